@@ -5,14 +5,116 @@ import abc
 import asyncio
 import contextvars
 import functools
-from typing import List, Sequence, Union, Dict
+import time
+from dataclasses import dataclass
+from typing import (
+    List,
+    Sequence,
+    Union,
+    Dict,
+    Optional,
+    Callable,
+    AsyncIterator,
+    Awaitable,
+)
 
 from tqdm.asyncio import tqdm_asyncio
 
+from crispo.llms.cache import GenerationCache
+from crispo.llms.concurrency import AdaptiveConcurrencyLimiter
+from crispo.llms.hedging import RequestHedger
+from crispo.llms.rate_limit import RateLimiter, estimate_num_tokens
+from crispo.llms.scheduler import PriorityScheduler
+from crispo.utilities.async_util import run_until_complete
+from crispo.utilities.prompt_util import extract_xml_tag
+
 TYPE_PROMPT = Union[str, List[Dict]]
 
 
+class FailedGeneration(str):
+    """
+    An empty generation standing in for a request that failed, so a batch can still be parsed and scored.
+    """
+
+    def __new__(cls, error: BaseException):
+        return str.__new__(cls, "")
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class PrefixedPrompt(str):
+    """
+    A prompt starting with a ``prefix`` shared by many requests, e.g., the instructions of a task prompt. Backends
+    supporting prompt caching cache the prefix server-side, the others see a plain string.
+    """
+
+    def __new__(cls, prompt: str, prefix: str):
+        return str.__new__(cls, prompt)
+
+    def __init__(self, prompt: str, prefix: str):
+        assert prompt.startswith(prefix), "The prefix must start the prompt"
+        self.prefix = prefix
+
+    def __getnewargs__(self):
+        return str(self), self.prefix
+
+
+def truncate_at_stop_sequences(generation: str, stop_sequences: Sequence[str]) -> str:
+    """
+    Cut a completion before the first occurrence of any of the stop sequences, like servers do.
+    """
+    positions = [generation.find(stop) for stop in stop_sequences if stop]
+    positions = [position for position in positions if position >= 0]
+    return generation[: min(positions)] if positions else generation
+
+
+# Errors of the client rather than the service, which fail the same way when retried
+NON_RETRYABLE_ERROR_CODES = {
+    "ValidationException",
+    "AccessDeniedException",
+    "ResourceNotFoundException",
+    "UnrecognizedClientException",
+}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether a failed request may succeed when sent again. Rejected requests are not, i.e., Bedrock client errors with
+    one of ``NON_RETRYABLE_ERROR_CODES`` and HTTP 4xx statuses other than 408 and 429.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and "Error" in response:
+        # botocore.exceptions.ClientError
+        return response["Error"].get("Code") not in NON_RETRYABLE_ERROR_CODES
+    status = getattr(error, "status", None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return status in (408, 429)
+    return True
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How ``batch_generate`` resubmits the prompts that failed.
+
+    Args:
+        max_retries: The maximum number of extra rounds over the failed prompts.
+        delay: The number of seconds to wait before each round.
+        retryable: Whether an error is worth retrying, ``is_retryable`` by default.
+    """
+
+    max_retries: int = 2
+    delay: float = 1.0
+    retryable: Callable[[BaseException], bool] = is_retryable
+
+
 class LargeLanguageModel(abc.ABC):
+    # Whether ``generate`` and ``agenerate`` accept per-request ``stop_sequences``
+    supports_stop_sequences = False
+    # Whether ``agenerate_n`` samples several completions in one request
+    supports_n = False
+
     def __init__(
         self,
         max_new_tokens: int = 2048,
@@ -21,6 +123,7 @@ class LargeLanguageModel(abc.ABC):
         top_k: int = 1,
         concurrency: int = 16,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         """
         A blackbox Large Language Model.
@@ -29,7 +132,16 @@ class LargeLanguageModel(abc.ABC):
             max_new_tokens: The maximum number of tokens to sample.
             temperature: Sampling temperature.
             concurrency: The number of concurrent requests allowed per process (worker).
+            cache: An optional on-disk cache of generations, consulted by ``generate_async`` and ``batch_generate``.
+
+        Set ``streaming`` to stream generations and cancel them early once the tag a caller parses has closed.
         """
+        self.model_name = None
+        self.cache = cache
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.hedger: Optional[RequestHedger] = None
+        self.streaming = False
+        self.first_token_latencies: List[float] = []
         self.stop_sequences = stop_sequences
         self.top_k = top_k
         self.top_p = top_p
@@ -47,6 +159,107 @@ class LargeLanguageModel(abc.ABC):
         self._concurrency = concurrency
         self.lock = asyncio.Semaphore(concurrency)
 
+    def use_adaptive_concurrency(self, maximum: Optional[int] = None, **kwargs):
+        """
+        Replace the fixed semaphore with an AIMD limiter shared by all LLMs targeting the same model, starting from
+        the current ``concurrency``.
+
+        Args:
+            maximum: The upper bound of concurrent requests, 256 by default.
+            **kwargs: Other arguments passed to ``AdaptiveConcurrencyLimiter``.
+
+        Returns:
+            This LLM.
+
+        Raises:
+            ValueError: If the limiter of the model is already shared with other arguments.
+        """
+        self.lock = AdaptiveConcurrencyLimiter.for_model(
+            self.model_name or self.__class__.__name__,
+            defaults=dict(initial=self.concurrency, maximum=256),
+            maximum=maximum,
+            **kwargs,
+        )
+        return self
+
+    def use_scheduler(self, concurrency: Optional[int] = None):
+        """
+        Replace the semaphore of this LLM with a scheduler shared by all LLMs targeting the same model, e.g., the task
+        and meta LLMs, which caps their total concurrency and serves waiting requests by priority. Requests are
+        prioritized with ``crispo.llms.scheduler.request_priority``.
+
+        Args:
+            concurrency: The maximum number of concurrent requests to the model, defaults to the ``concurrency`` of
+                the first LLM creating the scheduler.
+
+        Returns:
+            This LLM.
+
+        Raises:
+            ValueError: If the scheduler of the model is already shared with another ``concurrency``.
+        """
+        self.lock = PriorityScheduler.for_model(
+            self.model_name or self.__class__.__name__,
+            defaults=dict(concurrency=self.concurrency),
+            concurrency=concurrency,
+        )
+        return self
+
+    def use_rate_limit(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        """
+        Pace requests with token buckets shared by all LLMs targeting the same model. Each request reserves its
+        estimated input tokens plus ``max_new_tokens`` before it is sent.
+
+        Args:
+            requests_per_minute: The RPM quota of the model, unlimited if not given when the limiter is created.
+            tokens_per_minute: The TPM quota of the model, unlimited if not given when the limiter is created.
+
+        Returns:
+            This LLM.
+
+        Raises:
+            ValueError: If the rate limiter of the model is already shared with other quotas.
+        """
+        self.rate_limiter = RateLimiter.for_model(
+            self.model_name or self.__class__.__name__,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        return self
+
+    def use_hedging(
+        self, quantile: float = 0.95, max_extra_load: float = 0.05, **kwargs
+    ):
+        """
+        Send a duplicate of a request once it has been in flight longer than the ``quantile`` of the recent latencies,
+        and keep the first response. Only requests at temperature 0 are hedged, since duplicates of sampled requests
+        would return different completions. Hedges take a concurrency slot and a rate limit reservation of their own.
+        The hedges fired and won are counted in ``hedger.stats``.
+
+        Args:
+            quantile: The quantile of the rolling latencies after which a request is hedged.
+            max_extra_load: The maximum number of hedges as a fraction of the requests.
+            **kwargs: Other arguments passed to ``RequestHedger``.
+
+        Returns:
+            This LLM.
+        """
+        self.hedger = RequestHedger(quantile, max_extra_load, **kwargs)
+        return self
+
+    @property
+    def caches_prefixes(self) -> bool:
+        """
+        Whether the backend caches the ``prefix`` of ``PrefixedPrompt`` prompts server-side. A cached prefix is only
+        read by the requests sent after a first response to it has started, so concurrent requests sharing a prefix
+        are held back until the first one has returned instead of each paying for writing the cache.
+        """
+        return False
+
     @abc.abstractmethod
     def generate(self, prompt: TYPE_PROMPT) -> str:
         """
@@ -60,29 +273,330 @@ class LargeLanguageModel(abc.ABC):
         """
         pass
 
-    async def generate_async(self, prompt: TYPE_PROMPT) -> str:
+    async def agenerate(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        """
+        The non-blocking implementation of ``generate``. Backends with a native asynchronous transport override it,
+        otherwise the blocking ``generate`` runs in the default executor.
+
+        Args:
+            prompt: A prompt in Claude 2 format (https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-anthropic-claude-text-completion.html).
+            stop_sequences: Per-request stop sequences, only passed to backends with ``supports_stop_sequences``. The
+                completions of other backends are truncated at them instead.
+
+        Returns:
+            The completion.
+        """
+        loop = asyncio.events.get_running_loop()
+        ctx = contextvars.copy_context()
+        args = (prompt,) if stop_sequences is None else (prompt, stop_sequences)
+        func_call = functools.partial(ctx.run, self.generate, *args)
+        return await loop.run_in_executor(None, func_call)
+
+    async def stream_async(self, prompt: TYPE_PROMPT) -> AsyncIterator[str]:
+        """
+        Stream the completion as text chunks. Backends without a streaming transport yield the whole completion at
+        once.
+
+        Args:
+            prompt: A prompt in Claude 2 format (https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-anthropic-claude-text-completion.html).
+
+        Returns:
+            An asynchronous iterator of text chunks.
+        """
+        yield await self.agenerate(prompt)
+
+    async def agenerate_until(self, prompt: TYPE_PROMPT, stop_tag: str) -> str:
+        """
+        Stream the completion and cancel it as soon as the ``stop_tag`` XML tag has been closed with some content in
+        it. The time to first token is appended to ``first_token_latencies``.
+
+        Args:
+            prompt: A prompt in Claude 2 format (https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-anthropic-claude-text-completion.html).
+            stop_tag: The XML tag to wait for, e.g., ``summary``.
+
+        Returns:
+            The completion up to the closing tag.
+        """
+        closing_tag = f"</{stop_tag}>"
+        start = time.perf_counter()
+        text = ""
+        stream = self.stream_async(prompt)
+        try:
+            async for chunk in stream:
+                if not text:
+                    self.first_token_latencies.append(time.perf_counter() - start)
+                text += chunk
+                if closing_tag in text[-len(chunk) - len(closing_tag) :]:
+                    if extract_xml_tag(text, stop_tag):
+                        text = text[: text.rindex(closing_tag) + len(closing_tag)]
+                        break
+        finally:
+            await stream.aclose()
+        return text.lstrip()
+
+    def request_stop_sequences(
+        self, stop_tag: Optional[str] = None, stop_sequences: Sequence[str] = None
+    ) -> Sequence[str]:
+        """
+        The stop sequences in effect for a request which parses ``stop_tag``. The closing tag becomes a stop sequence
+        when the backend supports per-request stop sequences or streaming is enabled.
+        """
+        if stop_sequences is None:
+            stop_sequences = self.stop_sequences
+        if stop_tag and (self.streaming or self.supports_stop_sequences):
+            stop_sequences = [*stop_sequences, f"</{stop_tag}>"]
+        return stop_sequences
+
+    async def generate_async(
+        self,
+        prompt: TYPE_PROMPT,
+        stop_tag: Optional[str] = None,
+        stop_sequences: Sequence[str] = None,
+    ) -> str:
         """
         Asynchronous API call to the LLM for a completion
 
         Args:
             prompt: A prompt in Claude 2 format (https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-anthropic-claude-text-completion.html).
+            stop_tag: The XML tag the caller parses from the completion. The generation stops once it is closed.
+            stop_sequences: Per-request stop sequences overriding ``self.stop_sequences``.
 
         Returns:
             The completion future event.
         """
-        async with self.lock:
-            loop = asyncio.events.get_running_loop()
-            ctx = contextvars.copy_context()
-            func_call = functools.partial(ctx.run, self.generate, prompt)
-            return await loop.run_in_executor(None, func_call)
+        stop_sequences = self.request_stop_sequences(stop_tag, stop_sequences)
+        if self.cache is not None:
+            generation = await self.cache.aget(self, prompt, stop_sequences)
+            if generation is not None:
+                return generation
+        if self.rate_limiter is None:
+            async with self.lock:
+                generation = await self.agenerate_with(prompt, stop_tag, stop_sequences)
+        else:
+            generation = await self.rate_limited(
+                prompt,
+                estimate_num_tokens(prompt) + (self.max_new_tokens or 0),
+                functools.partial(
+                    self.agenerate_with, prompt, stop_tag, stop_sequences
+                ),
+            )
+        if self.cache is not None:
+            await self.cache.aput(self, prompt, generation, stop_sequences)
+        return generation
 
-    def batch_generate(
-        self, prompts: List[TYPE_PROMPT], desc="Generating"
+    async def agenerate_with(
+        self,
+        prompt: TYPE_PROMPT,
+        stop_tag: Optional[str] = None,
+        stop_sequences: Sequence[str] = None,
+    ) -> str:
+        call = functools.partial(self.agenerate_once, prompt, stop_tag, stop_sequences)
+        if self.hedger is not None and not self.temperature:
+            return await self.hedger.run(
+                call, functools.partial(self.ahedge, prompt, call)
+            )
+        return await call()
+
+    async def ahedge(
+        self, prompt: TYPE_PROMPT, call: Callable[[], Awaitable[str]]
+    ) -> str:
+        """
+        The duplicate of a slow request. It takes its own concurrency slot and rate limit reservation, since it adds
+        to the load of the model like any other request.
+        """
+        if self.rate_limiter is None:
+            async with self.lock:
+                return await call()
+        return await self.rate_limited(
+            prompt, estimate_num_tokens(prompt) + (self.max_new_tokens or 0), call
+        )
+
+    async def agenerate_once(
+        self,
+        prompt: TYPE_PROMPT,
+        stop_tag: Optional[str] = None,
+        stop_sequences: Sequence[str] = None,
+    ) -> str:
+        if stop_tag and self.streaming:
+            return await self.agenerate_until(prompt, stop_tag)
+        if stop_sequences is None or list(stop_sequences) == list(self.stop_sequences):
+            return await self.agenerate(prompt)
+        if self.supports_stop_sequences:
+            return await self.agenerate(prompt, stop_sequences)
+        # Other backends only take their own stop sequences, the override is applied to the completion
+        return truncate_at_stop_sequences(await self.agenerate(prompt), stop_sequences)
+
+    async def agenerate_n(self, prompt: TYPE_PROMPT, n: int) -> List[str]:
+        """
+        Sample ``n`` completions of the same prompt in one request, for backends with ``supports_n``.
+        """
+        raise NotImplementedError()
+
+    async def agenerate_samples(self, prompt: TYPE_PROMPT, n: int) -> List[str]:
+        """
+        Sample ``n`` completions of the same prompt, in one request holding one concurrency slot if the backend
+        ``supports_n``, otherwise with ``n`` concurrent ``generate_async`` calls.
+
+        Args:
+            prompt: A prompt in Claude 2 format (https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-anthropic-claude-text-completion.html).
+            n: The number of completions.
+
+        Returns:
+            The completions.
+        """
+        if not self.supports_n or n == 1:
+            generations = []
+            if n > 1 and self.caches_prefixes and isinstance(prompt, PrefixedPrompt):
+                # The first request writes the cached prefix the others read
+                generations.append(await self.generate_async(prompt))
+            generations.extend(
+                await asyncio.gather(
+                    *[self.generate_async(prompt) for _ in range(n - len(generations))]
+                )
+            )
+            return generations
+        if self.rate_limiter is None:
+            async with self.lock:
+                return await self.agenerate_n(prompt, n)
+        return await self.rate_limited(
+            prompt,
+            estimate_num_tokens(prompt) + n * (self.max_new_tokens or 0),
+            functools.partial(self.agenerate_n, prompt, n),
+        )
+
+    async def rate_limited(
+        self,
+        prompt: TYPE_PROMPT,
+        reserved_tokens: int,
+        call: Callable[[], Awaitable[Union[str, List[str]]]],
+    ) -> Union[str, List[str]]:
+        """
+        Await ``call()`` once the rate limiter has granted ``reserved_tokens`` and a concurrency slot is free. The
+        unused part of the reservation is refunded, all of it if the call fails.
+        """
+        await self.rate_limiter.acquire(reserved_tokens)
+        result, network_time = None, 0.0
+        try:
+            async with self.lock:
+                start = time.perf_counter()
+                try:
+                    result = await call()
+                finally:
+                    network_time = time.perf_counter() - start
+        finally:
+            used_tokens = (
+                0
+                if result is None
+                else estimate_num_tokens(prompt) + estimate_num_tokens(result)
+            )
+            self.rate_limiter.release(reserved_tokens, used_tokens, network_time)
+        return result
+
+    async def abatch_generate(
+        self,
+        prompts: List[TYPE_PROMPT],
+        desc="Generating",
+        return_exceptions: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        stop_tag: Union[None, str, Sequence[Optional[str]]] = None,
+        stop_sequences: Sequence[str] = None,
     ) -> List[str]:
-        async def fire(_tasks):
-            return await tqdm_asyncio.gather(*_tasks, desc=desc, disable=not desc)
+        """
+        Generate completions for a batch of prompts concurrently on the running event loop. Completed generations are
+        kept when some prompts fail, and only the failed ones are resubmitted.
 
-        tasks = [self.generate_async(prompt) for prompt in prompts]
+        Args:
+            prompts: The prompts.
+            desc: The description of the progress bar, ``None`` to disable it.
+            return_exceptions: Return a ``FailedGeneration`` placeholder for each prompt that still fails after
+                retries instead of raising its error.
+            retry_policy: How failed prompts are retried, no retry by default.
+            stop_tag: The XML tag the caller parses from each completion, or one tag per prompt. See
+                ``generate_async``.
+            stop_sequences: Per-request stop sequences overriding ``self.stop_sequences``.
+
+        Returns:
+            The completions, in the same order as the prompts.
+        """
+        if stop_tag is None or isinstance(stop_tag, str):
+            stop_tags = [stop_tag] * len(prompts)
+        else:
+            stop_tags = list(stop_tag)
+            assert len(stop_tags) == len(prompts), "Expect one stop tag per prompt"
+
+        # The first request of each cached prefix, which the other requests sharing it wait for
+        warming: Dict[str, asyncio.Event] = dict()
+
+        async def capture(prompt, tag):
+            warmed = None
+            if self.caches_prefixes and isinstance(prompt, PrefixedPrompt):
+                if prompt.prefix in warming:
+                    await warming[prompt.prefix].wait()
+                else:
+                    warmed = warming[prompt.prefix] = asyncio.Event()
+            try:
+                return await self.generate_async(prompt, tag, stop_sequences)
+            except Exception as e:
+                return FailedGeneration(e)
+            finally:
+                if warmed is not None:
+                    warmed.set()
+
+        async def fire(indices, _desc):
+            _tasks = [capture(prompts[i], stop_tags[i]) for i in indices]
+            return await tqdm_asyncio.gather(*_tasks, desc=_desc, disable=not _desc)
+
+        generations = await fire(range(len(prompts)), desc)
 
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(fire(tasks))
+        if retry_policy is not None:
+            for attempt in range(retry_policy.max_retries):
+                failed = [
+                    i
+                    for i, generation in enumerate(generations)
+                    if isinstance(generation, FailedGeneration)
+                    and retry_policy.retryable(generation.error)
+                ]
+                if not failed:
+                    break
+                if retry_policy.delay:
+                    await asyncio.sleep(retry_policy.delay)
+                retried = await fire(
+                    failed, f"{desc} (retry {attempt + 1})" if desc else None
+                )
+                for i, generation in zip(failed, retried):
+                    generations[i] = generation
+
+        if self.cache is not None:
+            # So that the next run finds the generations of this batch
+            await self.cache.aflush()
+
+        if not return_exceptions:
+            for generation in generations:
+                if isinstance(generation, FailedGeneration):
+                    raise generation.error
+        return generations
+
+    def batch_generate(
+        self,
+        prompts: List[TYPE_PROMPT],
+        desc="Generating",
+        return_exceptions: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        stop_tag: Union[None, str, Sequence[Optional[str]]] = None,
+        stop_sequences: Sequence[str] = None,
+    ) -> List[str]:
+        """
+        The blocking version of ``abatch_generate``.
+        """
+        return run_until_complete(
+            self.abatch_generate(
+                prompts,
+                desc=desc,
+                return_exceptions=return_exceptions,
+                retry_policy=retry_policy,
+                stop_tag=stop_tag,
+                stop_sequences=stop_sequences,
+            )
+        )
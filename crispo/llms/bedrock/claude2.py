@@ -1,14 +1,17 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
-from typing import Sequence
+from typing import Sequence, AsyncIterator, Optional
 
 from crispo.llms.bedrock.wrapper import BedrockWrapper
 
 from crispo.llms import LargeLanguageModel, TYPE_PROMPT
+from crispo.llms.cache import GenerationCache
 
 
 class ClaudeInstant(LargeLanguageModel):
+    supports_stop_sequences = True
+
     def __init__(
         self,
         model_name: str = "anthropic.claude-instant-v1",
@@ -18,26 +21,55 @@ class ClaudeInstant(LargeLanguageModel):
         top_k: int = 1,
         concurrency: int = 16,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         super().__init__(
-            max_new_tokens, temperature, top_p, top_k, concurrency, stop_sequences
+            max_new_tokens,
+            temperature,
+            top_p,
+            top_k,
+            concurrency,
+            stop_sequences,
+            cache=cache,
         )
+        self.model_name = model_name
         self.client = BedrockWrapper(
             model_name=model_name,
             max_new_tokens=max_new_tokens,
             temperature=temperature,
             top_p=top_p,
             top_k=top_k,
+            max_pool_connections=concurrency,
             stop_sequences=stop_sequences,
         )
 
-    def generate(self, prompt: TYPE_PROMPT) -> str:
+    @staticmethod
+    def format_prompt(prompt: TYPE_PROMPT) -> TYPE_PROMPT:
         if isinstance(prompt, str):
             if not prompt.startswith("\n\nHuman: "):
                 prompt = "\n\nHuman: " + prompt
             if not prompt.endswith("\n\nAssistant: "):
                 prompt += "\n\nAssistant: "
-        generation: str = self.client.generate(prompt)
+        return prompt
+
+    def generate(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        generation: str = self.client.generate(
+            self.format_prompt(prompt), stop_sequences
+        )
+        generation = generation.lstrip()
+        return generation
+
+    def stream_async(self, prompt: TYPE_PROMPT) -> AsyncIterator[str]:
+        return self.client.stream_async(self.format_prompt(prompt))
+
+    async def agenerate(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        generation: str = await self.client.generate_async(
+            self.format_prompt(prompt), stop_sequences
+        )
         generation = generation.lstrip()
         return generation
 
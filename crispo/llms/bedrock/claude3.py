@@ -2,10 +2,11 @@
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
 import os
-from typing import Union, List, Dict, Sequence
+from typing import Union, List, Dict, Sequence, AsyncIterator, Optional
 
-from crispo.llms import LargeLanguageModel, TYPE_PROMPT
+from crispo.llms import LargeLanguageModel, TYPE_PROMPT, PrefixedPrompt
 from crispo.llms.bedrock.wrapper import BedrockWrapper
+from crispo.llms.cache import GenerationCache
 
 
 class BedrockClaude3(BedrockWrapper):
@@ -36,6 +37,7 @@ class BedrockClaude3(BedrockWrapper):
             max_pool_connections,
             stop_sequences,
         )
+        self.prompt_caching = False
 
     def build_payload(
         self,
@@ -44,18 +46,23 @@ class BedrockClaude3(BedrockWrapper):
         temperature: float,
         top_p: float,
         top_k: int,
+        stop_sequences: Sequence[str] = None,
     ):
+        if isinstance(prompt, str):
+            messages = self.get_input_msg_claude3(prompt)
+            if self.prompt_caching and isinstance(prompt, PrefixedPrompt):
+                self.mark_cache_breakpoint(messages[0], prompt)
+        else:
+            messages = prompt
         return {
-            "messages": (
-                self.get_input_msg_claude3(prompt)
-                if isinstance(prompt, str)
-                else prompt
-            ),
+            "messages": messages,
             "max_tokens": max_new_tokens,
             "temperature": temperature,
             "top_p": top_p,
             "top_k": top_k,
-            "stop_sequences": self.stop_sequences,
+            "stop_sequences": (
+                self.stop_sequences if stop_sequences is None else list(stop_sequences)
+            ),
             "anthropic_version": "bedrock-2023-05-31",
         }
 
@@ -72,12 +79,49 @@ class BedrockClaude3(BedrockWrapper):
             input_msg.append({"role": "assistant", "content": assistant_part})
         return input_msg
 
+    @staticmethod
+    def mark_cache_breakpoint(message: dict, prompt: PrefixedPrompt):
+        """
+        Split the content of the user message after the static prefix of the prompt and mark the prefix with a cache
+        control breakpoint, so Bedrock reads it from the prompt cache in subsequent requests sharing it.
+        """
+        text = message["content"]
+        # The prefix is counted from the start of the prompt, which may have been stripped
+        split = len(prompt.prefix) - prompt.index(text)
+        if split <= 0:
+            return
+        content = [
+            {
+                "type": "text",
+                "text": text[:split],
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+        if text[split:]:
+            content.append({"type": "text", "text": text[split:]})
+        message["content"] = content
+
     def parse_response(self, response: dict) -> str:
         content = response["content"]
         return content[0]["text"] if content else ""
 
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        if chunk.get("type") == "content_block_delta":
+            return chunk["delta"].get("text", "")
+        if chunk.get("type") == "message_start":
+            self.record_usage(chunk["message"].get("usage"))
+        elif chunk.get("type") == "message_delta":
+            self.record_usage(chunk.get("usage"))
+        return ""
+
+    def parse_stop_sequence(self, response: dict) -> Optional[str]:
+        if response.get("stop_reason") == "stop_sequence":
+            return response.get("stop_sequence")
+
 
 class Claude3(LargeLanguageModel):
+    supports_stop_sequences = True
+
     def __init__(
         self,
         model_name: str,
@@ -87,21 +131,62 @@ class Claude3(LargeLanguageModel):
         top_k: int = 1,
         concurrency: int = 16,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         super().__init__(
-            max_new_tokens, temperature, top_p, top_k, concurrency, stop_sequences
+            max_new_tokens,
+            temperature,
+            top_p,
+            top_k,
+            concurrency,
+            stop_sequences,
+            cache=cache,
         )
+        self.model_name = model_name
         self.client = BedrockClaude3(
             model_name=model_name,
             max_new_tokens=max_new_tokens,
             temperature=temperature,
             top_p=top_p,
             top_k=top_k,
+            max_pool_connections=concurrency,
             stop_sequences=stop_sequences,
         )
 
-    def generate(self, prompt: TYPE_PROMPT) -> str:
-        generation: str = self.client.generate(prompt)
+    def use_prompt_caching(self, enabled: bool = True) -> "Claude3":
+        """
+        Cache the static prefix of ``PrefixedPrompt`` prompts on Bedrock. The models only cache prefixes longer than
+        a minimum number of tokens (1024 for Sonnet, 2048 for Haiku); shorter ones are processed as usual.
+        """
+        self.client.prompt_caching = enabled
+        return self
+
+    @property
+    def caches_prefixes(self) -> bool:
+        return self.client.prompt_caching
+
+    @property
+    def usage(self) -> dict:
+        """
+        The accumulated token usage, including ``cache_creation_input_tokens`` and ``cache_read_input_tokens`` when
+        prompt caching is used.
+        """
+        return dict(self.client.usage)
+
+    def generate(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        generation: str = self.client.generate(prompt, stop_sequences)
+        generation = generation.lstrip()
+        return generation
+
+    def stream_async(self, prompt: TYPE_PROMPT) -> AsyncIterator[str]:
+        return self.client.stream_async(prompt)
+
+    async def agenerate(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        generation: str = await self.client.generate_async(prompt, stop_sequences)
         generation = generation.lstrip()
         return generation
 
@@ -117,6 +202,7 @@ class ClaudeSonnet(Claude3):
         top_k: int = 1,
         concurrency: int = 8,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         super().__init__(
             model_name,
@@ -126,6 +212,7 @@ class ClaudeSonnet(Claude3):
             top_k,
             concurrency,
             stop_sequences,
+            cache=cache,
         )
 
 
@@ -140,6 +227,7 @@ class ClaudeSonnet35(Claude3):
         top_k: int = 1,
         concurrency: int = 8,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         super().__init__(
             model_name,
@@ -149,6 +237,7 @@ class ClaudeSonnet35(Claude3):
             top_k,
             concurrency,
             stop_sequences,
+            cache=cache,
         )
 
 
@@ -163,6 +252,7 @@ class ClaudeHaiku(Claude3):
         top_k: int = 1,
         concurrency: int = 16,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         super().__init__(
             model_name,
@@ -172,6 +262,7 @@ class ClaudeHaiku(Claude3):
             top_k,
             concurrency,
             stop_sequences,
+            cache=cache,
         )
 
 
@@ -186,6 +277,7 @@ class ClaudeHaiku35(Claude3):
         top_k: int = 1,
         concurrency: int = 16,
         stop_sequences: Sequence[str] = (),
+        cache: Optional[GenerationCache] = None,
     ) -> None:
         super().__init__(
             model_name,
@@ -195,6 +287,7 @@ class ClaudeHaiku35(Claude3):
             top_k,
             concurrency,
             stop_sequences,
+            cache=cache,
         )
 
 
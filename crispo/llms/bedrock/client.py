@@ -0,0 +1,176 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import (
+    CredentialProvider,
+    CredentialResolver,
+    InstanceMetadataProvider,
+    ReadOnlyCredentials,
+)
+from botocore.utils import InstanceMetadataFetcher
+
+EXPIRED_TOKEN_DELAY = 60
+REFRESH_INTERVAL = 60
+
+
+class SharedBedrockClient:
+    _registry: Dict[Tuple, "SharedBedrockClient"] = dict()
+    _registry_lock = threading.Lock()
+
+    def __init__(
+        self,
+        aws_profile: Optional[str],
+        region_name: str,
+        endpoint_url: str,
+        refresh_interval: float = REFRESH_INTERVAL,
+    ) -> None:
+        """
+        A boto3 ``bedrock-runtime`` client shared by all wrappers targeting the same profile, region and endpoint.
+        Credentials are loaded once, on first use, and kept refreshable: a daemon thread rotates temporary credentials
+        before they expire, so requests never wait for a refresh. The connection pool is sized to the sum of the
+        concurrency of the wrappers sharing the client.
+
+        Args:
+            aws_profile: The AWS profile, or ``None`` for the credentials of the instance.
+            region_name: The AWS region.
+            endpoint_url: The Bedrock runtime endpoint.
+            refresh_interval: The number of seconds between two checks of the background refresh. Refreshable
+                credentials are rotated once they expire within 15 minutes.
+        """
+        self.aws_profile = aws_profile
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.refresh_interval = refresh_interval
+        self.max_pool_connections = 0
+        self.max_retries = 0
+        self.session: Optional[boto3.Session] = None
+        self._client = None
+        self._renewed_at = -EXPIRED_TOKEN_DELAY
+        self._lock = threading.RLock()
+        self._refresher: Optional[threading.Thread] = None
+
+    @classmethod
+    def acquire(
+        cls,
+        aws_profile: Optional[str],
+        region_name: str,
+        endpoint_url: str,
+        max_pool_connections: int,
+        max_retries: int,
+    ) -> "SharedBedrockClient":
+        """
+        Get the client shared for ``(aws_profile, region_name, endpoint_url)``, creating it on the first call, and
+        grow its connection pool by ``max_pool_connections``.
+        """
+        key = (aws_profile, region_name, endpoint_url)
+        with cls._registry_lock:
+            shared = cls._registry.get(key)
+            if shared is None:
+                shared = cls._registry[key] = cls(*key)
+        with shared._lock:
+            shared.max_pool_connections += max_pool_connections
+            shared.max_retries = max(shared.max_retries, max_retries)
+            # Rebuilt with the larger pool on next use
+            shared._client = None
+        return shared
+
+    @staticmethod
+    def credential_provider() -> CredentialProvider:
+        return InstanceMetadataProvider(
+            iam_role_fetcher=InstanceMetadataFetcher(timeout=10, num_attempts=3)
+        )
+
+    def build_session(self) -> boto3.Session:
+        if self.aws_profile:
+            return boto3.Session(profile_name=self.aws_profile)
+        session = botocore.session.get_session()
+        session.register_component(
+            "credential_provider", CredentialResolver([self.credential_provider()])
+        )
+        return boto3.Session(botocore_session=session)
+
+    def build_config(self, config_cls=Config, max_pool_connections: int = None):
+        return config_cls(
+            read_timeout=120,
+            connect_timeout=120,
+            max_pool_connections=max_pool_connections or self.max_pool_connections,
+            retries={
+                "max_attempts": self.max_retries,
+            },
+        )
+
+    @property
+    def credentials(self):
+        with self._lock:
+            if self.session is None:
+                self.session = self.build_session()
+                self.start_refresher()
+            return self.session.get_credentials()
+
+    def frozen_credentials(self) -> ReadOnlyCredentials:
+        """
+        The current access key, secret key and token, refreshed first if they are about to expire.
+        """
+        return self.credentials.get_frozen_credentials()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self.credentials
+                self._client = self.session.client(
+                    "bedrock-runtime",
+                    self.region_name,
+                    endpoint_url=self.endpoint_url,
+                    config=self.build_config(),
+                )
+            return self._client
+
+    def start_refresher(self):
+        if self._refresher is not None:
+            return
+        if not hasattr(self.session.get_credentials(), "refresh_needed"):
+            # Static credentials cannot be rotated
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_periodically,
+            name=f"bedrock-credentials-{self.aws_profile or 'instance'}",
+            daemon=True,
+        )
+        self._refresher.start()
+
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.frozen_credentials()
+            except Exception as e:
+                # The credentials are refreshed again on use, surfacing the error there
+                print(f"Failed to refresh the Bedrock credentials: {e}")
+
+    def renew(self, expired: ReadOnlyCredentials):
+        """
+        Reload the credentials after Bedrock rejected ``expired``. Only the first of the concurrent callers reloads
+        them, the others return as soon as it is done. If freshly loaded credentials expire again, the reload waits
+        ``EXPIRED_TOKEN_DELAY`` seconds for the user to update them.
+        """
+        with self._lock:
+            if self.session is not None and self.frozen_credentials() != expired:
+                # Rotated in the meantime
+                return
+            delay = EXPIRED_TOKEN_DELAY - (time.monotonic() - self._renewed_at)
+            if delay > 0:
+                print(
+                    f"Please update the credentials. Bedrock will retry in {delay:.0f} seconds."
+                )
+                time.sleep(delay)
+            self.session = self._client = None
+            self.credentials
+            self._renewed_at = time.monotonic()
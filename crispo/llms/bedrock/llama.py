@@ -3,9 +3,11 @@
 
 import logging
 import traceback
+from typing import AsyncIterator, Optional, Sequence
 
 from crispo.llms import LargeLanguageModel, TYPE_PROMPT
-from crispo.llms.bedrock.wrapper import BedrockWrapper
+from crispo.llms.bedrock.wrapper import BedrockWrapper, is_context_length_error
+from crispo.llms.cache import GenerationCache
 
 
 class LlamaWrapper(BedrockWrapper):
@@ -17,6 +19,7 @@ class LlamaWrapper(BedrockWrapper):
         temperature: float,
         top_p: float,
         top_k: int,
+        stop_sequences: Sequence[str] = None,
     ):
         return {
             "prompt": f"<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n{prompt}<|eot_id|>"
@@ -28,18 +31,51 @@ class LlamaWrapper(BedrockWrapper):
     def parse_response(self, response: dict) -> str:
         return response["generation"]
 
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        return chunk.get("generation") or ""
+
 
 class BedrockLlama(LargeLanguageModel):
-    def __init__(self, max_new_tokens: int = None, temperature: float = None) -> None:
-        super().__init__(max_new_tokens, temperature)
-        self.inferencer = LlamaWrapper("meta.llama3-8b-instruct-v1:0")
+    def __init__(
+        self,
+        max_new_tokens: int = None,
+        temperature: float = None,
+        cache: Optional[GenerationCache] = None,
+    ) -> None:
+        super().__init__(max_new_tokens, temperature, cache=cache)
+        self.model_name = "meta.llama3-8b-instruct-v1:0"
+        self.inferencer = LlamaWrapper(self.model_name)
 
     def generate(self, prompt: TYPE_PROMPT) -> str:
         if not prompt:
             return ""
         try:
             generation: str = self.inferencer.generate(prompt)
-        except:
+        except Exception as e:
+            # As in agenerate, only context length errors are turned into empty generations
+            if not is_context_length_error(e):
+                raise
+            traceback.print_exc()
+            logging.warning("LLAMA max context length error.")
+            return ""
+
+        if not isinstance(generation, str):
+            return ""
+        generation = generation.lstrip()
+        return generation
+
+    def stream_async(self, prompt: TYPE_PROMPT) -> AsyncIterator[str]:
+        return self.inferencer.stream_async(prompt)
+
+    async def agenerate(self, prompt: TYPE_PROMPT) -> str:
+        if not prompt:
+            return ""
+        try:
+            generation: str = await self.inferencer.generate_async(prompt)
+        except Exception as e:
+            # Cancellations and other errors reach the caller and its retry policy
+            if not is_context_length_error(e):
+                raise
             traceback.print_exc()
             logging.warning("LLAMA max context length error.")
             return ""
@@ -3,9 +3,11 @@
 
 import logging
 import traceback
+from typing import AsyncIterator, Optional, Sequence
 
 from crispo.llms import LargeLanguageModel, TYPE_PROMPT
-from crispo.llms.bedrock.wrapper import BedrockWrapper
+from crispo.llms.bedrock.wrapper import BedrockWrapper, is_context_length_error
+from crispo.llms.cache import GenerationCache
 
 
 class MistralWrapper(BedrockWrapper):
@@ -17,6 +19,7 @@ class MistralWrapper(BedrockWrapper):
         temperature: float,
         top_p: float,
         top_k: int,
+        stop_sequences: Sequence[str] = None,
     ):
         return {
             "prompt": f"<s>[INST] {prompt}\n[/INST]",
@@ -27,20 +30,54 @@ class MistralWrapper(BedrockWrapper):
     def parse_response(self, response: dict) -> str:
         return response["outputs"][0]["text"].lstrip()
 
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        outputs = chunk.get("outputs")
+        return outputs[0]["text"] if outputs else ""
+
 
 class BedrockMistral(LargeLanguageModel):
-    def __init__(self, max_new_tokens: int = None, temperature: float = None) -> None:
-        super().__init__(max_new_tokens, temperature)
-        self.inferencer = MistralWrapper("mistral.mistral-7b-instruct-v0:2")
+    def __init__(
+        self,
+        max_new_tokens: int = None,
+        temperature: float = None,
+        cache: Optional[GenerationCache] = None,
+    ) -> None:
+        super().__init__(max_new_tokens, temperature, cache=cache)
+        self.model_name = "mistral.mistral-7b-instruct-v0:2"
+        self.inferencer = MistralWrapper(self.model_name)
 
     def generate(self, prompt: TYPE_PROMPT) -> str:
         if not prompt:
             return ""
         try:
             generation: str = self.inferencer.generate(prompt)
-        except:
+        except Exception as e:
+            # As in agenerate, only context length errors are turned into empty generations
+            if not is_context_length_error(e):
+                raise
+            traceback.print_exc()
+            logging.warning("Mistral max context length error.")
+            return ""
+
+        if not isinstance(generation, str):
+            return ""
+        generation = generation.lstrip()
+        return generation
+
+    def stream_async(self, prompt: TYPE_PROMPT) -> AsyncIterator[str]:
+        return self.inferencer.stream_async(prompt)
+
+    async def agenerate(self, prompt: TYPE_PROMPT) -> str:
+        if not prompt:
+            return ""
+        try:
+            generation: str = await self.inferencer.generate_async(prompt)
+        except Exception as e:
+            # Cancellations and other errors reach the caller and its retry policy
+            if not is_context_length_error(e):
+                raise
             traceback.print_exc()
-            logging.warning("Mistral error.")
+            logging.warning("Mistral max context length error.")
             return ""
 
         if not isinstance(generation, str):
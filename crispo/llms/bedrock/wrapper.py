@@ -1,20 +1,59 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
+import asyncio
 import json
 import os
+import re
+import threading
+from collections import Counter
 from time import sleep
-from typing import Sequence
+from typing import Sequence, AsyncIterator, Optional
 
-import boto3
 import botocore
 from botocore.config import Config
 import botocore.errorfactory
 import botocore.exceptions
-from botocore.credentials import InstanceMetadataProvider
-from botocore.utils import InstanceMetadataFetcher
 
 from crispo.llms import TYPE_PROMPT
+from crispo.llms.bedrock.client import SharedBedrockClient
+from crispo.llms.concurrency import AdaptiveConcurrencyLimiter
+from crispo.utilities.async_util import run_on_loop
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import AioSession
+except ImportError:
+    AioConfig = AioSession = None
+
+REGION_NAME = "us-west-2"
+ENDPOINT_URL = "https://bedrock-runtime.us-west-2.amazonaws.com/"
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "ModelTimeoutException",
+    "ModelErrorException",
+    "ServiceUnavailableException",
+}
+CONGESTION_ERROR_CODES = {"ThrottlingException", "ModelTimeoutException"}
+CONNECTION_ERROR_DELAY = 3
+# The messages of the ValidationException Bedrock raises when a prompt does not fit in the context of the model
+CONTEXT_LENGTH_MESSAGE = re.compile(
+    r"(input|prompt) is too long|maximum context length|context window|"
+    r"prompt \+ max_gen_len|too many (input )?tokens",
+    re.IGNORECASE,
+)
+
+
+def is_context_length_error(error: BaseException) -> bool:
+    """
+    Whether Bedrock rejected a request because the prompt does not fit in the context of the model.
+    """
+    if not isinstance(error, botocore.exceptions.ClientError):
+        return False
+    details = error.response.get("Error", {})
+    return details.get("Code") == "ValidationException" and bool(
+        CONTEXT_LENGTH_MESSAGE.search(details.get("Message", ""))
+    )
 
 
 class BedrockWrapper:
@@ -43,36 +82,82 @@ class BedrockWrapper:
         self.aws_profile = aws_profile
         self.max_retries = max_retries
         self.max_pool_connections = max_pool_connections
-        self.bedrock = self.initialize_bedrock()
-
-    def initialize_bedrock(self):
-        if self.aws_profile:
-            session = boto3.Session(profile_name=self.aws_profile)
-        else:
-            credentials_provider = InstanceMetadataProvider(
-                iam_role_fetcher=InstanceMetadataFetcher(timeout=10, num_attempts=3)
-            )
-            boto3_credentials = credentials_provider.load().get_frozen_credentials()
-            session = boto3.Session(
-                aws_access_key_id=boto3_credentials.access_key,
-                aws_secret_access_key=boto3_credentials.secret_key,
-                aws_session_token=boto3_credentials.token,
-            )
-
-        config = Config(
-            read_timeout=120,
-            connect_timeout=120,
-            max_pool_connections=self.max_pool_connections,
-            retries={
-                "max_attempts": self.max_retries,
-            },
-        )
-        return session.client(
-            "bedrock-runtime",
-            "us-west-2",
-            endpoint_url="https://bedrock-runtime.us-west-2.amazonaws.com/",
-            config=config,
+        self.shared_client = SharedBedrockClient.acquire(
+            aws_profile, REGION_NAME, ENDPOINT_URL, max_pool_connections, max_retries
         )
+        self.async_bedrock = None
+        self._async_bedrock_context = None
+        self._async_bedrock_loop = None
+        self._async_bedrock_lock = None
+        self._async_credentials = None
+        self.usage = Counter()
+        self._usage_lock = threading.Lock()
+
+    @property
+    def bedrock(self):
+        return self.shared_client.client
+
+    def build_config(self, config_cls=Config):
+        return self.shared_client.build_config(config_cls, self.max_pool_connections)
+
+    async def initialize_bedrock_async(self):
+        """
+        Lazily create an aiobotocore client bound to the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_bedrock_loop is not loop:
+            # Clients and locks cannot be shared across event loops, the client of the previous one is closed there
+            previous_loop = self._async_bedrock_loop
+            context = self._async_bedrock_context
+            self.async_bedrock = self._async_bedrock_context = None
+            self._async_bedrock_loop = loop
+            self._async_bedrock_lock = asyncio.Lock()
+            if context is not None:
+                await run_on_loop(previous_loop, context.__aexit__(None, None, None))
+        async with self._async_bedrock_lock:
+            if self.async_bedrock is None:
+                # Sign with the credentials of the shared client rather than resolving them again
+                self._async_credentials = await loop.run_in_executor(
+                    None, self.shared_client.frozen_credentials
+                )
+                session = AioSession()
+                session.set_credentials(
+                    self._async_credentials.access_key,
+                    self._async_credentials.secret_key,
+                    self._async_credentials.token,
+                )
+                self._async_bedrock_context = session.create_client(
+                    "bedrock-runtime",
+                    REGION_NAME,
+                    endpoint_url=ENDPOINT_URL,
+                    config=self.build_config(AioConfig),
+                )
+                self.async_bedrock = await self._async_bedrock_context.__aenter__()
+        return self.async_bedrock
+
+    def record_usage(self, usage: Optional[dict]):
+        """
+        Accumulate the token counts reported by the model, e.g., ``input_tokens``, ``output_tokens``,
+        ``cache_creation_input_tokens`` and ``cache_read_input_tokens`` for Claude 3, into ``self.usage``.
+        """
+        if not usage:
+            return
+        with self._usage_lock:
+            for name, value in usage.items():
+                if isinstance(value, int):
+                    self.usage[name] += value
+
+    def report_congestion(self, error_code: str):
+        if error_code in CONGESTION_ERROR_CODES:
+            limiter = AdaptiveConcurrencyLimiter.get(self.model_name)
+            if limiter is not None:
+                limiter.on_throttle()
+
+    async def close_async(self):
+        if self._async_bedrock_context is not None:
+            context = self._async_bedrock_context
+            self.async_bedrock = self._async_bedrock_context = None
+            await context.__aexit__(None, None, None)
 
     def build_payload(
         self,
@@ -81,6 +166,7 @@ class BedrockWrapper:
         temperature: float,
         top_p: float,
         top_k: int,
+        stop_sequences: Sequence[str] = None,
     ):
         return {
             "prompt": prompt,
@@ -88,18 +174,39 @@ class BedrockWrapper:
             "temperature": temperature,
             "top_p": top_p,
             "top_k": top_k,
-            "stop_sequences": self.stop_sequences,
+            "stop_sequences": (
+                self.stop_sequences if stop_sequences is None else list(stop_sequences)
+            ),
             "anthropic_version": "bedrock-2023-05-31",
         }
 
-    def generate(self, prompt: TYPE_PROMPT) -> str:
+    def generate(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        """
+        Invoke the model, retrying on throttling and transient errors.
+
+        Args:
+            prompt: The prompt.
+            stop_sequences: Per-request stop sequences overriding ``self.stop_sequences``. Bedrock drops the matched
+                stop sequence from the completion, so a matched per-request one is appended back for parsers.
+
+        Returns:
+            The completion.
+        """
         body = self.build_payload(
-            prompt, self.max_new_tokens, self.temperature, self.top_p, self.top_k
+            prompt,
+            self.max_new_tokens,
+            self.temperature,
+            self.top_p,
+            self.top_k,
+            stop_sequences,
         )
         body = json.dumps(body)
         attempt = 0
         while attempt < self.throttling_retries:
             try:
+                credentials = self.shared_client.frozen_credentials()
                 output = self.bedrock.invoke_model(
                     modelId=self.model_name,
                     body=body,
@@ -108,7 +215,9 @@ class BedrockWrapper:
                 )
 
                 response = json.loads(output["body"].read())
+                self.record_usage(response.get("usage"))
                 result = self.parse_response(response)
+                result = self.restore_stop_sequence(result, response, stop_sequences)
                 return result
 
             except (
@@ -118,20 +227,11 @@ class BedrockWrapper:
                 error_code = e.response["Error"]["Code"]
                 print(f"{error_code}: {e}")
                 if error_code == "ExpiredTokenException":
-                    delay = 60
-                    print(
-                        f"Please update the credentials. Bedrock will retry in {delay} seconds."
-                    )
-                    sleep(delay)
-                    self.bedrock = self.initialize_bedrock()
+                    self.shared_client.renew(credentials)
                     continue
-                if error_code not in {
-                    "ThrottlingException",
-                    "ModelTimeoutException",
-                    "ModelErrorException",
-                    "ServiceUnavailableException",
-                }:
+                if error_code not in RETRYABLE_ERROR_CODES:
                     raise e from None
+                self.report_congestion(error_code)
                 if attempt == self.throttling_retries - 1:
                     raise e from None
                 sleep(self.throttling_wait * (attempt + 1))
@@ -140,10 +240,130 @@ class BedrockWrapper:
                 botocore.exceptions.ConnectionClosedError,
             ) as e:
                 print(e)
-                sleep(3)
+                sleep(CONNECTION_ERROR_DELAY)
+                continue
+            attempt += 1
+
+    async def generate_async(
+        self, prompt: TYPE_PROMPT, stop_sequences: Sequence[str] = None
+    ) -> str:
+        """
+        Non-blocking counterpart of ``generate`` with the same retry semantics. Falls back to running ``generate`` in
+        the default executor when aiobotocore is not installed.
+        """
+        if AioSession is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, self.generate, prompt, stop_sequences
+            )
+        body = self.build_payload(
+            prompt,
+            self.max_new_tokens,
+            self.temperature,
+            self.top_p,
+            self.top_k,
+            stop_sequences,
+        )
+        response = await self.invoke_async(json.dumps(body))
+        self.record_usage(response.get("usage"))
+        result = self.parse_response(response)
+        result = self.restore_stop_sequence(result, response, stop_sequences)
+        return result
+
+    async def stream_async(self, prompt: TYPE_PROMPT) -> AsyncIterator[str]:
+        """
+        Stream the generation as text chunks through ``invoke_model_with_response_stream``. Closing the iterator
+        closes the underlying connection, which stops Bedrock from sampling further tokens. Falls back to yielding the
+        whole generation at once when aiobotocore is not installed.
+        """
+        if AioSession is None:
+            yield await self.generate_async(prompt)
+            return
+        body = self.build_payload(
+            prompt, self.max_new_tokens, self.temperature, self.top_p, self.top_k
+        )
+        stream = await self.invoke_async(json.dumps(body), stream=True)
+        try:
+            async for event in stream:
+                chunk = event.get("chunk")
+                if chunk:
+                    text = self.parse_stream_chunk(json.loads(chunk["bytes"]))
+                    if text:
+                        yield text
+        finally:
+            stream.close()
+
+    async def invoke_async(self, body: str, stream: bool = False):
+        """
+        Invoke the model with the retry semantics of ``generate``.
+
+        Returns:
+            The parsed response, or the event stream of the response if ``stream`` is set. Errors raised while
+            consuming the event stream are not retried.
+        """
+        attempt = 0
+        while attempt < self.throttling_retries:
+            try:
+                bedrock = await self.initialize_bedrock_async()
+                invoke = (
+                    bedrock.invoke_model_with_response_stream
+                    if stream
+                    else bedrock.invoke_model
+                )
+                output = await invoke(
+                    modelId=self.model_name,
+                    body=body,
+                    accept="application/json",
+                    contentType="application/json",
+                )
+                if stream:
+                    return output["body"]
+                async with output["body"] as response_body:
+                    return json.loads(await response_body.read())
+
+            except (
+                botocore.errorfactory.ClientError,
+                botocore.exceptions.ClientError,
+            ) as e:
+                error_code = e.response["Error"]["Code"]
+                print(f"{error_code}: {e}")
+                if error_code == "ExpiredTokenException":
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.shared_client.renew, self._async_credentials
+                    )
+                    await self.close_async()
+                    continue
+                if error_code not in RETRYABLE_ERROR_CODES:
+                    raise e from None
+                self.report_congestion(error_code)
+                if attempt == self.throttling_retries - 1:
+                    raise e from None
+                await asyncio.sleep(self.throttling_wait * (attempt + 1))
+            except (
+                botocore.exceptions.ReadTimeoutError,
+                botocore.exceptions.ConnectionClosedError,
+            ) as e:
+                print(e)
+                await asyncio.sleep(CONNECTION_ERROR_DELAY)
                 continue
             attempt += 1
 
     def parse_response(self, response: dict) -> str:
         result = response["completion"]
         return result
+
+    def parse_stream_chunk(self, chunk: dict) -> str:
+        return chunk.get("completion", "")
+
+    def parse_stop_sequence(self, response: dict) -> Optional[str]:
+        if response.get("stop_reason") == "stop_sequence":
+            return response.get("stop")
+
+    def restore_stop_sequence(
+        self, result: str, response: dict, stop_sequences: Optional[Sequence[str]]
+    ) -> str:
+        if stop_sequences is not None:
+            stop = self.parse_stop_sequence(response)
+            if stop and stop in stop_sequences and stop not in self.stop_sequences:
+                result += stop
+        return result
@@ -0,0 +1,248 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import atexit
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Sequence
+
+# Writes are committed in batches, at most this many or this many seconds apart
+COMMIT_EVERY = 64
+COMMIT_INTERVAL = 1.0
+
+
+class GenerationCache:
+    def __init__(
+        self,
+        path: str,
+        max_size: Optional[int] = None,
+        max_age: Optional[float] = None,
+        force: bool = False,
+    ) -> None:
+        """
+        An on-disk, content-addressed cache of LLM generations backed by SQLite.
+
+        Args:
+            path: Path to the SQLite database file.
+            max_size: The maximum total size (in bytes) of cached generations. The least recently used entries are
+                evicted first once it is exceeded.
+            max_age: The maximum age (in seconds) of a cached generation. Older entries are treated as misses and
+                evicted.
+            force: Memoize non-deterministic calls (``temperature > 0``) as well.
+
+        ``LargeLanguageModel.generate_async`` goes through ``aget`` and ``aput``, which run the SQLite work in a
+        dedicated thread rather than on the event loop. Writes are committed in batches, and the pending ones once
+        ``abatch_generate`` drains, on ``flush`` or ``close``, and at interpreter exit.
+        """
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.force = force
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, generation TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._db.commit()
+        self._pending_writes = 0
+        self._last_commit = time.monotonic()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._closed = False
+        atexit.register(self.close)
+        # Also sets the total size, tracked on writes so the table is only scanned when it outgrows max_size
+        self.evict()
+
+    @staticmethod
+    def key(llm, prompt, stop_sequences: Sequence[str] = None) -> str:
+        if stop_sequences is None:
+            stop_sequences = llm.stop_sequences
+        request = [
+            llm.__class__.__name__,
+            getattr(llm, "model_name", None),
+            llm.max_new_tokens,
+            llm.temperature,
+            llm.top_p,
+            llm.top_k,
+            list(stop_sequences),
+            prompt,
+        ]
+        request = json.dumps(request, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def cacheable(self, llm) -> bool:
+        return self.force or not llm.temperature
+
+    @staticmethod
+    def storable(generation) -> bool:
+        # Empty generations stand for errors, e.g., a FailedGeneration or a context length error of Llama/Mistral
+        return isinstance(generation, str) and bool(generation)
+
+    def get(self, llm, prompt, stop_sequences: Sequence[str] = None) -> Optional[str]:
+        if not self.cacheable(llm):
+            return None
+        key = self.key(llm, prompt, stop_sequences)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT generation, created, size FROM generations WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and (
+                self.max_age is not None and now - row[1] > self.max_age
+            ):
+                self._db.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self._size -= row[2]
+                self._wrote()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE generations SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._wrote()
+            self.hits += 1
+            return row[0]
+
+    def put(self, llm, prompt, generation: str, stop_sequences: Sequence[str] = None):
+        if not self.cacheable(llm) or not self.storable(generation):
+            return
+        key = self.key(llm, prompt, stop_sequences)
+        now = time.time()
+        size = len(generation.encode("utf-8"))
+        with self._lock:
+            replaced = self._db.execute(
+                "SELECT size FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)",
+                (key, generation, size, now, now),
+            )
+            self._size += size - (replaced[0] if replaced else 0)
+            self._wrote()
+            oversized = self.max_size is not None and self._size > self.max_size
+        if oversized:
+            self.evict()
+
+    async def aget(
+        self, llm, prompt, stop_sequences: Sequence[str] = None
+    ) -> Optional[str]:
+        """
+        ``get`` in the thread of the cache, off the event loop.
+        """
+        if not self.cacheable(llm):
+            return None
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.get, llm, prompt, stop_sequences
+        )
+
+    async def aput(
+        self, llm, prompt, generation: str, stop_sequences: Sequence[str] = None
+    ):
+        """
+        ``put`` in the thread of the cache, off the event loop.
+        """
+        if not self.cacheable(llm) or not self.storable(generation):
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.put, llm, prompt, generation, stop_sequences
+        )
+
+    def _wrote(self):
+        # Called with the lock held
+        self._pending_writes += 1
+        if (
+            self._pending_writes >= COMMIT_EVERY
+            or time.monotonic() - self._last_commit >= COMMIT_INTERVAL
+        ):
+            self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._pending_writes = 0
+        self._last_commit = time.monotonic()
+
+    def flush(self):
+        """
+        Commit the pending writes.
+        """
+        with self._lock:
+            if not self._closed and self._pending_writes:
+                self._commit()
+
+    async def aflush(self):
+        """
+        ``flush`` in the thread of the cache, after the writes already submitted to it.
+        """
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.flush)
+
+    def evict(self):
+        with self._lock:
+            if self.max_age is not None:
+                self._db.execute(
+                    "DELETE FROM generations WHERE created < ?",
+                    (time.time() - self.max_age,),
+                )
+            total = self.size
+            if self.max_size is not None and total > self.max_size:
+                # Drop the least recently used entries until the cache fits
+                rows = self._db.execute(
+                    "SELECT key, size FROM generations ORDER BY accessed"
+                ).fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total <= self.max_size:
+                        break
+                    evicted.append((key,))
+                    total -= size
+                self._db.executemany("DELETE FROM generations WHERE key = ?", evicted)
+            self._size = total
+            self._commit()
+
+    @property
+    def size(self) -> int:
+        return self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM generations"
+        ).fetchone()[0]
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self),
+            "size": self.size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM generations")
+            self._size = 0
+            self._commit()
+
+    def close(self):
+        if self._closed:
+            return
+        atexit.unregister(self.close)
+        self._executor.shutdown()
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._db.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
@@ -0,0 +1,85 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import math
+import threading
+import time
+
+from crispo.llms.shared import LoopLocal, SharedPerModel
+
+
+class AdaptiveConcurrencyLimiter(SharedPerModel):
+    def __init__(
+        self,
+        initial: int = 8,
+        minimum: int = 1,
+        maximum: int = 256,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+    ) -> None:
+        """
+        An additive-increase/multiplicative-decrease (AIMD) concurrency limiter. It can be used in place of an
+        ``asyncio.Semaphore``. The limit grows by ``increase`` per window of successful calls and is multiplied by
+        ``decrease`` when the backend reports throttling.
+
+        Args:
+            initial: The initial number of concurrent requests.
+            minimum: The lower bound of the limit.
+            maximum: The upper bound of the limit.
+            increase: The additive increase applied after a full window (``limit`` calls) of successes.
+            decrease: The multiplicative factor applied on throttling.
+            cooldown: The minimum number of seconds between two decreases, so a burst of throttled requests only
+                counts as one congestion signal.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.num_throttles = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._condition = LoopLocal(asyncio.Condition)
+
+    @property
+    def concurrency(self) -> int:
+        return max(self.minimum, math.floor(self.limit))
+
+    def on_success(self):
+        with self._lock:
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def on_throttle(self):
+        with self._lock:
+            self.num_throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * self.decrease)
+
+    async def acquire(self):
+        condition = self._condition.get()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+
+    async def release(self, success: bool = True):
+        if success:
+            self.on_success()
+        condition = self._condition.get()
+        async with condition:
+            self.in_flight -= 1
+            # Only as many waiters as there are free slots
+            condition.notify(max(0, self.concurrency - self.in_flight))
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release(success=exc_type is None)
@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import collections
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class RequestHedger:
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        max_extra_load: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+    ) -> None:
+        """
+        Hedge slow requests: once a request has been in flight longer than the ``quantile`` of the recent latencies, a
+        duplicate is sent and whichever response comes first wins, the other one is cancelled. Only meant for
+        deterministic requests, whose duplicates return the same completion.
+
+        Args:
+            quantile: The quantile of the rolling latencies after which a request is hedged.
+            max_extra_load: The maximum number of hedges as a fraction of the requests.
+            window: The number of recent latencies the quantile is computed over.
+            min_samples: The number of latencies to observe before hedging.
+        """
+        self.quantile = quantile
+        self.max_extra_load = max_extra_load
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.num_requests = 0
+        self.num_fired = 0
+        self.num_won = 0
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """
+        The number of seconds after which a request is hedged, ``None`` while there are too few latencies.
+        """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[
+            min(len(latencies) - 1, math.ceil(self.quantile * len(latencies)) - 1)
+        ]
+
+    def within_budget(self) -> bool:
+        return self.num_fired < self.max_extra_load * self.num_requests
+
+    async def _timed(self, call: Callable[[], Awaitable[str]]) -> str:
+        start = time.perf_counter()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # Primaries losing to their hedge are the slow tail, the time until then is a lower bound of their latency
+            self._record(time.perf_counter() - start)
+            raise
+        self._record(time.perf_counter() - start)
+        return result
+
+    def _record(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[str]],
+        hedge: Optional[Callable[[], Awaitable[str]]] = None,
+    ) -> str:
+        """
+        Await ``call()``, calling ``hedge()`` if the first call is slow. Only the latencies of the first calls are
+        recorded.
+
+        Args:
+            call: The request.
+            hedge: The duplicate request, defaults to ``call``. ``LargeLanguageModel`` passes one taking its own
+                concurrency slot and rate limit reservation, so hedges count against both.
+        """
+        self.num_requests += 1
+        delay = self.delay()
+        primary = asyncio.ensure_future(self._timed(call))
+        pending = {primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.within_budget():
+                    self.num_fired += 1
+                    pending.add(asyncio.ensure_future((hedge or call)()))
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Prefer a successful response, the error of the last one is raised otherwise
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None or not pending:
+                    winner = winner or done.pop()
+                    break
+            if winner is not primary and winner.exception() is None:
+                self.num_won += 1
+            return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "requests": self.num_requests,
+            "fired": self.num_fired,
+            "won": self.num_won,
+            "delay": self.delay(),
+        }
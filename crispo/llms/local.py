@@ -0,0 +1,264 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import abc
+import asyncio
+import concurrent.futures
+from typing import List, Optional, Sequence, Tuple
+
+from crispo.llms import LargeLanguageModel, TYPE_PROMPT
+from crispo.llms.cache import GenerationCache
+from crispo.llms.rate_limit import estimate_num_tokens
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        generate_batch,
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        max_pending: int = None,
+    ) -> None:
+        """
+        Collect concurrent requests into batches for a model running in-process. The first request of a batch waits
+        up to ``max_wait`` seconds for others. The pending requests are then sorted by length and split into batches
+        of similar lengths, which limits padding. Batches run one at a time in a dedicated thread, so the event loop
+        keeps collecting the next ones meanwhile.
+
+        Args:
+            generate_batch: A blocking function generating the completions of a list of prompts.
+            max_batch_size: The maximum number of prompts per batch.
+            max_wait: The number of seconds the first request waits for a batch to fill up.
+            max_pending: The maximum number of pending requests sorted together, defaults to 4 batches.
+        """
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_pending = max_pending or 4 * max_batch_size
+        self.num_requests = 0
+        self.num_batches = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    def _get_queue(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker.done():
+            # Queues and tasks cannot be shared across event loops
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run(self._queue))
+        return self._queue
+
+    async def submit(self, prompt: TYPE_PROMPT) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._get_queue().put_nowait((prompt, future))
+        return await future
+
+    async def _collect(
+        self, queue: asyncio.Queue
+    ) -> List[Tuple[TYPE_PROMPT, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        pending = [await queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        while len(pending) < self.max_pending and not queue.empty():
+            pending.append(queue.get_nowait())
+        # Requests cancelled while queued, e.g., by hedging
+        return [(prompt, future) for prompt, future in pending if not future.done()]
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        # The worker stops once idle and is restarted by the next request
+        while not queue.empty():
+            pending = await self._collect(queue)
+            pending.sort(key=lambda request: estimate_num_tokens(request[0]))
+            for i in range(0, len(pending), self.max_batch_size):
+                batch = pending[i : i + self.max_batch_size]
+                self.num_requests += len(batch)
+                self.num_batches += 1
+                try:
+                    generations = await loop.run_in_executor(
+                        self._executor,
+                        self.generate_batch,
+                        [prompt for prompt, _ in batch],
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), generation in zip(batch, generations):
+                    if not future.done():
+                        future.set_result(generation)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "requests": self.num_requests,
+            "batches": self.num_batches,
+            "mean_batch_size": (
+                self.num_requests / self.num_batches if self.num_batches else 0.0
+            ),
+        }
+
+
+class LocalLLM(LargeLanguageModel, abc.ABC):
+    def __init__(
+        self,
+        max_new_tokens: int = 512,
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        top_k: int = 1,
+        stop_sequences: Sequence[str] = (),
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        max_pending: int = None,
+        cache: Optional[GenerationCache] = None,
+    ) -> None:
+        """
+        An LLM running in-process, which batches the concurrent ``generate_async`` calls with a ``MicroBatcher``.
+        Subclasses implement ``generate_batch``.
+
+        Args:
+            max_batch_size: The maximum number of prompts per forward pass.
+            max_wait: The number of seconds a request waits for a batch to fill up.
+            max_pending: The maximum number of pending requests bucketed by length together.
+        """
+        batcher = MicroBatcher(
+            self.generate_batch, max_batch_size, max_wait, max_pending
+        )
+        # Enough requests in flight to fill the pending requests bucketed together while a batch runs
+        super().__init__(
+            max_new_tokens,
+            temperature,
+            top_p,
+            top_k,
+            batcher.max_pending + max_batch_size,
+            stop_sequences,
+            cache=cache,
+        )
+        self.batcher = batcher
+
+    @abc.abstractmethod
+    def generate_batch(self, prompts: List[TYPE_PROMPT]) -> List[str]:
+        """
+        Generate the completions of a batch of prompts in one forward pass.
+        """
+        pass
+
+    def generate(self, prompt: TYPE_PROMPT) -> str:
+        return self.generate_batch([prompt])[0]
+
+    async def agenerate(self, prompt: TYPE_PROMPT) -> str:
+        return await self.batcher.submit(prompt)
+
+
+class TransformersLLM(LocalLLM):
+    def __init__(
+        self,
+        model_name: str,
+        max_new_tokens: int = 512,
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        top_k: int = 1,
+        stop_sequences: Sequence[str] = (),
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        max_pending: int = None,
+        num_threads: int = None,
+        cache: Optional[GenerationCache] = None,
+    ) -> None:
+        """
+        A causal language model from the Hugging Face hub, loaded with ``transformers`` on the first generation.
+
+        Args:
+            model_name: The name or path of the model.
+            num_threads: The number of intra-op threads of PyTorch, left to its default if not given.
+        """
+        super().__init__(
+            max_new_tokens,
+            temperature,
+            top_p,
+            top_k,
+            stop_sequences,
+            max_batch_size,
+            max_wait,
+            max_pending,
+            cache=cache,
+        )
+        self.model_name = model_name
+        self.num_threads = num_threads
+        self.model = None
+        self.tokenizer = None
+
+    def load(self):
+        if self.model is None:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+            # Pad on the left so that the completions of a batch start at the same position
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name, padding_side="left"
+            )
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.model = AutoModelForCausalLM.from_pretrained(self.model_name)
+            self.model.eval()
+
+    def format_prompt(self, prompt: TYPE_PROMPT) -> str:
+        messages = (
+            [{"role": "user", "content": prompt}] if isinstance(prompt, str) else prompt
+        )
+        if self.tokenizer.chat_template:
+            return self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+        return "\n\n".join(message["content"] for message in messages)
+
+    def generate_batch(self, prompts: List[TYPE_PROMPT]) -> List[str]:
+        import torch
+
+        self.load()
+        inputs = self.tokenizer(
+            [self.format_prompt(prompt) for prompt in prompts],
+            return_tensors="pt",
+            padding=True,
+            # Chat templates already add the special tokens
+            add_special_tokens=not self.tokenizer.chat_template,
+        )
+        sampling = (
+            dict(do_sample=True, temperature=self.temperature, top_p=self.top_p)
+            if self.temperature
+            else dict(do_sample=False)
+        )
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                stop_strings=list(self.stop_sequences) or None,
+                tokenizer=self.tokenizer,
+                **sampling,
+            )
+        generations = self.tokenizer.batch_decode(
+            outputs[:, inputs["input_ids"].shape[1] :], skip_special_tokens=True
+        )
+        return [self.truncate(generation).lstrip() for generation in generations]
+
+    def truncate(self, generation: str) -> str:
+        # Generation stops once every sequence of the batch has hit a stop string, the others may run past theirs
+        for stop in self.stop_sequences:
+            if stop in generation:
+                generation = generation[: generation.index(stop)]
+        return generation
@@ -0,0 +1,243 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import atexit
+import os
+from typing import List, Optional, Sequence
+
+from crispo.llms import LargeLanguageModel, TYPE_PROMPT
+from crispo.llms.cache import GenerationCache
+from crispo.llms.concurrency import AdaptiveConcurrencyLimiter
+from crispo.utilities.async_util import (
+    close_at_shutdown,
+    run_on_loop,
+    run_until_complete,
+)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Throttling and overload statuses, retried like the retryable Bedrock error codes
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+CONGESTION_STATUSES = {429, 504}
+CONNECTION_ERROR_DELAY = 3
+
+
+class OpenAICompatibleError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class OpenAICompatibleClient:
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = "http://localhost:8000/v1",
+        api_key: Optional[str] = os.environ.get("OPENAI_API_KEY"),
+        throttling_retries: int = 99999,
+        throttling_wait: int = 2,
+        max_new_tokens: int = 2048,
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        top_k: Optional[int] = None,
+        max_connections: int = 16,
+        timeout: float = 120,
+        stop_sequences: Sequence[str] = (),
+    ):
+        """
+        A client of the ``chat/completions`` API served by OpenAI-compatible endpoints, e.g., vLLM or TGI. Requests go
+        through one ``aiohttp`` session per event loop, which keeps up to ``max_connections`` connections alive. The
+        session of a loop is closed once requests run on another loop, and at interpreter exit.
+        Throttling and transient errors are retried with the semantics of ``BedrockWrapper.generate``.
+
+        Args:
+            model_name: The model served by the endpoint.
+            base_url: The URL the API paths are appended to, e.g., ``http://localhost:8000/v1``.
+            api_key: The bearer token, if the endpoint requires one.
+            throttling_retries: The maximum number of attempts on throttling and transient errors.
+            throttling_wait: The base delay in seconds between attempts, multiplied by the attempt number.
+            top_k: Sent only when given, since it is an extension of vLLM and TGI.
+            max_connections: The size of the connection pool.
+            timeout: The number of seconds to wait for a response.
+        """
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.throttling_retries = throttling_retries
+        self.throttling_wait = throttling_wait
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.stop_sequences = list(stop_sequences)
+        self.session = None
+        self._session_loop = None
+        self._session_guard = None
+        atexit.register(self.close)
+
+    async def get_session(self):
+        """
+        Lazily create an ``aiohttp`` session bound to the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session_loop is not loop or self.session.closed:
+            # Sessions cannot be shared across event loops, the one of the previous loop is closed there
+            previous_loop, previous_guard = self._session_loop, self._session_guard
+            headers = (
+                {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            )
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections, keepalive_timeout=60
+                ),
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._session_loop = loop
+            # Also closed when the loop shuts down, e.g., at the end of asyncio.run
+            self._session_guard = close_at_shutdown(self.session.close)
+            await self._session_guard.__anext__()
+            if previous_guard is not None:
+                await run_on_loop(previous_loop, previous_guard.aclose())
+        return self.session
+
+    async def close_async(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def close(self):
+        """
+        Close the session from outside of any event loop, e.g., at interpreter exit. Nothing can be closed once the
+        loop of the session has been closed, which ``asyncio.run`` only does after closing the session.
+        """
+        loop = self._session_loop
+        if self._session_guard is None or loop.is_closed() or loop.is_running():
+            return
+        loop.run_until_complete(self._session_guard.aclose())
+
+    def build_payload(self, prompt: TYPE_PROMPT, n: int = 1) -> dict:
+        payload = {
+            "model": self.model_name,
+            "messages": (
+                [{"role": "user", "content": prompt}]
+                if isinstance(prompt, str)
+                else prompt
+            ),
+            "max_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "n": n,
+        }
+        if self.top_k is not None:
+            payload["top_k"] = self.top_k
+        if self.stop_sequences:
+            payload["stop"] = self.stop_sequences
+        return payload
+
+    def report_congestion(self, status: int):
+        if status in CONGESTION_STATUSES:
+            limiter = AdaptiveConcurrencyLimiter.get(self.model_name)
+            if limiter is not None:
+                limiter.on_throttle()
+
+    async def generate_async(self, prompt: TYPE_PROMPT, n: int = 1) -> List[str]:
+        """
+        Sample ``n`` completions of the prompt in one request, retrying on throttling and transient errors.
+
+        Returns:
+            The completions.
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "aiohttp is required for OpenAI-compatible endpoints: pip install aiohttp"
+            )
+        body = self.build_payload(prompt, n)
+        attempt = 0
+        while attempt < self.throttling_retries:
+            try:
+                session = await self.get_session()
+                async with session.post(
+                    f"{self.base_url}/chat/completions", json=body
+                ) as output:
+                    if output.status != 200:
+                        raise OpenAICompatibleError(output.status, await output.text())
+                    response = await output.json()
+                choices = sorted(response["choices"], key=lambda c: c.get("index", 0))
+                return [choice["message"]["content"] or "" for choice in choices]
+
+            except OpenAICompatibleError as e:
+                print(e)
+                if e.status not in RETRYABLE_STATUSES:
+                    raise e from None
+                self.report_congestion(e.status)
+                if attempt == self.throttling_retries - 1:
+                    raise e from None
+                await asyncio.sleep(self.throttling_wait * (attempt + 1))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                print(repr(e))
+                await asyncio.sleep(CONNECTION_ERROR_DELAY)
+                continue
+            attempt += 1
+
+
+class OpenAICompatible(LargeLanguageModel):
+    supports_n = True
+
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = "http://localhost:8000/v1",
+        api_key: Optional[str] = os.environ.get("OPENAI_API_KEY"),
+        max_new_tokens: int = 2048,
+        temperature: float = 0.0,
+        top_p: float = 1.0,
+        top_k: Optional[int] = None,
+        concurrency: int = 16,
+        stop_sequences: Sequence[str] = (),
+        max_connections: Optional[int] = None,
+        cache: Optional[GenerationCache] = None,
+    ) -> None:
+        """
+        An LLM served by an OpenAI-compatible endpoint, e.g., vLLM or TGI.
+
+        Args:
+            max_connections: The size of the connection pool, defaults to ``concurrency``.
+        """
+        super().__init__(
+            max_new_tokens,
+            temperature,
+            top_p,
+            top_k,
+            concurrency,
+            stop_sequences,
+            cache=cache,
+        )
+        self.model_name = model_name
+        self.client = OpenAICompatibleClient(
+            model_name=model_name,
+            base_url=base_url,
+            api_key=api_key,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            max_connections=max_connections or concurrency,
+            stop_sequences=stop_sequences,
+        )
+
+    def generate(self, prompt: TYPE_PROMPT) -> str:
+        return run_until_complete(self.agenerate(prompt))
+
+    async def agenerate(self, prompt: TYPE_PROMPT) -> str:
+        generations = await self.client.generate_async(prompt)
+        return generations[0].lstrip()
+
+    async def agenerate_n(self, prompt: TYPE_PROMPT, n: int) -> List[str]:
+        generations = await self.client.generate_async(prompt, n)
+        return [generation.lstrip() for generation in generations]
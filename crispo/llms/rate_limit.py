@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import math
+import threading
+import time
+from typing import Optional
+
+from crispo.llms.shared import SharedPerModel
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_num_tokens(prompt) -> int:
+    """
+    Roughly estimate the number of tokens in a prompt (str or message list) from its number of characters.
+    """
+    if not prompt:
+        return 0
+    if isinstance(prompt, str):
+        return math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    if isinstance(prompt, dict):
+        return estimate_num_tokens(prompt.get("content") or prompt.get("text"))
+    return sum(estimate_num_tokens(each) for each in prompt)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None) -> None:
+        """
+        A token bucket refilled at ``rate_per_minute``. Reservations are granted immediately and may overdraw the
+        bucket, in which case the caller is told how long to wait before its reservation is covered.
+
+        Args:
+            rate_per_minute: The refill rate.
+            capacity: The maximum burst, defaults to one minute worth of tokens.
+        """
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.available = self.capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill()
+            self.available -= amount
+            return max(0.0, -self.available / self.rate)
+
+    def refund(self, amount: float):
+        with self._lock:
+            self._refill()
+            self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter(SharedPerModel):
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ) -> None:
+        """
+        Proactively pace requests to stay within requests-per-minute (RPM) and tokens-per-minute (TPM) quotas.
+
+        Args:
+            requests_per_minute: The RPM quota, unlimited if ``None``.
+            tokens_per_minute: The TPM quota (input plus output tokens), unlimited if ``None``.
+        """
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.num_requests = 0
+        self.num_tokens = 0
+        self.wait_time = 0.0
+        self.network_time = 0.0
+
+    async def acquire(self, num_tokens: int) -> float:
+        """
+        Wait until both quotas cover one more request of ``num_tokens`` tokens.
+
+        Returns:
+            The number of seconds waited.
+        """
+        delay = 0.0
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens:
+            delay = max(delay, self.tokens.reserve(num_tokens))
+        self.num_requests += 1
+        self.num_tokens += num_tokens
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # Never sent, the whole reservation goes back
+                self.cancel(num_tokens)
+                raise
+            self.wait_time += delay
+        return delay
+
+    def cancel(self, num_tokens: int):
+        """
+        Refund the reservation of a request which was not sent.
+        """
+        self.num_requests -= 1
+        self.num_tokens -= num_tokens
+        if self.requests:
+            self.requests.refund(1)
+        if self.tokens:
+            self.tokens.refund(num_tokens)
+
+    def release(self, reserved_tokens: int, used_tokens: int, network_time: float):
+        """
+        Return the unused part of a token reservation and record the time spent on the network.
+        """
+        self.network_time += network_time
+        unused = reserved_tokens - used_tokens
+        if unused > 0:
+            self.num_tokens -= unused
+            if self.tokens:
+                self.tokens.refund(unused)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "requests": self.num_requests,
+            "tokens": self.num_tokens,
+            "wait_time": self.wait_time,
+            "network_time": self.network_time,
+        }
@@ -0,0 +1,96 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+from collections import Counter
+
+from crispo.llms.shared import SharedPerModel
+
+
+class Priority(enum.IntEnum):
+    """
+    The priority classes of LLM requests, lower values are served first.
+    """
+
+    # On the critical path of a step: critiques and meta prompt generation
+    CRITICAL = 0
+    # Evaluation of the new prompts on the train set
+    TRAIN = 1
+    # Evaluation on the dev or test set, which can lag behind
+    BULK = 2
+
+
+REQUEST_PRIORITY: contextvars.ContextVar = contextvars.ContextVar(
+    "request_priority", default=Priority.TRAIN
+)
+
+
+@contextlib.contextmanager
+def request_priority(priority: Priority):
+    """
+    Submit the LLM requests made within this context, including the tasks it creates, with ``priority``.
+    """
+    token = REQUEST_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        REQUEST_PRIORITY.reset(token)
+
+
+class PriorityScheduler(SharedPerModel):
+    def __init__(self, concurrency: int = 16) -> None:
+        """
+        A concurrency cap shared by all LLMs targeting the same model, which admits waiting requests by priority
+        (``REQUEST_PRIORITY``), then in arrival order. It can be used in place of an ``asyncio.Semaphore``. A freed
+        slot wakes up the head waiter only.
+
+        Args:
+            concurrency: The maximum number of concurrent requests to the model.
+        """
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.served = Counter()
+        # (priority, seq, future) of the waiting requests, the future resolves once admitted
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def _admit_next(self):
+        while self._waiting and self.in_flight < self.concurrency:
+            _, _, admitted = heapq.heappop(self._waiting)
+            # Cancelled waiters are skipped
+            if not admitted.done():
+                self.in_flight += 1
+                admitted.set_result(None)
+
+    async def acquire(self):
+        priority = REQUEST_PRIORITY.get()
+        if self.in_flight < self.concurrency and not self._waiting:
+            self.in_flight += 1
+        else:
+            admitted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (priority, next(self._seq), admitted))
+            try:
+                await admitted
+            except asyncio.CancelledError:
+                if admitted.done() and not admitted.cancelled():
+                    # Admitted and cancelled before resuming, the slot goes to the next waiter
+                    self.in_flight -= 1
+                    self._admit_next()
+                raise
+        self.served[priority] += 1
+
+    async def release(self):
+        self.in_flight -= 1
+        self._admit_next()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
@@ -0,0 +1,76 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SharedPerModel:
+    """
+    A base class of the objects shared by all LLMs targeting the same model, e.g., limiters and schedulers. Each
+    subclass keeps its own registry, filled by ``for_model``.
+    """
+
+    _registry: Dict[str, "SharedPerModel"]
+    _registry_lock: threading.Lock
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._registry = dict()
+        cls._registry_lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_name: str, defaults: Dict[str, Any] = None, **settings):
+        """
+        Get the instance shared by all LLMs targeting ``model_name``, creating it on the first call.
+
+        Args:
+            model_name: The model the instance is shared for.
+            defaults: The arguments used only if the instance is created, e.g., values derived from the calling LLM.
+            **settings: The arguments the instance must have, ``None`` for unspecified ones.
+
+        Raises:
+            ValueError: If the shared instance was created with other settings.
+        """
+        settings = dict((k, v) for k, v in settings.items() if v is not None)
+        with cls._registry_lock:
+            shared = cls._registry.get(model_name)
+            if shared is None:
+                arguments = dict(defaults or {}, **settings)
+                shared = cls._registry[model_name] = cls(**arguments)
+                shared._settings = arguments
+                return shared
+            conflicts = dict(
+                (k, v) for k, v in settings.items() if shared._settings.get(k) != v
+            )
+            if conflicts:
+                raise ValueError(
+                    f"The {cls.__name__} of {model_name} is already shared with {shared._settings}, "
+                    f"which conflicts with {conflicts}"
+                )
+            return shared
+
+    @classmethod
+    def get(cls, model_name: str) -> Optional["SharedPerModel"]:
+        return cls._registry.get(model_name)
+
+
+class LoopLocal(Generic[T]):
+    def __init__(self, factory: Callable[[], T]) -> None:
+        """
+        An object created by ``factory`` for the running event loop, e.g., an ``asyncio.Condition``, since asyncio
+        primitives cannot be shared across event loops. It is created again whenever the loop changes.
+        """
+        self.factory = factory
+        self._loop = None
+        self._value = None
+
+    def get(self) -> T:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._value = self.factory()
+        return self._value
@@ -4,7 +4,7 @@
 import abc
 import statistics
 from collections import defaultdict
-from typing import Union, Any, Optional, List
+from typing import Union, Any, Optional, List, Sequence
 
 from crispo.metrics.floats import FloatDict
 
@@ -17,6 +17,20 @@ class Metric(abc.ABC):
     ) -> float:
         pass
 
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> list:
+        """
+        Score a batch of predictions. Metrics backed by a model override it to score the whole batch at once, the
+        others score each prediction with ``score``.
+        """
+        if xs is None:
+            xs = [None] * len(preds)
+        return [self.score(pred, gold, x) for pred, gold, x in zip(preds, golds, xs)]
+
     def aggregate(self, scores):
         return statistics.mean(scores)
 
@@ -38,6 +52,21 @@ class MetricDict(Metric):
         )
         return FloatDict(**scores)
 
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> List[FloatDict]:
+        columns = dict(
+            (name, metric.score_batch(preds, golds, xs))
+            for name, metric in self.metrics.items()
+        )
+        return [
+            FloatDict(**dict((name, column[i]) for name, column in columns.items()))
+            for i in range(len(preds))
+        ]
+
     def aggregate(self, scores: List[FloatDict]):
         scores_per_metric = defaultdict(list)
         for each in scores:
@@ -33,6 +33,7 @@ Draft your new instruction step by step:
 4. Write your final new instruction in <instruction> tags.
 """.strip()
     )
+    num_candidates: int = 1
 
     # noinspection PyMethodOverriding
     def fill(
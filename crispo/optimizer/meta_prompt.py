@@ -2,22 +2,56 @@
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
 import abc
-from typing import List, Tuple
+import re
+from typing import List, Tuple, Optional
 
+from crispo.llms import PrefixedPrompt
 from crispo.task.example import Example
 from crispo.task.prompt import TaskPrompt
 
 
 class MetaPrompt(abc.ABC):
+    # The number of distinct candidates asked for in each meta LLM call
+    num_candidates: int = 1
+
     @abc.abstractmethod
     def fill(
         self,
         prompt_score_pairs: List[Tuple[TaskPrompt, float]],
         few_shot_examples: List[Example],
-        **kwargs
+        **kwargs,
     ) -> str:
         pass
 
     @abc.abstractmethod
     def parse(self, generation: str) -> TaskPrompt:
         pass
+
+    def request_candidates(self, meta_prompt_text: str) -> str:
+        """
+        Ask for ``num_candidates`` distinct candidates in one response, each wrapped in ``<candidate>`` tags.
+        """
+        if self.num_candidates <= 1:
+            return meta_prompt_text
+        return (
+            f"{meta_prompt_text}\n\nRepeat the above {self.num_candidates} times to write {self.num_candidates} "
+            f"distinct candidates. Wrap each complete candidate in its own <candidate></candidate> tags."
+        )
+
+    def parse_many(self, generation: str) -> List[Optional[TaskPrompt]]:
+        """
+        Parse each ``<candidate>`` of a generation with ``parse``, or the whole generation if it has none.
+        """
+        candidates = re.findall(
+            r"<candidate>(.*?)</candidate>", generation, flags=re.DOTALL
+        )
+        if not candidates:
+            return [self.parse(generation)]
+        return [self.parse(candidate) for candidate in candidates]
+
+    def mark_static_prefix(self, meta_prompt_text: str) -> str:
+        """
+        Mark the part of a filled meta prompt shared by the requests generating new prompts, which is all of it by
+        default since the same text is sent for every candidate.
+        """
+        return PrefixedPrompt(meta_prompt_text, meta_prompt_text)
@@ -13,6 +13,7 @@ from crispo.task.prompt import TaskPrompt
 @dataclass
 class OproMetaPrompt(MetaPrompt, ABC):
     prompt: str = "Your task is to generate the instruction <INS>."
+    num_candidates: int = 1
 
     def fill(
         self,
@@ -2,13 +2,18 @@
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
 import abc
+import os
 from dataclasses import dataclass
-from typing import Any, Union
+from typing import Any, Union, ClassVar, Optional, List
+
+from crispo.llms import PrefixedPrompt
 
 
 @dataclass(eq=True, frozen=True)
 class TaskPrompt(abc.ABC):
     prompt: str
+    # The XML tag that ``parse`` extracts the prediction from, if any
+    output_tag: ClassVar[Optional[str]] = None
 
     @abc.abstractmethod
     def fill(self, x: Union[str, Any]) -> str:
@@ -16,8 +21,24 @@ class TaskPrompt(abc.ABC):
 
     @abc.abstractmethod
     def parse(self, generation: str) -> Union[str, Any]:
+        """
+        Parse a generation into a prediction. A failed request is passed in as an empty
+        ``crispo.llms.FailedGeneration`` carrying its error.
+        """
         pass
 
+    def mark_static_prefix(self, prompts: List[str]) -> List[str]:
+        """
+        Mark the part of the prompts filled from different inputs that does not depend on the input, so it can be
+        cached by backends supporting prompt caching. Override it if the filled prompts do not start with it.
+        """
+        if len(prompts) < 2 or not all(isinstance(p, str) for p in prompts):
+            return prompts
+        prefix = os.path.commonprefix(prompts)
+        if not prefix:
+            return prompts
+        return [PrefixedPrompt(p, prefix) for p in prompts]
+
     def __str__(self) -> str:
         return self.prompt
 
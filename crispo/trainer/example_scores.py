@@ -0,0 +1,45 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+from typing import Sequence
+
+import numpy as np
+
+
+class ExampleScoreSums:
+    def __init__(self, num_examples: int) -> None:
+        """
+        Running sums of the per-example overall scores (``float(score)``) of the prompts fully evaluated on the train
+        set, over the prompts of the current step and of all steps. They rank the train examples for few-shot
+        selection. The scores of each prompt are not kept, so memory does not grow with the number of prompts.
+
+        Args:
+            num_examples: The size of the train set.
+        """
+        self.step_sums = np.zeros(num_examples)
+        self.total_sums = np.zeros(num_examples)
+
+    def add(self, scores: Sequence[float]):
+        scores = np.fromiter((float(score) for score in scores), float, len(scores))
+        self.step_sums += scores
+        self.total_sums += scores
+
+    def start_step(self):
+        self.step_sums[:] = 0
+
+
+def lowest(values: Sequence[float], k: int) -> np.ndarray:
+    """
+    The indices of the ``k`` lowest values in ascending order, ties broken by index as a stable sort would, found with
+    a partial sort.
+    """
+    values = np.asarray(values, dtype=float)
+    if k >= len(values):
+        return np.argsort(values, kind="stable")
+    if k <= 0:
+        return np.zeros(0, dtype=int)
+    kth = np.partition(values, k - 1)[k - 1]
+    below = np.flatnonzero(values < kth)
+    ties = np.flatnonzero(values == kth)[: k - len(below)]
+    chosen = np.concatenate([below, ties])
+    return chosen[np.argsort(values[chosen], kind="stable")]
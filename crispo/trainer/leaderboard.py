@@ -0,0 +1,119 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import bisect
+import heapq
+import statistics
+from typing import Any, Dict, Iterator, List, Tuple
+
+from crispo.metrics.floats import FloatDict
+from crispo.metrics.metric import Metric, MetricDict
+from crispo.task.prompt import TaskPrompt
+
+
+class Leaderboard:
+    def __init__(self, metric: Metric) -> None:
+        """
+        The scores of all prompts seen so far, iterated from the best to the worst. It replaces the dict of prompt
+        score pairs in the trainer and keeps its scores sorted as they are inserted.
+
+        With a ``MetricDict(primary="rank")``, the score of a prompt is its average rank across the metrics, i.e., the
+        average number of prompts strictly better than it. The keys of each metric are kept in a sorted list, so a rank
+        is computed with one bisection per metric when the score is looked up rather than re-ranking every prompt on
+        each insertion.
+
+        Args:
+            metric: The metric whose ``key`` orders the scores.
+        """
+        self.metric = metric
+        self._scores: Dict[TaskPrompt, Any] = dict()
+        self._seq: Dict[TaskPrompt, int] = dict()
+        # Ranked: the ascending keys of each metric. Otherwise: (-key, seq, prompt) from best to worst.
+        self._keys: Dict[str, list] = dict()
+        self._order: List[Tuple[Any, int, TaskPrompt]] = []
+
+    @property
+    def ranked(self) -> bool:
+        return isinstance(self.metric, MetricDict) and self.metric.primary == "rank"
+
+    def __setitem__(self, prompt: TaskPrompt, score):
+        if prompt in self._scores:
+            self._remove(prompt)
+        else:
+            self._seq[prompt] = len(self._seq)
+        if self.ranked:
+            scores = dict(score.scores)
+            scores.pop("rank", None)
+            score = FloatDict(**scores)
+            for name, value in scores.items():
+                bisect.insort(
+                    self._keys.setdefault(name, []), self.metric[name].key(value)
+                )
+        else:
+            bisect.insort(
+                self._order, (-self.metric.key(score), self._seq[prompt], prompt)
+            )
+        self._scores[prompt] = score
+
+    def _remove(self, prompt: TaskPrompt):
+        score = self._scores.pop(prompt)
+        if self.ranked:
+            for name, value in score.scores.items():
+                keys = self._keys[name]
+                del keys[bisect.bisect_left(keys, self.metric[name].key(value))]
+        else:
+            entry = (-self.metric.key(score), self._seq[prompt], prompt)
+            del self._order[bisect.bisect_left(self._order, entry)]
+
+    def rank(self, prompt: TaskPrompt) -> float:
+        ranks = []
+        for name, value in self._scores[prompt].scores.items():
+            keys = self._keys[name]
+            ranks.append(
+                len(keys) - bisect.bisect_right(keys, self.metric[name].key(value))
+            )
+        return statistics.mean(ranks) if ranks else 0
+
+    def __getitem__(self, prompt: TaskPrompt):
+        score = self._scores[prompt]
+        if self.ranked:
+            rank = self.rank(prompt)
+            return FloatDict(rank, **score.scores, rank=rank)
+        return score
+
+    def top(self, k: int = None) -> List[Tuple[TaskPrompt, Any]]:
+        """
+        The ``k`` best prompts and their scores, from the best to the worst.
+        """
+        if k is None:
+            k = len(self)
+        if self.ranked:
+            best = heapq.nsmallest(
+                k, ((self.rank(p), seq, p) for p, seq in self._seq.items())
+            )
+            return [(p, self[p]) for _, _, p in best]
+        return [(p, self._scores[p]) for _, _, p in self._order[:k]]
+
+    def items(self) -> List[Tuple[TaskPrompt, Any]]:
+        return self.top()
+
+    def keys(self) -> List[TaskPrompt]:
+        return [p for p, _ in self.top()]
+
+    def values(self) -> List[Any]:
+        return [score for _, score in self.top()]
+
+    def __iter__(self) -> Iterator[TaskPrompt]:
+        return iter(self.keys())
+
+    def __contains__(self, prompt) -> bool:
+        return prompt in self._scores
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __getstate__(self):
+        # Metrics may hold models, the trainer re-attaches the metric when resuming
+        state = self.__dict__.copy()
+        state["metric"] = None
+        return state
@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import math
+import statistics
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class RacingPolicy:
+    """
+    How ``Trainer.fit`` races the candidate prompts of a step on growing subsets of the train set. After each round,
+    a candidate is dropped once the upper confidence bound of its mean ``metric.key`` falls below the best score on
+    the full train set so far or below the lower bound of another candidate. Only the survivors are evaluated on the
+    full train set.
+
+    Args:
+        initial_size: The number of examples in the first round.
+        growth: The factor by which the subset grows from one round to the next.
+        confidence: The probability that no bound of a race is violated, i.e., that no candidate is dropped wrongly.
+            The error ``1 - confidence`` is split evenly across the lower and upper bounds of every candidate in
+            every round (union bound).
+        value_range: The range of the per-example ``metric.key``, e.g., ``1`` for accuracy. When given, Hoeffding bounds
+            are used, which stay valid on small subsets with little variance. Otherwise, the bounds rely on the normal
+            approximation.
+        seed: The seed of the order the examples are revealed in. All candidates share it.
+    """
+
+    initial_size: int = 20
+    growth: float = 2.0
+    confidence: float = 0.95
+    value_range: Optional[float] = None
+    seed: int = 0
+
+    def sizes(self, total: int) -> List[int]:
+        sizes = []
+        size = self.initial_size
+        while size < total:
+            sizes.append(size)
+            size = max(size + 1, math.ceil(size * self.growth))
+        sizes.append(total)
+        return sizes
+
+    def bounds(
+        self, values: List[float], total: int, num_bounds: int = 1
+    ) -> Tuple[float, float]:
+        """
+        The lower and upper confidence bounds of the mean over ``total`` examples given the first ``values``, each
+        holding with probability ``1 - (1 - confidence) / num_bounds``.
+
+        Args:
+            num_bounds: The number of bounds of the race the error is split across.
+        """
+        n = len(values)
+        mean = statistics.mean(values)
+        if n >= total:
+            return mean, mean
+        error = (1 - self.confidence) / num_bounds
+        # Sampling without replacement from a finite train set
+        correction = math.sqrt((total - n) / (total - 1))
+        if self.value_range is not None:
+            half_width = self.value_range * math.sqrt(math.log(1 / error) / (2 * n))
+        elif n < 2:
+            return -math.inf, math.inf
+        else:
+            z = statistics.NormalDist().inv_cdf(1 - error)
+            half_width = z * statistics.stdev(values) / math.sqrt(n)
+        half_width *= correction
+        return mean - half_width, mean + half_width
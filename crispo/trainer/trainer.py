@@ -2,32 +2,70 @@
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
 import abc
+import asyncio
+import functools
+import math
 import os
 import random
-import statistics
 from collections import defaultdict
+from dataclasses import dataclass, field
 from typing import List, Sequence, Union, Any, Literal, Set, Optional, Dict, Tuple
 
+import numpy as np
 import pandas as pd
-from crispo.llms import LargeLanguageModel
+from crispo.llms import LargeLanguageModel, FailedGeneration, RetryPolicy
+from crispo.llms.scheduler import Priority, request_priority
 from tqdm import tqdm
 
-from crispo.metrics.floats import FloatDict
 from crispo.metrics.metric import Metric, MetricDict
 from crispo.optimizer.meta_prompt import MetaPrompt
 from crispo.task.critique import CritiquePrompt
 from crispo.task.example import Example
 from crispo.task.prompt import TaskPrompt
+from crispo.trainer.leaderboard import Leaderboard
+from crispo.trainer.racing import RacingPolicy
+from crispo.trainer.example_scores import ExampleScoreSums, lowest
+from crispo.utilities.async_util import run_until_complete
+from crispo.utilities.io_util import save_pickle, load_pickle
 from crispo.utilities.log_util import init_logger
 from crispo.utilities.plot_util import boxplot
 from crispo.utilities.time_util import CountdownTimer
 
 
+@dataclass
+class TrainingState:
+    """
+    The search state ``Trainer.fit`` carries from one step to the next.
+    """
+
+    prompt_score_pairs: Leaderboard = None
+    prompt_score_pairs_dev: Leaderboard = None
+    prompt_steps: Dict[TaskPrompt, int] = field(default_factory=dict)
+    example_score_sums: ExampleScoreSums = None
+    stepwise_scores: Dict[str, list] = field(
+        default_factory=lambda: {"train": [], "dev": []}
+    )
+    critiques: Dict[TaskPrompt, str] = field(default_factory=lambda: defaultdict(str))
+    best_prompt: Optional[TaskPrompt] = None
+    best_score: Any = None
+    best_prompt_dev: Optional[TaskPrompt] = None
+    best_prompt_score_dev: Any = None
+    best_prompt_dev_step: int = 0
+    # The next step to run and the prompts it evaluates
+    step: int = 0
+    new_prompts: Dict[TaskPrompt, None] = field(default_factory=dict)
+    # The prompts dropped by racing, whose train score is only estimated on a subset. They are kept in
+    # ``prompt_score_pairs`` so the meta LLM sees them and does not propose them again, but never evaluated on dev
+    # nor selected as the best prompt.
+    partial_train_prompts: Set[TaskPrompt] = field(default_factory=set)
+
+
 class Trainer(abc.ABC):
-    def __init__(self, save_dir: str) -> None:
+    def __init__(self, save_dir: str, retry_policy: RetryPolicy = None) -> None:
         super().__init__()
         self.logger = init_logger(name="log.md", save_dir=save_dir, mode="a")
         self.save_dir = save_dir
+        self.retry_policy = retry_policy or RetryPolicy()
 
     def fit(
         self,
@@ -56,31 +94,78 @@ class Trainer(abc.ABC):
         max_retry=5,
         refresh_meta_prompt_each_attempt=True,
         save_every_n_steps=1,
+        flatten_evaluation=False,
+        racing: RacingPolicy = None,
+        resume=False,
     ) -> (Dict[TaskPrompt, float], str, float):
-        timer = CountdownTimer(num_search_steps + 1)
-        prompt_score_pairs = dict()
-        prompt_score_pairs_dev = dict()
-        best_prompt = None
-        best_prompt_dev, best_prompt_dev_step = None, 0
-        prompt_steps = dict()
-        accumulative_few_shot_example_scores = [[] for _ in range(len(train))]
-        stepwise_scores = {"train": [], "dev": []}
-        critiques = defaultdict(str)
+        if (
+            racing is not None
+            and isinstance(metric, MetricDict)
+            and metric.primary == "rank"
+        ):
+            raise ValueError("Racing needs a per-example score, which the rank is not")
+        state = self.init_state(train, initial_task_prompts, metric, resume)
+        timer = CountdownTimer(num_search_steps + 1 - state.step)
 
         if task_llm is None:
             task_llm = meta_llm
 
-        new_prompts = dict.fromkeys(initial_task_prompts)
+        new_prompts = state.new_prompts
 
-        for step in range(num_search_steps + 1):
-            self.logger.info(f"[yellow]## Step {step}/{num_search_steps}[/yellow]")
-            step_save_dir = f"{self.save_dir}/step-{step:03}"
-            os.makedirs(step_save_dir, exist_ok=True)
-            step_few_shot_example_scores = [[] for _ in range(len(train))]
-            stepwise_scores["train"].append([])
-            stepwise_scores["dev"].append([])
+        for step in range(state.step, num_search_steps + 1):
+            step_save_dir = self.start_step(state, step, num_search_steps)
 
+            raced = dict()
+            predicted = None
+            if racing is not None:
+                raced = self.race(
+                    list(new_prompts),
+                    train,
+                    task_llm,
+                    metric,
+                    racing,
+                    incumbent=max(
+                        (
+                            metric.key(score)
+                            for prompt, score in state.prompt_score_pairs.items()
+                            if prompt not in state.partial_train_prompts
+                        ),
+                        default=None,
+                    ),
+                    desc=f"Racing {len(new_prompts)} prompts on train",
+                )
+            elif flatten_evaluation:
+                # Submit all (prompt, example) pairs of this step as one batch
+                predicted = self.predict_many(
+                    [example.x for example in train],
+                    list(new_prompts),
+                    task_llm,
+                    desc=f"Evaluating {len(new_prompts)} prompts on train",
+                )
             for pi, task_prompt in enumerate(new_prompts):
+                indices, _predicted, _scores = raced.get(
+                    task_prompt, (None, predicted[pi] if predicted else None, None)
+                )
+                if indices is not None and len(indices) < len(train):
+                    # Dropped early, keep its estimate so it is not proposed again
+                    overall_score, _, _ = self.evaluate(
+                        task_prompt=task_prompt,
+                        dataset=[train[i] for i in indices],
+                        task_llm=task_llm,
+                        metric=metric,
+                        save_path=f"{step_save_dir}/train-prompt-{pi + 1:03}.csv",
+                        prompt_score_pairs=state.prompt_score_pairs,
+                        predicted=_predicted,
+                        scores=_scores,
+                    )
+                    state.prompt_steps[task_prompt] = step
+                    state.partial_train_prompts.add(task_prompt)
+                    self.logger.info(
+                        f"`{task_prompt.short_str()}` dropped after {len(indices)}/{len(train)} examples "
+                        f"with an estimated score of [light_cyan]{overall_score:.4f}[/light_cyan] on train"
+                    )
+                    continue
+
                 # train
                 overall_score, scores, predictions = self.evaluate(
                     task_prompt=task_prompt,
@@ -90,44 +175,28 @@ class Trainer(abc.ABC):
                     desc=f"Evaluating {pi + 1}/{len(new_prompts)} prompts on train",
                     save_path=f"{step_save_dir}/train-prompt-{pi + 1:03}.csv",
                     # we use dev set to select in context examples for train. This argument will be used with Trainer_fewshot class.
-                    prompt_score_pairs=prompt_score_pairs,
+                    prompt_score_pairs=state.prompt_score_pairs,
+                    predicted=_predicted,
+                    scores=_scores,
+                )
+                self.record_train_score(
+                    state,
+                    step,
+                    task_prompt,
+                    overall_score,
+                    scores,
+                    metric,
                 )
-
-                prompt_score_pairs[task_prompt] = overall_score
-                prompt_steps[task_prompt] = step
-                stepwise_scores["train"][-1].append(overall_score)
-                for i, score in enumerate(scores):
-                    step_few_shot_example_scores[i].append(score)
-                    accumulative_few_shot_example_scores[i].append(score)
-
-                # report in log
-                if (
-                    best_prompt is None
-                    or metric.key(overall_score) > prompt_score_pairs[best_prompt]
-                ):
-                    best_score = overall_score
-                    best_prompt = task_prompt
-                    msg = (
-                        f"New best prompt `[light_magenta]{str(best_prompt)}[/light_magenta]` score "
-                        f"on train: [light_cyan]{overall_score:.4f}[/light_cyan]"
-                    )
-                else:
-                    msg = (
-                        f"`{task_prompt.short_str()}` score on train: [light_cyan]{overall_score:.4f}"
-                        f"[/light_cyan], worse than the best score [red]{best_score:.4f}"
-                        f"[/red] at step [light_yellow]{prompt_steps[best_prompt]}[/light_yellow]"
-                    )
-                self.logger.info(msg)
 
                 # critique
                 if critique_prompt:
-                    critiques = self.update_critique(
+                    state.critiques = self.update_critique(
                         scores=scores,
                         critique_prompt=critique_prompt,
                         task_prompt=task_prompt,
                         predictions=predictions,
                         train=train,
-                        critiques=critiques,
+                        critiques=state.critiques,
                         critique_example_selection_criteria=critique_example_selection_criteria,
                         max_score_of_example_in_critique=max_score_of_example_in_critique,
                         meta_llm=meta_llm,
@@ -136,69 +205,44 @@ class Trainer(abc.ABC):
                     )
 
             # collect the prompt history
-            prompt_score_pairs = self.sort_prompts_best_to_worst(
-                prompt_score_pairs, metric
-            )
-            best_prompt, best_score = list(prompt_score_pairs.items())[0]
-
-            timer.log(
-                f"Best prompt on train `[light_magenta]{best_prompt.short_str()}[/light_magenta]` "
-                f"scored [light_red]{best_score:.4f}[/light_red] at "
-                f"step [light_yellow]{prompt_steps[best_prompt]}[/light_yellow]",
-                logger=self.logger,
-                newline=True,
-                ratio_percentage=False,
-                ratio=False,
-            )
+            self.finish_train_evaluation(state, metric, timer)
 
             # run evaluate on best train set prompt
             if step % dev_evaluation_per_n_steps == 0 and dev:
-                prompts_to_eval_dev = new_prompts
-                if best_prompt not in prompt_score_pairs_dev:
-                    prompts_to_eval_dev[best_prompt] = None
-
-                for pi, prompt in enumerate(prompts_to_eval_dev):
-                    if dev_evaluation_threshold is not None and metric.key(
-                        prompt_score_pairs[prompt]
-                    ) < metric.key(dev_evaluation_threshold):
-                        continue
+                prompts_to_eval_dev, num_prompts_to_eval_dev = (
+                    self.select_prompts_to_eval_dev(
+                        state, new_prompts, metric, dev_evaluation_threshold
+                    )
+                )
+                predicted_dev = dict()
+                if flatten_evaluation:
+                    _prompts = [prompt for _, prompt in prompts_to_eval_dev]
+                    predicted_dev = dict(
+                        zip(
+                            _prompts,
+                            self.predict_many(
+                                [example.x for example in dev],
+                                _prompts,
+                                task_llm,
+                                desc=f"Evaluating {len(_prompts)} prompts on dev",
+                            ),
+                        )
+                    )
+                for pi, prompt in prompts_to_eval_dev:
                     overall_score_dev, _, _ = self.evaluate(
                         task_prompt=prompt,
                         dataset=dev,
                         task_llm=task_llm,
                         metric=metric,
-                        desc=f"Evaluating {pi + 1}/{len(prompts_to_eval_dev)} prompts on dev",
+                        desc=f"Evaluating {pi + 1}/{num_prompts_to_eval_dev} prompts on dev",
                         save_path=f"{step_save_dir}/dev-prompt-{pi + 1:03}.csv",
                         # we use train set to select in context examples for dev. This argument will be used with Trainer_fewshot class.
-                        prompt_score_pairs=prompt_score_pairs_dev,
+                        prompt_score_pairs=state.prompt_score_pairs_dev,
+                        predicted=predicted_dev.get(prompt),
                     )
-
-                    stepwise_scores["dev"][-1].append(overall_score_dev)
-                    prompt_score_pairs_dev[prompt] = overall_score_dev
-                    prompt_score_pairs_dev = self.sort_prompts_best_to_worst(
-                        prompt_score_pairs_dev, metric
+                    self.record_dev_score(
+                        state, step, prompt, overall_score_dev, metric
                     )
-                    if (
-                        best_prompt_dev is None
-                        or metric.key(overall_score_dev)
-                        > prompt_score_pairs_dev[best_prompt_dev]
-                    ):
-                        best_prompt_score_dev, best_prompt_dev, best_prompt_dev_step = (
-                            overall_score_dev,
-                            prompt,
-                            step,
-                        )
-                        msg = (
-                            f"New best prompt `[light_magenta]{str(best_prompt_dev)}[/light_magenta]` score "
-                            f"on dev: [light_cyan]{overall_score_dev:.4f}[/light_cyan]"
-                        )
-                    else:
-                        msg = (
-                            f"`{prompt.short_str()}` score on dev: [light_cyan]{overall_score_dev:.4f}"
-                            f"[/light_cyan], worse than the best score [red]{best_prompt_score_dev:.4f}"
-                            f"[/red] at step [light_yellow]{best_prompt_dev_step}[/light_yellow]"
-                        )
-                    self.logger.info(msg)
 
             if step == num_search_steps:
                 break
@@ -210,11 +254,11 @@ class Trainer(abc.ABC):
             # Generate new task prompts
             new_prompts = self.generating_new_prompts(
                 meta_prompt=meta_prompt,
-                prompt_score_pairs=prompt_score_pairs,
+                prompt_score_pairs=state.prompt_score_pairs,
                 train=train,
-                step_few_shot_example_scores=step_few_shot_example_scores,
-                accumulative_few_shot_example_scores=accumulative_few_shot_example_scores,
-                critiques=critiques,
+                step_few_shot_example_scores=state.example_score_sums.step_sums,
+                accumulative_few_shot_example_scores=state.example_score_sums.total_sums,
+                critiques=state.critiques,
                 step_save_dir=step_save_dir,
                 meta_llm=meta_llm,
                 metric=metric,
@@ -227,31 +271,379 @@ class Trainer(abc.ABC):
             )
 
             # save every n steps
+            state.step, state.new_prompts = step + 1, new_prompts
             if (step + 1) % save_every_n_steps == 0:
-                # self.logger.debug('### Final Prompts\n')
-                prompts_df = self.convert_prompt_scores_to_df(
-                    prompt_score_pairs, prompt_steps
+                self.save_progress(state, metric)
+
+        return dict(state.prompt_score_pairs.items()), state.best_prompt_dev
+
+    async def afit(
+        self,
+        train: List[Example],
+        dev: Optional[List[Example]],
+        initial_task_prompts: Set[TaskPrompt],
+        meta_prompt: MetaPrompt,
+        meta_llm: LargeLanguageModel,
+        metric: Metric,
+        task_llm: LargeLanguageModel = None,
+        critique_prompt: CritiquePrompt = None,
+        num_examples_in_critique=10,
+        max_score_of_example_in_critique=None,
+        critique_example_selection_criteria: Literal[
+            "random", "lowest_score"
+        ] = "random",
+        num_search_steps=200,
+        num_new_prompts_in_each_step=8,
+        few_shot_selection_criteria: Literal[
+            "random", "current_lowest_score", "accumulative_lowest_score"
+        ] = "current_lowest_score",
+        num_few_shot_examples_in_meta_prompt=3,
+        num_task_prompts_in_meta_prompt=20,
+        dev_evaluation_per_n_steps=5,
+        dev_evaluation_threshold=None,
+        max_retry=5,
+        refresh_meta_prompt_each_attempt=True,
+        save_every_n_steps=1,
+        racing: RacingPolicy = None,
+        resume=False,
+    ) -> (Dict[TaskPrompt, float], str, float):
+        """
+        A pipelined ``fit``. The generations of all new prompts are in flight at once, each prompt is scored and
+        critiqued as soon as its predictions arrive, and the dev evaluation runs while the next prompts are generated.
+        State is updated and random numbers are drawn in the same order as ``fit``, so both return the same results
+        for the same seeds. Racing is not supported, since every prompt is evaluated on the full train set at once.
+        """
+        if racing is not None:
+            raise ValueError("Racing is only supported by fit")
+        loop = asyncio.get_running_loop()
+        state = self.init_state(train, initial_task_prompts, metric, resume)
+        timer = CountdownTimer(num_search_steps + 1 - state.step)
+
+        if task_llm is None:
+            task_llm = meta_llm
+
+        new_prompts = state.new_prompts
+
+        for step in range(state.step, num_search_steps + 1):
+            step_save_dir = self.start_step(state, step, num_search_steps)
+
+            predicting = [
+                asyncio.ensure_future(
+                    self.apredict_many(
+                        [example.x for example in train], [task_prompt], task_llm
+                    )
                 )
-                # self.logger.debug(prompts_df.to_markdown(index=False) + '\n')
-                prompts_df.to_json(
-                    f"{self.save_dir}/prompts.json", indent=2, orient="records"
+                for task_prompt in new_prompts
+            ]
+            critiquing = []
+            for pi, (task_prompt, predicted) in enumerate(zip(new_prompts, predicting)):
+                (predicted,) = await predicted
+                # Score in a worker thread while the generations of the other prompts keep arriving
+                overall_score, scores, predictions = await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        self.evaluate,
+                        task_prompt=task_prompt,
+                        dataset=train,
+                        task_llm=task_llm,
+                        metric=metric,
+                        save_path=f"{step_save_dir}/train-prompt-{pi + 1:03}.csv",
+                        prompt_score_pairs=state.prompt_score_pairs,
+                        predicted=predicted,
+                    ),
                 )
+                self.record_train_score(
+                    state,
+                    step,
+                    task_prompt,
+                    overall_score,
+                    scores,
+                    metric,
+                )
+                if critique_prompt:
+                    _cp = self.fill_critique_prompt(
+                        scores=scores,
+                        critique_prompt=critique_prompt,
+                        task_prompt=task_prompt,
+                        predictions=predictions,
+                        train=train,
+                        critique_example_selection_criteria=critique_example_selection_criteria,
+                        max_score_of_example_in_critique=max_score_of_example_in_critique,
+                        num_examples_in_critique=num_examples_in_critique,
+                        metric=metric,
+                    )
+                    with request_priority(Priority.CRITICAL):
+                        critiquing.append(
+                            (
+                                task_prompt,
+                                asyncio.ensure_future(meta_llm.generate_async(_cp)),
+                            )
+                        )
+
+            self.finish_train_evaluation(state, metric, timer)
 
-                prompts_df_dev = self.convert_prompt_scores_to_df(
-                    prompt_score_pairs_dev, prompt_steps
+            evaluating_dev = None
+            if step % dev_evaluation_per_n_steps == 0 and dev:
+                evaluating_dev = asyncio.ensure_future(
+                    self.aevaluate_dev(
+                        state,
+                        step,
+                        step_save_dir,
+                        new_prompts,
+                        dev,
+                        task_llm,
+                        metric,
+                        dev_evaluation_threshold,
+                    )
                 )
-                # self.logger.debug(prompts_df_dev.to_markdown(index=False) + '\n')
-                prompts_df_dev.to_json(
-                    f"{self.save_dir}/prompts_dev.json", indent=2, orient="records"
+            for task_prompt, critique in critiquing:
+                state.critiques = self.record_critique(
+                    state.critiques, critique_prompt, task_prompt, await critique
                 )
 
-                for _split, _scores in stepwise_scores.items():
-                    fig = boxplot(
-                        _scores, xlabel="Step", ylabel=metric.__class__.__name__
-                    )
-                    fig.savefig(f"{self.save_dir}/stepwise_scores_{_split}.png")
+            if step == num_search_steps:
+                if evaluating_dev:
+                    await evaluating_dev
+                break
+
+            new_prompts = await self.agenerating_new_prompts(
+                meta_prompt=meta_prompt,
+                prompt_score_pairs=state.prompt_score_pairs,
+                train=train,
+                step_few_shot_example_scores=state.example_score_sums.step_sums,
+                accumulative_few_shot_example_scores=state.example_score_sums.total_sums,
+                critiques=state.critiques,
+                step_save_dir=step_save_dir,
+                meta_llm=meta_llm,
+                metric=metric,
+                few_shot_selection_criteria=few_shot_selection_criteria,
+                num_few_shot_examples_in_meta_prompt=num_few_shot_examples_in_meta_prompt,
+                num_task_prompts_in_meta_prompt=num_task_prompts_in_meta_prompt,
+                num_new_prompts_in_each_step=num_new_prompts_in_each_step,
+                refresh_meta_prompt_each_attempt=refresh_meta_prompt_each_attempt,
+                max_retry=max_retry,
+            )
+            if evaluating_dev:
+                await evaluating_dev
+
+            state.step, state.new_prompts = step + 1, new_prompts
+            if (step + 1) % save_every_n_steps == 0:
+                self.save_progress(state, metric)
+
+        return dict(state.prompt_score_pairs.items()), state.best_prompt_dev
+
+    async def aevaluate_dev(
+        self,
+        state,
+        step,
+        step_save_dir,
+        new_prompts,
+        dev,
+        task_llm,
+        metric,
+        dev_evaluation_threshold,
+    ):
+        loop = asyncio.get_running_loop()
+        prompts_to_eval_dev, _ = self.select_prompts_to_eval_dev(
+            state, new_prompts, metric, dev_evaluation_threshold
+        )
+        with request_priority(Priority.BULK):
+            predicted_dev = await self.apredict_many(
+                [example.x for example in dev],
+                [prompt for _, prompt in prompts_to_eval_dev],
+                task_llm,
+            )
+        for (pi, prompt), predicted in zip(prompts_to_eval_dev, predicted_dev):
+            overall_score_dev, _, _ = await loop.run_in_executor(
+                None,
+                functools.partial(
+                    self.evaluate,
+                    task_prompt=prompt,
+                    dataset=dev,
+                    task_llm=task_llm,
+                    metric=metric,
+                    save_path=f"{step_save_dir}/dev-prompt-{pi + 1:03}.csv",
+                    prompt_score_pairs=state.prompt_score_pairs_dev,
+                    predicted=predicted,
+                ),
+            )
+            self.record_dev_score(state, step, prompt, overall_score_dev, metric)
+
+    def init_state(
+        self, train, initial_task_prompts, metric, resume=False
+    ) -> TrainingState:
+        state = self.load_checkpoint() if resume else None
+        if state is None:
+            state = TrainingState(
+                prompt_score_pairs=Leaderboard(metric),
+                prompt_score_pairs_dev=Leaderboard(metric),
+                example_score_sums=ExampleScoreSums(len(train)),
+                new_prompts=dict.fromkeys(initial_task_prompts),
+            )
+        else:
+            state.prompt_score_pairs.metric = metric
+            state.prompt_score_pairs_dev.metric = metric
+            self.logger.info(
+                f"[yellow]Resuming from step {state.step} of {self.checkpoint_path}[/yellow]"
+            )
+        return state
+
+    @property
+    def checkpoint_path(self) -> str:
+        return f"{self.save_dir}/checkpoint.pkl"
+
+    def save_checkpoint(self, state: TrainingState):
+        """
+        Save the search state and the RNG state, replacing the previous checkpoint atomically so a crash while saving
+        never leaves a truncated file behind.
+        """
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        save_pickle({"state": state, "random": random.getstate()}, tmp_path)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> Optional[TrainingState]:
+        """
+        Load the search state and restore the RNG state, or return ``None`` if there is no checkpoint.
+        """
+        if not os.path.isfile(self.checkpoint_path):
+            return None
+        checkpoint = load_pickle(self.checkpoint_path)
+        random.setstate(checkpoint["random"])
+        return checkpoint["state"]
+
+    def start_step(self, state, step, num_search_steps):
+        self.logger.info(f"[yellow]## Step {step}/{num_search_steps}[/yellow]")
+        step_save_dir = f"{self.save_dir}/step-{step:03}"
+        os.makedirs(step_save_dir, exist_ok=True)
+        state.example_score_sums.start_step()
+        state.stepwise_scores["train"].append([])
+        state.stepwise_scores["dev"].append([])
+        return step_save_dir
+
+    def record_train_score(
+        self,
+        state,
+        step,
+        task_prompt,
+        overall_score,
+        scores,
+        metric,
+    ):
+        state.prompt_score_pairs[task_prompt] = overall_score
+        state.prompt_steps[task_prompt] = step
+        state.stepwise_scores["train"][-1].append(overall_score)
+        state.example_score_sums.add(scores)
+
+        # report in log
+        if (
+            state.best_prompt is None
+            or metric.key(overall_score) > state.prompt_score_pairs[state.best_prompt]
+        ):
+            state.best_score = overall_score
+            state.best_prompt = task_prompt
+            msg = (
+                f"New best prompt `[light_magenta]{str(state.best_prompt)}[/light_magenta]` score "
+                f"on train: [light_cyan]{overall_score:.4f}[/light_cyan]"
+            )
+        else:
+            msg = (
+                f"`{task_prompt.short_str()}` score on train: [light_cyan]{overall_score:.4f}"
+                f"[/light_cyan], worse than the best score [red]{state.best_score:.4f}"
+                f"[/red] at step [light_yellow]{state.prompt_steps[state.best_prompt]}[/light_yellow]"
+            )
+        self.logger.info(msg)
+
+    def finish_train_evaluation(self, state, metric, timer):
+        state.prompt_score_pairs = self.sort_prompts_best_to_worst(
+            state.prompt_score_pairs, metric
+        )
+        state.best_prompt, state.best_score = next(
+            (prompt, score)
+            for prompt, score in state.prompt_score_pairs.items()
+            if prompt not in state.partial_train_prompts
+        )
 
-        return prompt_score_pairs, best_prompt_dev
+        timer.log(
+            f"Best prompt on train `[light_magenta]{state.best_prompt.short_str()}[/light_magenta]` "
+            f"scored [light_red]{state.best_score:.4f}[/light_red] at "
+            f"step [light_yellow]{state.prompt_steps[state.best_prompt]}[/light_yellow]",
+            logger=self.logger,
+            newline=True,
+            ratio_percentage=False,
+            ratio=False,
+        )
+
+    def select_prompts_to_eval_dev(
+        self, state, new_prompts, metric, dev_evaluation_threshold
+    ) -> Tuple[List[Tuple[int, TaskPrompt]], int]:
+        """
+        Select the new prompts evaluated on the full train set and the best prompt on train for dev evaluation.
+
+        Returns:
+            The ``(index, prompt)`` pairs passing ``dev_evaluation_threshold`` and the number of candidates.
+        """
+        prompts_to_eval_dev = dict(
+            (prompt, None)
+            for prompt in new_prompts
+            if prompt not in state.partial_train_prompts
+        )
+        if state.best_prompt not in state.prompt_score_pairs_dev:
+            prompts_to_eval_dev[state.best_prompt] = None
+        selected = [
+            (pi, prompt)
+            for pi, prompt in enumerate(prompts_to_eval_dev)
+            if dev_evaluation_threshold is None
+            or metric.key(state.prompt_score_pairs[prompt])
+            >= metric.key(dev_evaluation_threshold)
+        ]
+        return selected, len(prompts_to_eval_dev)
+
+    def record_dev_score(self, state, step, prompt, overall_score_dev, metric):
+        state.stepwise_scores["dev"][-1].append(overall_score_dev)
+        state.prompt_score_pairs_dev[prompt] = overall_score_dev
+        state.prompt_score_pairs_dev = self.sort_prompts_best_to_worst(
+            state.prompt_score_pairs_dev, metric
+        )
+        if (
+            state.best_prompt_dev is None
+            or metric.key(overall_score_dev)
+            > state.prompt_score_pairs_dev[state.best_prompt_dev]
+        ):
+            state.best_prompt_score_dev = overall_score_dev
+            state.best_prompt_dev = prompt
+            state.best_prompt_dev_step = step
+            msg = (
+                f"New best prompt `[light_magenta]{str(state.best_prompt_dev)}[/light_magenta]` score "
+                f"on dev: [light_cyan]{overall_score_dev:.4f}[/light_cyan]"
+            )
+        else:
+            msg = (
+                f"`{prompt.short_str()}` score on dev: [light_cyan]{overall_score_dev:.4f}"
+                f"[/light_cyan], worse than the best score [red]{state.best_prompt_score_dev:.4f}"
+                f"[/red] at step [light_yellow]{state.best_prompt_dev_step}[/light_yellow]"
+            )
+        self.logger.info(msg)
+
+    def save_progress(self, state, metric):
+        self.save_checkpoint(state)
+        # self.logger.debug('### Final Prompts\n')
+        prompts_df = self.convert_prompt_scores_to_df(
+            state.prompt_score_pairs, state.prompt_steps
+        )
+        # self.logger.debug(prompts_df.to_markdown(index=False) + '\n')
+        prompts_df.to_json(f"{self.save_dir}/prompts.json", indent=2, orient="records")
+
+        prompts_df_dev = self.convert_prompt_scores_to_df(
+            state.prompt_score_pairs_dev, state.prompt_steps
+        )
+        # self.logger.debug(prompts_df_dev.to_markdown(index=False) + '\n')
+        prompts_df_dev.to_json(
+            f"{self.save_dir}/prompts_dev.json", indent=2, orient="records"
+        )
+
+        for _split, _scores in state.stepwise_scores.items():
+            fig = boxplot(_scores, xlabel="Step", ylabel=metric.__class__.__name__)
+            fig.savefig(f"{self.save_dir}/stepwise_scores_{_split}.png")
 
     def update_critique(
         self,
@@ -267,26 +659,59 @@ class Trainer(abc.ABC):
         num_examples_in_critique,
         metric,
     ):
+        _cp = self.fill_critique_prompt(
+            scores=scores,
+            critique_prompt=critique_prompt,
+            task_prompt=task_prompt,
+            predictions=predictions,
+            train=train,
+            critique_example_selection_criteria=critique_example_selection_criteria,
+            max_score_of_example_in_critique=max_score_of_example_in_critique,
+            num_examples_in_critique=num_examples_in_critique,
+            metric=metric,
+        )
+        with request_priority(Priority.CRITICAL):
+            _gen = run_until_complete(meta_llm.generate_async(_cp))
+        return self.record_critique(critiques, critique_prompt, task_prompt, _gen)
+
+    def fill_critique_prompt(
+        self,
+        scores,
+        critique_prompt,
+        task_prompt,
+        predictions,
+        train,
+        critique_example_selection_criteria,
+        max_score_of_example_in_critique,
+        num_examples_in_critique,
+        metric,
+    ) -> str:
         if critique_example_selection_criteria == "random":
             indices = list(range(len(scores)))
             random.shuffle(indices)
+            if max_score_of_example_in_critique is not None:
+                indices = [
+                    _i
+                    for _i in indices
+                    if metric.key(scores[_i]) < max_score_of_example_in_critique
+                ]
         else:
-            indices = sorted(range(len(scores)), key=lambda _i: metric.key(scores[_i]))
-        if max_score_of_example_in_critique is not None:
-            indices = [
-                _i
-                for _i in indices
-                if metric.key(scores[_i]) < max_score_of_example_in_critique
-            ]
+            keys = np.array([metric.key(score) for score in scores], dtype=float)
+            candidates = np.arange(len(keys))
+            if max_score_of_example_in_critique is not None:
+                candidates = np.flatnonzero(keys < max_score_of_example_in_critique)
+            indices = candidates[
+                lowest(keys[candidates], num_examples_in_critique)
+            ].tolist()
 
-        _cp = critique_prompt.fill(
+        return critique_prompt.fill(
             str(task_prompt),
             [predictions[_i] for _i in indices][:num_examples_in_critique],
             [train[_i] for _i in indices][:num_examples_in_critique],
         )
-        _gen = meta_llm.generate(_cp)
-        critique = critique_prompt.parse(_gen)
-        # noinspection PyUnboundLocalVariable
+
+    def record_critique(self, critiques, critique_prompt, task_prompt, generation):
+        critique = critique_prompt.parse(generation)
         critiques[task_prompt] = critique
         self.logger.info(f"Critique: [white]{critique}[/white]")
         return critiques
@@ -320,9 +745,14 @@ class Trainer(abc.ABC):
         else:
             few_shot_examples = None
         # noinspection PyTypeChecker
-        promising_task_prompt_score_pairs = list(reversed(prompt_score_pairs.items()))[
-            -num_task_prompts_in_meta_prompt:
-        ]
+        if isinstance(prompt_score_pairs, Leaderboard):
+            promising_task_prompt_score_pairs = list(
+                reversed(prompt_score_pairs.top(num_task_prompts_in_meta_prompt))
+            )
+        else:
+            promising_task_prompt_score_pairs = list(
+                reversed(prompt_score_pairs.items())
+            )[-num_task_prompts_in_meta_prompt:]
         if hasattr(metric, "get_description"):
             promising_task_prompt_score_pairs = [
                 (prompt, metric.get_description(score))
@@ -335,11 +765,16 @@ class Trainer(abc.ABC):
                 critiques.get(p, None) for p, _ in promising_task_prompt_score_pairs
             ],
         )
+        meta_prompt_text = meta_prompt.request_candidates(meta_prompt_text)
+        meta_prompt_text = meta_prompt.mark_static_prefix(meta_prompt_text)
         # self.logger.debug('### Meta Prompt\n')
         # self.logger.debug('> ' + meta_prompt_text.replace('\n', '\n> '))
         return meta_prompt_text
 
-    def generating_new_prompts(
+    def generating_new_prompts(self, *args, **kwargs):
+        return run_until_complete(self.agenerating_new_prompts(*args, **kwargs))
+
+    async def agenerating_new_prompts(
         self,
         meta_prompt,
         prompt_score_pairs,
@@ -385,28 +820,41 @@ class Trainer(abc.ABC):
                         num_task_prompts_in_meta_prompt=num_task_prompts_in_meta_prompt,
                     )
 
-                generations = meta_llm.batch_generate(
-                    [meta_prompt_text]
-                    * (num_new_prompts_in_each_step - len(new_prompts)),
-                    desc=None,
-                )
+                # Each call returns up to ``num_candidates`` new prompts
+                num_candidates = max(1, meta_prompt.num_candidates)
+                with request_priority(Priority.CRITICAL):
+                    generations = await meta_llm.agenerate_samples(
+                        meta_prompt_text,
+                        math.ceil(
+                            (num_new_prompts_in_each_step - len(new_prompts))
+                            / num_candidates
+                        ),
+                    )
                 for generation in generations:
-                    new_prompt = meta_prompt.parse(generation)
-                    if (
-                        new_prompt
-                        and new_prompt not in prompt_score_pairs
-                        and new_prompt not in new_prompts
-                    ):
-                        new_prompts[new_prompt] = None
-                        pbar.update()
-                        table.append(
-                            {
-                                "meta_prompt": meta_prompt_text,
-                                "generation": generation,
-                                "new_prompt": new_prompt,
-                            }
-                        )
+                    if num_candidates > 1:
+                        candidates = meta_prompt.parse_many(generation)
                     else:
+                        candidates = [meta_prompt.parse(generation)]
+                    # A retry is counted per call that yields no new prompt, however many candidates it holds
+                    num_new_prompts = len(new_prompts)
+                    for new_prompt in candidates:
+                        if len(new_prompts) >= num_new_prompts_in_each_step:
+                            break
+                        if (
+                            new_prompt
+                            and new_prompt not in prompt_score_pairs
+                            and new_prompt not in new_prompts
+                        ):
+                            new_prompts[new_prompt] = None
+                            pbar.update()
+                            table.append(
+                                {
+                                    "meta_prompt": meta_prompt_text,
+                                    "generation": generation,
+                                    "new_prompt": new_prompt,
+                                }
+                            )
+                    if len(new_prompts) == num_new_prompts:
                         counter += 1
             pd.DataFrame(table).to_csv(f"{step_save_dir}/meta-prompts.csv", index=False)
         return new_prompts
@@ -420,51 +868,28 @@ class Trainer(abc.ABC):
         desc: str = None,
         save_path=None,
         prompt_score_pairs=None,
+        predicted: Tuple[list, list, list] = None,
+        scores: List[float] = None,
     ) -> Tuple[float, List[float], list]:
+        """
+        Score a task prompt on a dataset.
+
+        Args:
+            predicted: The ``(prompts, generations, predictions)`` already produced by ``predict_many``, in which case
+                ``task_llm`` is not called again.
+            scores: The per-example scores of ``predicted``, if already computed.
+        """
         xs, ys = [example.x for example in dataset], [example.y for example in dataset]
-        prompts, generations, predictions = self.predict(
-            xs, task_prompt, task_llm, desc
-        )
-        scores = [
-            metric.score(p, e.y, x=e.x)
-            for p, e in tqdm(
-                zip(predictions, dataset),
-                total=len(dataset),
-                desc=metric.__class__.__name__,
-            )
-        ]
+        if predicted is None:
+            predicted = self.predict(xs, task_prompt, task_llm, desc)
+        prompts, generations, predictions = predicted
+        if scores is None:
+            scores = metric.score_batch(predictions, ys, xs)
         overall_score = metric.aggregate(scores)
         if prompt_score_pairs is not None:
             prompt_score_pairs[task_prompt] = overall_score
-            if (
-                isinstance(overall_score, FloatDict)
-                and isinstance(metric, MetricDict)
-                and metric.primary == "rank"
-            ):
-                score_pairs = list(prompt_score_pairs.values())
-                # Update the average rank of each prompt
-                metric_scores = defaultdict(list)
-                for prompt_scores in score_pairs:
-                    assert isinstance(prompt_scores, FloatDict)
-                    prompt_scores.scores.pop("rank", None)
-                    for name, score in prompt_scores.scores.items():
-                        metric_scores[name].append(score)
-                for prompt_scores in score_pairs:
-                    ranks = []
-                    for name, _scores in metric_scores.items():
-                        ranks.append(
-                            sorted(_scores, key=metric[name].key, reverse=True).index(
-                                prompt_scores.scores[name]
-                            )
-                        )
-                    prompt_scores.scores["rank"] = (
-                        statistics.mean(ranks) if ranks else 0
-                    )
-                for prompt, prompt_scores in list(zip(prompt_score_pairs, score_pairs)):
-                    prompt_score_pairs[prompt] = FloatDict(
-                        prompt_scores.scores["rank"], **prompt_scores.scores
-                    )
-                overall_score = prompt_score_pairs[task_prompt]
+            # A leaderboard ranks the new score among the others
+            overall_score = prompt_score_pairs[task_prompt]
 
         self.save_evaluation_info(
             xs, ys, predictions, scores, prompts, generations, save_path
@@ -472,6 +897,90 @@ class Trainer(abc.ABC):
         self.logger.info(f"{save_path} overall score: {overall_score}")
         return overall_score, scores, predictions
 
+    def race(
+        self,
+        task_prompts: List[TaskPrompt],
+        dataset: List[Example],
+        task_llm: LargeLanguageModel,
+        metric: Metric,
+        racing: RacingPolicy,
+        incumbent: Optional[float] = None,
+        desc: str = None,
+    ) -> Dict[TaskPrompt, Tuple[List[int], Tuple[list, list, list], list]]:
+        """
+        Evaluate the candidates round by round on growing subsets of ``dataset``, each round being one batch, and
+        drop the dominated ones as described in ``RacingPolicy``.
+
+        Args:
+            incumbent: The best ``metric.key`` of the prompts evaluated on the full ``dataset`` so far.
+
+        Returns:
+            For each candidate, the indices of the examples it was evaluated on, its
+            ``(prompts, generations, predictions)`` and its scores on them, in the order of ``dataset``.
+        """
+        order = list(range(len(dataset)))
+        random.Random(racing.seed).shuffle(order)
+        sizes = racing.sizes(len(dataset))
+        # A lower and an upper bound per candidate in every round but the last
+        num_bounds = 2 * len(task_prompts) * (len(sizes) - 1)
+        results = dict((p, ([], [], [], [], [])) for p in task_prompts)
+        alive = list(task_prompts)
+        start = 0
+        for size in sizes:
+            indices = order[start:size]
+            start = size
+            predicted = self.predict_many(
+                [dataset[i].x for i in indices],
+                alive,
+                task_llm,
+                desc=f"{desc} ({size}/{len(dataset)})" if desc else None,
+            )
+            for task_prompt, (prompts, generations, predictions) in zip(
+                alive, predicted
+            ):
+                _indices, _prompts, _generations, _predictions, _scores = results[
+                    task_prompt
+                ]
+                _indices.extend(indices)
+                _prompts.extend(prompts)
+                _generations.extend(generations)
+                _predictions.extend(predictions)
+                _scores.extend(
+                    metric.score_batch(
+                        predictions,
+                        [dataset[i].y for i in indices],
+                        [dataset[i].x for i in indices],
+                    )
+                )
+            if size == len(dataset):
+                break
+            bounds = dict(
+                (
+                    p,
+                    racing.bounds(
+                        [metric.key(score) for score in results[p][-1]],
+                        len(dataset),
+                        num_bounds,
+                    ),
+                )
+                for p in alive
+            )
+            best = max(lower for lower, _ in bounds.values())
+            if incumbent is not None:
+                best = max(best, incumbent)
+            alive = [p for p in alive if bounds[p][1] >= best]
+            if not alive:
+                break
+
+        raced = dict()
+        for task_prompt, (indices, *columns) in results.items():
+            ranks = sorted(range(len(indices)), key=indices.__getitem__)
+            indices, prompts, generations, predictions, scores = [
+                [column[r] for r in ranks] for column in [indices] + columns
+            ]
+            raced[task_prompt] = (indices, (prompts, generations, predictions), scores)
+        return raced
+
     def save_evaluation_info(
         self, xs, ys, predictions, scores, prompts, generations, save_path
     ):
@@ -503,6 +1012,13 @@ class Trainer(abc.ABC):
         step_few_shot_example_scores,
         accumulative_few_shot_example_scores,
     ):
+        """
+        Select few-shot examples for the meta prompt.
+
+        Args:
+            step_few_shot_example_scores: The sum of the scores of each example over the prompts of the current step.
+            accumulative_few_shot_example_scores: The sum of the scores of each example over all prompts.
+        """
         few_shot_example_indices = []
         if num_few_shot_examples_in_meta_prompt:
             if few_shot_selection_criteria == "random":
@@ -510,16 +1026,14 @@ class Trainer(abc.ABC):
                     list(range(len(train))), k=num_few_shot_examples_in_meta_prompt
                 )
             elif few_shot_selection_criteria == "current_lowest_score":
-                few_shot_example_indices = sorted(
-                    enumerate(step_few_shot_example_scores), key=lambda x: sum(x[1])
-                )[:num_few_shot_examples_in_meta_prompt]
-                few_shot_example_indices = [x[0] for x in few_shot_example_indices]
+                few_shot_example_indices = lowest(
+                    step_few_shot_example_scores, num_few_shot_examples_in_meta_prompt
+                ).tolist()
             else:
-                few_shot_example_indices = sorted(
-                    enumerate(accumulative_few_shot_example_scores),
-                    key=lambda x: sum(x[1]),
-                )[:num_few_shot_examples_in_meta_prompt]
-                few_shot_example_indices = [x[0] for x in few_shot_example_indices]
+                few_shot_example_indices = lowest(
+                    accumulative_few_shot_example_scores,
+                    num_few_shot_examples_in_meta_prompt,
+                ).tolist()
         few_shot_examples = [train[i] for i in few_shot_example_indices]
         return few_shot_examples
 
@@ -530,12 +1044,60 @@ class Trainer(abc.ABC):
         task_llm: LargeLanguageModel,
         desc: str = None,
     ) -> Sequence[Union[str, Any]]:
-        prompts = [task_prompt.fill(x) for x in xs]
-        generations = task_llm.batch_generate(prompts, desc=desc)
-        predictions = [
-            task_prompt.parse(generation) for generation, x in zip(generations, xs)
+        return self.predict_many(xs, [task_prompt], task_llm, desc)[0]
+
+    def predict_many(
+        self,
+        xs: Sequence[Union[str, Any]],
+        task_prompts: Sequence[TaskPrompt],
+        task_llm: LargeLanguageModel,
+        desc: str = None,
+    ) -> List[Tuple[list, list, list]]:
+        return run_until_complete(self.apredict_many(xs, task_prompts, task_llm, desc))
+
+    async def apredict_many(
+        self,
+        xs: Sequence[Union[str, Any]],
+        task_prompts: Sequence[TaskPrompt],
+        task_llm: LargeLanguageModel,
+        desc: str = None,
+    ) -> List[Tuple[list, list, list]]:
+        """
+        Run every task prompt on every input as one concurrent batch, so stragglers of one prompt overlap with the
+        requests of the others.
+
+        Returns:
+            The ``(prompts, generations, predictions)`` of each task prompt, in the order of ``task_prompts``.
+        """
+        prompts = [
+            prompt
+            for task_prompt in task_prompts
+            for prompt in task_prompt.mark_static_prefix(
+                [task_prompt.fill(x) for x in xs]
+            )
         ]
-        return prompts, generations, predictions
+        generations = await task_llm.abatch_generate(
+            prompts,
+            desc=desc,
+            return_exceptions=True,
+            retry_policy=self.retry_policy,
+            stop_tag=[
+                task_prompt.output_tag for task_prompt in task_prompts for _ in xs
+            ],
+        )
+        failures = [g for g in generations if isinstance(g, FailedGeneration)]
+        if failures:
+            self.logger.warning(
+                f"[red]{len(failures)}/{len(generations)} generations failed, e.g., "
+                f"{failures[0].error!r}. They are parsed as empty generations.[/red]"
+            )
+        results = []
+        for pi, task_prompt in enumerate(task_prompts):
+            _prompts = prompts[pi * len(xs) : (pi + 1) * len(xs)]
+            _generations = generations[pi * len(xs) : (pi + 1) * len(xs)]
+            predictions = [task_prompt.parse(generation) for generation in _generations]
+            results.append((_prompts, _generations, predictions))
+        return results
 
     def convert_prompt_scores_to_df(
         self,
@@ -574,6 +1136,9 @@ class Trainer(abc.ABC):
 
     @staticmethod
     def sort_prompts_best_to_worst(prompt_score_pairs, metric):
+        if isinstance(prompt_score_pairs, Leaderboard):
+            # Already sorted
+            return prompt_score_pairs
         return dict(
             sorted(
                 prompt_score_pairs.items(), key=lambda x: metric.key(x[1]), reverse=True
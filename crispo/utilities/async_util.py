@@ -0,0 +1,50 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+def run_until_complete(awaitable: Awaitable[T]) -> T:
+    """
+    Run an awaitable to completion on the event loop of the current thread, creating one if there is none.
+    """
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        # e.g., the previous loop has been closed by asyncio.run, or this is not the main thread
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(awaitable)
+
+
+async def run_on_loop(loop: asyncio.AbstractEventLoop, coroutine: Coroutine):
+    """
+    Await a coroutine on the event loop its resources are bound to, from the running one, e.g., to close a client
+    created by a previous ``run_until_complete`` or ``asyncio.run``. Nothing runs if that loop has been closed.
+    """
+    if loop.is_closed():
+        coroutine.close()
+        return None
+    if loop.is_running():
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coroutine, loop)
+        )
+    # A stopped loop can only be run by a thread without a running loop
+    return await asyncio.get_running_loop().run_in_executor(
+        None, loop.run_until_complete, coroutine
+    )
+
+
+async def close_at_shutdown(close: Callable[[], Awaitable]) -> AsyncIterator[None]:
+    """
+    An asynchronous generator awaiting ``close()`` when it is closed. Once started, the running event loop closes it
+    when shutting its asynchronous generators down, e.g., at the end of ``asyncio.run``, so resources bound to the loop
+    are released before it is closed.
+    """
+    try:
+        yield
+    finally:
+        await close()
@@ -9,7 +9,10 @@ def boxplot(data: List[List[float]], xlabel=None, ylabel=None, title=None):
     labels = list(range(len(data)))
     fig = plt.figure(figsize=(10, 8), dpi=80)
     ax = fig.add_subplot(111)
-    ax.boxplot(data, labels=labels)
+    ax.boxplot(data)
+    # Set the tick labels separately since ``labels`` was renamed in matplotlib 3.9
+    ax.set_xticks(range(1, len(labels) + 1))
+    ax.set_xticklabels(labels)
     ax.set_ylabel(ylabel)
     ax.set_xlabel(xlabel)
     fig.suptitle(title)
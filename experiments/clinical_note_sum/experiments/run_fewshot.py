@@ -60,7 +60,7 @@ predictions = [
     for y in task_llm.batch_generate(prompts)
 ]
 
-scores = [metric.score(p, example.y) for p, example in zip(predictions, test)]
+scores = metric.score_batch(predictions, [example.y for example in test])
 score = metric.aggregate(scores)
 
 print(f"{k}-shot score: {score:.4f}")
@@ -19,6 +19,7 @@ Let\'s solve the problem. Write your final numerical answer within <answer> XML
 
 @dataclass(eq=True, frozen=True)
 class GsmTaskPrompt(TaskPrompt):
+    output_tag = "answer"
     prompt: str = _P
 
     def fill(self, x: Union[str, Any]) -> str:
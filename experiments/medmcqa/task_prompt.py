@@ -18,6 +18,7 @@ Let\'s solve the multiple-choice problem. Chose an option and write it in <answe
 
 @dataclass(eq=True, frozen=True)
 class MedMcqaTaskPrompt(TaskPrompt):
+    output_tag = "answer"
     prompt: str = _P
 
     def fill(self, x: Union[str, Any]) -> str:
@@ -3,7 +3,7 @@
 
 from typing import List
 
-from rouge_score.rouge_scorer import RougeScorer
+from experiments.summarization.metrics.fast_rouge import FastRougeScorer
 
 from crispo.metrics.metric import Metric
 
@@ -12,7 +12,7 @@ class MaxRougeLFmeasure(Metric):
 
     def __init__(self) -> None:
         super().__init__()
-        self.scorer = RougeScorer(["rougeL"], use_stemmer=True)
+        self.scorer = FastRougeScorer(["rougeL"], use_stemmer=True)
 
     def score(self, pred: str, gold: List[str], x: str = None) -> float:
         # See: https://github.com/shmsw25/qa-hard-em/issues/18#issuecomment-676813048
@@ -20,6 +20,7 @@ Question: {QUESTION_PLACEHOLDER}
 
 @dataclass(eq=True, frozen=True)
 class NarrativeQaTaskPrompt(TaskPrompt):
+    output_tag = "answer"
     prompt: str = _P
 
     def fill(self, x: Input) -> str:
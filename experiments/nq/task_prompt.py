@@ -16,6 +16,8 @@ from experiments.nq.example import encode_context
 
 @dataclass(eq=True, frozen=True)
 class RAGTaskPrompt(TaskPrompt):
+    output_tag = "answer"
+
     def __init__(self, prompt: str):
         if "<answer>" not in prompt:
             prompt += "Write your answer in <answer> tags."
@@ -42,6 +44,7 @@ class RAGTaskPrompt(TaskPrompt):
 
 @dataclass(eq=True, frozen=True)
 class RAGTaskPromptUniversalTemplate(TaskPrompt):
+    output_tag = "answer"
 
     def __init__(self, prompt: str):
         if "INSERT_CONTEXTS_HERE" in prompt:
@@ -1,68 +1,237 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
+import statistics
+import threading
+import time
 from abc import ABC
-from typing import Union, Any
+from typing import Union, Any, List, Sequence, Dict, Optional, Tuple
 
 import transformers
 from alignscore import AlignScore
 
-from crispo.metrics.metric import Metric
+from crispo.metrics.floats import FloatDict
+from crispo.metrics.metric import Metric, MetricDict
 
 
 class AlignScoreScorer(Metric, ABC):
-    def __init__(self, large=True) -> None:
+    _models: Dict[Tuple[str, bool], AlignScore] = dict()
+    _models_lock = threading.Lock()
+
+    def __init__(self, large=True, quantize=False, num_threads=None) -> None:
+        """
+        Args:
+            large: Use AlignScore-large rather than AlignScore-base.
+            quantize: Run the model on CPU with its linear layers dynamically quantized to int8, see
+                ``quantization_parity`` for the accuracy/speed trade-off.
+            num_threads: The number of intra-op threads of PyTorch on CPU, set when the model is loaded, left to its
+                default if not given.
+        """
         super().__init__()
-        device = "cpu"
-        try:
-            import torch
-
-            if torch.cuda.is_available():
-                device = "cuda:0"
-        except:
-            pass
+        self.large = large
+        self.quantize = quantize
+        self.num_threads = num_threads
+
+    @classmethod
+    def load_model(cls, large=True, quantize=False, num_threads=None) -> AlignScore:
+        """
+        Get the AlignScore model shared by all scorers of the process, loading its checkpoint on the first call.
+        """
         model_size = "large" if large else "base"
-        self.scorer = AlignScore(
-            model=f"roberta-{model_size}",
-            batch_size=32,
-            device=device,
-            ckpt_path=transformers.utils.get_file_from_repo(
-                "yzha/AlignScore", f"AlignScore-{model_size}.ckpt"
-            ),
-            evaluation_mode="nli_sp",
-            verbose=False,
+        with cls._models_lock:
+            if (model_size, quantize) not in cls._models:
+                device = "cpu"
+                try:
+                    import torch
+
+                    if torch.cuda.is_available() and not quantize:
+                        device = "cuda:0"
+                except:
+                    pass
+                if num_threads:
+                    import torch
+
+                    # A process-wide setting, changed once when a model is loaded
+                    torch.set_num_threads(num_threads)
+                model = AlignScore(
+                    model=f"roberta-{model_size}",
+                    batch_size=32,
+                    device=device,
+                    ckpt_path=transformers.utils.get_file_from_repo(
+                        "yzha/AlignScore", f"AlignScore-{model_size}.ckpt"
+                    ),
+                    evaluation_mode="nli_sp",
+                    verbose=False,
+                )
+                if quantize:
+                    cls.quantize_model(model)
+                cls._models[model_size, quantize] = model
+            return cls._models[model_size, quantize]
+
+    @staticmethod
+    def quantize_model(model: AlignScore):
+        """
+        Replace the linear layers of the roberta encoder behind ``model`` with dynamically quantized int8 ones, which
+        hold most of its compute on CPU. The classification heads are kept in fp32.
+        """
+        import torch
+
+        # AlignScore -> Inferencer -> BERTAlignModel, whose base_model is the encoder
+        align_model = model.model.model
+        align_model.base_model = torch.ao.quantization.quantize_dynamic(
+            align_model.base_model, {torch.nn.Linear}, dtype=torch.qint8
         )
+        align_model.eval()
 
+    @property
+    def scorer(self) -> AlignScore:
+        return self.load_model(self.large, self.quantize, self.num_threads)
 
-class AlignScorePrecision(AlignScoreScorer):
     def score(
         self, pred: Union[str, Any], gold: Union[str, Any], x: Union[str, Any] = None
     ) -> Union[float, dict]:
-        return self.scorer.score(contexts=[gold], claims=[pred])[0]
+        return self.score_batch([pred], [gold], [x])[0]
+
+
+class AlignScorePrecision(AlignScoreScorer):
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> List[float]:
+        return self.scorer.score(contexts=list(golds), claims=list(preds))
 
 
 class AlignScorePrecisionX(AlignScoreScorer):
-    def score(
-        self, pred: Union[str, Any], gold: Union[str, Any], x: Union[str, Any] = None
-    ) -> Union[float, dict]:
-        return self.scorer.score(contexts=[x], claims=[pred])[0]
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> List[float]:
+        if xs is None or any(x is None for x in xs):
+            raise ValueError("AlignScorePrecisionX scores the predictions against xs")
+        return self.scorer.score(contexts=list(xs), claims=list(preds))
 
 
 class AlignScoreRecall(AlignScoreScorer):
-    def score(
-        self, pred: Union[str, Any], gold: Union[str, Any], x: Union[str, Any] = None
-    ) -> Union[float, dict]:
-        return self.scorer.score(contexts=[pred], claims=[gold])[0]
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> List[float]:
+        return self.scorer.score(contexts=list(preds), claims=list(golds))
+
+
+def f1_score(precision: float, recall: float) -> float:
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
 
 
 class AlignScoreF1(AlignScoreScorer):
-    # noinspection PyTypeChecker
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> List[float]:
+        # Precision and recall in one submission
+        scores = self.scorer.score(contexts=[*golds, *preds], claims=[*preds, *golds])
+        return [
+            f1_score(p, r) for p, r in zip(scores[: len(preds)], scores[len(preds) :])
+        ]
+
+
+class AlignScoreMetrics(MetricDict):
+    def __init__(
+        self,
+        primary: Optional[str] = None,
+        large=True,
+        use_x=True,
+        quantize=False,
+        num_threads=None,
+    ):
+        """
+        AlignScore precision, recall, F1 and, with ``use_x``, precision against the input, computed together from
+        one batched submission to the shared model.
+
+        Args:
+            primary: The primary score, e.g., ``f1`` or ``rank``.
+            large: Use AlignScore-large rather than AlignScore-base.
+            use_x: Also score the precision of the predictions against the inputs, as ``precision_x``, when inputs are
+                given.
+            quantize: See ``AlignScoreScorer``.
+            num_threads: See ``AlignScoreScorer``.
+        """
+        options = dict(large=large, quantize=quantize, num_threads=num_threads)
+        metrics = dict(
+            precision=AlignScorePrecision(**options),
+            recall=AlignScoreRecall(**options),
+            f1=AlignScoreF1(**options),
+        )
+        if use_x:
+            metrics["precision_x"] = AlignScorePrecisionX(**options)
+        super().__init__(primary, **metrics)
+        self.options = options
+        self.use_x = use_x
+
     def score(
         self, pred: Union[str, Any], gold: Union[str, Any], x: Union[str, Any] = None
-    ) -> Union[float, dict]:
-        p = AlignScorePrecision.score(self, pred, gold)
-        r = AlignScoreRecall.score(self, pred, gold)
-        return 2 * p * r / (p + r)
+    ) -> FloatDict:
+        return self.score_batch([pred], [gold], [x])[0]
+
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> List[FloatDict]:
+        n = len(preds)
+        # precision_x is skipped when the inputs are missing
+        use_x = self.use_x and xs is not None and all(x is not None for x in xs)
+        contexts, claims = [*golds, *preds], [*preds, *golds]
+        if use_x:
+            contexts.extend(xs)
+            claims.extend(preds)
+        scores = AlignScoreScorer.load_model(**self.options).score(
+            contexts=contexts, claims=claims
+        )
+        batch = []
+        for i in range(n):
+            precision, recall = scores[i], scores[n + i]
+            result = dict(
+                precision=precision, recall=recall, f1=f1_score(precision, recall)
+            )
+            if use_x:
+                result["precision_x"] = scores[2 * n + i]
+            batch.append(FloatDict(**result))
+        return batch
+
+
+def quantization_parity(
+    contexts: Sequence[str], claims: Sequence[str], large=True, num_threads=None
+) -> dict:
+    """
+    Score the same pairs with the fp32 and the int8 model to weigh the accuracy lost by quantization against the
+    speed-up.
+
+    Returns:
+        The maximum and mean absolute differences of the scores and the seconds taken by each model.
+    """
+    scores, seconds = dict(), dict()
+    for quantize in (False, True):
+        model = AlignScoreScorer.load_model(large, quantize, num_threads)
+        start = time.perf_counter()
+        scores[quantize] = model.score(contexts=list(contexts), claims=list(claims))
+        seconds[quantize] = time.perf_counter() - start
+    diffs = [abs(a - b) for a, b in zip(scores[False], scores[True])]
+    return {
+        "max_abs_diff": max(diffs),
+        "mean_abs_diff": statistics.mean(diffs),
+        "fp32_seconds": seconds[False],
+        "int8_seconds": seconds[True],
+    }
 
 
 def main():
@@ -90,6 +259,21 @@ def main():
         "Planets often in periods of warming or cooling.",
     )
     print(f"F1: {f}")
+    # Shares the model loaded above and scores everything in one submission
+    fused = AlignScoreMetrics(use_x=False)
+    scores = fused.score(
+        pred="Over the last century, global temperatures have increased by approximately one degree Celsius.",
+        gold="Earth has warmed one degree in past 100 years."
+        "Greenhouse gases are causing temperatures to rise."
+        "Planets often in periods of warming or cooling.",
+    )
+    print(f"Fused: {scores.scores}")
+    parity = quantization_parity(
+        contexts=["Earth has warmed one degree in past 100 years."] * 32,
+        claims=["Global temperatures have increased by one degree Celsius."] * 32,
+        num_threads=4,
+    )
+    print(f"Int8 parity: {parity}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import functools
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from nltk.stem import porter
+from rouge_score.scoring import Score, fmeasure
+from rouge_score.tokenize import NON_ALPHANUM_RE, SPACES_RE, VALID_TOKEN_RE
+
+WORD_CACHE_SIZE = 2**18
+
+_stemmer = porter.PorterStemmer()
+_vocab: Dict[str, int] = dict()
+_vocab_lock = threading.Lock()
+
+
+def intern(token: str) -> int:
+    """
+    The integer id of a token, stable for the lifetime of the process.
+    """
+    token_id = _vocab.get(token)
+    if token_id is None:
+        with _vocab_lock:
+            token_id = _vocab.setdefault(token, len(_vocab))
+    return token_id
+
+
+@functools.lru_cache(maxsize=WORD_CACHE_SIZE)
+def _word_id(word: str, use_stemmer: bool) -> int:
+    # Only words longer than 3 characters are stemmed, as in rouge_score
+    if use_stemmer and len(word) > 3:
+        word = _stemmer.stem(word)
+    return intern(word) if VALID_TOKEN_RE.match(word) else -1
+
+
+def tokenize(text: str, use_stemmer: bool = True) -> np.ndarray:
+    """
+    Tokenize a text like the default tokenizer of ``rouge_score``, into the ids of its (stemmed) tokens. Stemming and
+    interning are memoized per word by an LRU cache.
+    """
+    words = SPACES_RE.split(NON_ALPHANUM_RE.sub(" ", text.lower()))
+    ids = [_word_id(word, use_stemmer) for word in words if word]
+    return np.array([i for i in ids if i >= 0], dtype=np.int64)
+
+
+def ngram_keys(tokens: np.ndarray, n: int, bits: int) -> np.ndarray:
+    """
+    Pack each n-gram of token ids of up to ``bits`` bits into one integer, or into a row of ids if they do not fit in
+    64 bits.
+    """
+    if len(tokens) < n:
+        return np.empty((0,) if n * bits <= 63 else (0, n), dtype=np.int64)
+    if n == 1:
+        return tokens
+    if n * bits <= 63:
+        keys = tokens[: len(tokens) - n + 1].copy()
+        for i in range(1, n):
+            keys = (keys << bits) | tokens[i : len(tokens) - n + 1 + i]
+        return keys
+    return np.lib.stride_tricks.sliding_window_view(tokens, n)
+
+
+def score_ngrams(target: np.ndarray, prediction: np.ndarray, n: int) -> Score:
+    # Both sides are packed with the same number of bits per id
+    bits = max(
+        [int(t.max()).bit_length() for t in (target, prediction) if len(t)] or [1]
+    )
+    target_keys = ngram_keys(target, n, bits)
+    prediction_keys = ngram_keys(prediction, n, bits)
+    hits = 0
+    if len(target_keys) and len(prediction_keys):
+        if n * bits <= 63:
+            target_ngrams, target_counts = np.unique(target_keys, return_counts=True)
+            prediction_ngrams, prediction_counts = np.unique(
+                prediction_keys, return_counts=True
+            )
+            _, i, j = np.intersect1d(
+                target_ngrams,
+                prediction_ngrams,
+                assume_unique=True,
+                return_indices=True,
+            )
+            hits = int(np.minimum(target_counts[i], prediction_counts[j]).sum())
+        else:
+            # Rows of ids, when the ids of a vocabulary this large cannot be packed
+            target_ngrams = Counter(map(tuple, target_keys.tolist()))
+            prediction_ngrams = Counter(map(tuple, prediction_keys.tolist()))
+            hits = sum((target_ngrams & prediction_ngrams).values())
+    precision = hits / max(len(prediction_keys), 1)
+    recall = hits / max(len(target_keys), 1)
+    return Score(
+        precision=precision, recall=recall, fmeasure=fmeasure(precision, recall)
+    )
+
+
+def _match_masks(ref: Sequence[int]) -> Dict[int, int]:
+    masks = dict()
+    for i, token in enumerate(ref):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+
+def _lcs_rows(ref: Sequence[int], can: Sequence[int]) -> List[int]:
+    """
+    Bit-parallel LCS (Allison-Dix, Hyyrö): row ``j`` encodes the column ``j`` of the LCS table of ``ref`` and
+    ``can[:j]``, where ``table[i][j]`` is the number of zeros among the lowest ``i`` bits.
+    """
+    masks = _match_masks(ref)
+    row = (1 << len(ref)) - 1
+    rows = [row]
+    for token in can:
+        match = row & masks.get(token, 0)
+        row = ((row + match) | (row - match)) & rows[0]
+        rows.append(row)
+    return rows
+
+
+def lcs_length(ref: Sequence[int], can: Sequence[int]) -> int:
+    if not len(ref) or not len(can):
+        return 0
+    masks = _match_masks(ref)
+    full = row = (1 << len(ref)) - 1
+    for token in can:
+        match = row & masks.get(token, 0)
+        row = ((row + match) | (row - match)) & full
+    return len(ref) - row.bit_count()
+
+
+def lcs_indices(ref: Sequence[int], can: Sequence[int]) -> List[int]:
+    """
+    The indices in ``ref`` of one longest common subsequence, the same one ``rouge_score`` backtracks.
+    """
+    rows = _lcs_rows(ref, can)
+
+    def table(i, j):
+        return i - (rows[j] & ((1 << i) - 1)).bit_count()
+
+    i, j = len(ref), len(can)
+    lcs = []
+    while i > 0 and j > 0:
+        if ref[i - 1] == can[j - 1]:
+            lcs.append(i - 1)
+            i -= 1
+            j -= 1
+        elif table(i, j - 1) > table(i - 1, j):
+            j -= 1
+        else:
+            i -= 1
+    lcs.reverse()
+    return lcs
+
+
+def score_lcs(target: np.ndarray, prediction: np.ndarray) -> Score:
+    if not len(target) or not len(prediction):
+        return Score(precision=0, recall=0, fmeasure=0)
+    length = lcs_length(target.tolist(), prediction.tolist())
+    precision = length / len(prediction)
+    recall = length / len(target)
+    return Score(
+        precision=precision, recall=recall, fmeasure=fmeasure(precision, recall)
+    )
+
+
+def score_summary_lcs(
+    target_sents: List[np.ndarray], prediction_sents: List[np.ndarray]
+) -> Score:
+    """
+    Summary-level LCS, computed like ``rouge_score._summary_level_lcs``.
+    """
+    m = sum(map(len, target_sents))
+    n = sum(map(len, prediction_sents))
+    if not m or not n:
+        return Score(precision=0, recall=0, fmeasure=0)
+    target_sents = [s.tolist() for s in target_sents]
+    prediction_sents = [s.tolist() for s in prediction_sents]
+    # Token counts prevent double counting
+    target_counts = Counter(t for s in target_sents for t in s)
+    prediction_counts = Counter(t for s in prediction_sents for t in s)
+    hits = 0
+    for ref in target_sents:
+        union = set()
+        for can in prediction_sents:
+            union.update(lcs_indices(ref, can))
+        for i in sorted(union):
+            token = ref[i]
+            if target_counts[token] > 0 and prediction_counts[token] > 0:
+                hits += 1
+                target_counts[token] -= 1
+                prediction_counts[token] -= 1
+    precision = hits / n
+    recall = hits / m
+    return Score(
+        precision=precision, recall=recall, fmeasure=fmeasure(precision, recall)
+    )
+
+
+class RougeText(NamedTuple):
+    """
+    A text tokenized for ROUGE, as a whole and per sentence, each only if one of the ROUGE types needs it.
+    """
+
+    tokens: Optional[np.ndarray]
+    sents: Optional[List[np.ndarray]]
+
+
+class FastRougeScorer:
+    def __init__(self, rouge_types: Sequence[str], use_stemmer: bool = False) -> None:
+        """
+        A drop-in replacement of ``rouge_score.rouge_scorer.RougeScorer`` computing the same scores. Tokens are
+        stemmed once per distinct word and interned as integers, n-grams are counted on integer arrays and LCS is
+        computed bit-parallel.
+
+        Args:
+            rouge_types: The ROUGE types to compute, ``rougeN``, ``rougeL`` or ``rougeLsum``.
+            use_stemmer: Whether to stem the tokens with the Porter stemmer.
+        """
+        for rouge_type in rouge_types:
+            if rouge_type not in ("rougeL", "rougeLsum") and not re.match(
+                r"rouge[1-9]$", rouge_type
+            ):
+                raise ValueError(f"Invalid rouge type: {rouge_type}")
+        self.rouge_types = list(rouge_types)
+        self.use_stemmer = use_stemmer
+
+    def tokenize(self, text: str) -> np.ndarray:
+        return tokenize(text, self.use_stemmer)
+
+    def tokenize_sents(self, text: str) -> List[np.ndarray]:
+        # Sentences are separated by newlines, as in rouge_score
+        return [self.tokenize(s) for s in text.split("\n") if len(s)]
+
+    def analyze(self, text: str) -> RougeText:
+        return RougeText(
+            tokens=(self.tokenize(text) if self.rouge_types != ["rougeLsum"] else None),
+            sents=(
+                self.tokenize_sents(text) if "rougeLsum" in self.rouge_types else None
+            ),
+        )
+
+    def score(self, target: str, prediction: str) -> Dict[str, Score]:
+        return self.score_analyzed(self.analyze(target), self.analyze(prediction))
+
+    def score_analyzed(
+        self, target: RougeText, prediction: RougeText
+    ) -> Dict[str, Score]:
+        """
+        Score texts already tokenized by ``analyze``, e.g., references scored against many predictions.
+        """
+        result = {}
+        for rouge_type in self.rouge_types:
+            if rouge_type == "rougeL":
+                result[rouge_type] = score_lcs(target.tokens, prediction.tokens)
+            elif rouge_type == "rougeLsum":
+                result[rouge_type] = score_summary_lcs(target.sents, prediction.sents)
+            else:
+                result[rouge_type] = score_ngrams(
+                    target.tokens, prediction.tokens, int(rouge_type[5:])
+                )
+        return result
+
+    def score_multi(self, targets: Sequence[str], prediction: str) -> Dict[str, Score]:
+        scores = [self.score(t, prediction) for t in targets]
+        return {
+            k: max(scores, key=lambda s: s[k].fmeasure)[k] for k in self.rouge_types
+        }
+
+
+def main():
+    import random
+    import time
+
+    from rouge_score.rouge_scorer import RougeScorer
+
+    rouge_types = ["rouge1", "rouge2", "rougeL", "rougeLsum"]
+    rng = random.Random(0)
+    words = [
+        "".join(rng.choices("abcdefghij", k=rng.randint(2, 9))) for _ in range(2000)
+    ]
+
+    def summary(num_words):
+        return "\n".join(
+            " ".join(rng.choices(words, k=20)) + "." for _ in range(num_words // 20)
+        )
+
+    pairs = [(summary(300), summary(200)) for _ in range(50)]
+    for name, scorer in [
+        ("rouge_score", RougeScorer(rouge_types, use_stemmer=True)),
+        ("fast_rouge", FastRougeScorer(rouge_types, use_stemmer=True)),
+    ]:
+        start = time.perf_counter()
+        for target, prediction in pairs:
+            scorer.score(target, prediction)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {len(pairs) / elapsed:.1f} pairs/s")
+
+
+if __name__ == "__main__":
+    main()
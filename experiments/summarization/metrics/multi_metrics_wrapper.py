@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
 import statistics
-from typing import Union, Any
+from typing import Union, Any, Sequence
 import pandas as pd
 from crispo.metrics.metric import Metric
 
@@ -23,6 +23,24 @@ class MultiMetricsWrapper(Metric):
             scores["avg_score"] = statistics.mean(scores.values())
         return scores
 
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> list:
+        columns = dict(
+            (name, metric.score_batch(preds, golds, xs))
+            for name, metric in self.metrics.items()
+        )
+        batch = []
+        for i in range(len(preds)):
+            scores = dict((name, column[i]) for name, column in columns.items())
+            if self.compute_avg:
+                scores["avg_score"] = statistics.mean(scores.values())
+            batch.append(scores)
+        return batch
+
     def get_description(self, result: dict) -> str:
         return "\n".join(f"{metric}: {score:.2f}" for metric, score in result.items())
 
@@ -2,14 +2,14 @@
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
 from typing import Union, Any
-from rouge_score.rouge_scorer import RougeScorer
+from experiments.summarization.metrics.fast_rouge import FastRougeScorer
 from crispo.metrics.metric import Metric
 
 
 class Rouge2Fmeasure(Metric):
     def __init__(self) -> None:
         super().__init__()
-        self.scorer = RougeScorer(["rouge2"], use_stemmer=True)
+        self.scorer = FastRougeScorer(["rouge2"], use_stemmer=True)
 
     def score(
         self, pred: Union[str, Any], gold: Union[str, Any], x: Union[str, Any] = None
@@ -1,16 +1,26 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: CC-BY-NC-4.0
 
-from typing import Union, Any
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Union, Any, Optional, Sequence
 
 import pandas as pd
 from nltk.tokenize import sent_tokenize, word_tokenize
-from rouge_score.rouge_scorer import RougeScorer
+from experiments.summarization.metrics.fast_rouge import FastRougeScorer, RougeText
 
 from crispo.metrics.floats import FloatDict
 from crispo.metrics.metric import Metric, MetricDict
 
 
+@dataclass(frozen=True)
+class TextAnalysis:
+    n_sent: int
+    n_word: Optional[int]
+    rouge: Optional[RougeText]
+
+
 class SummMultiMetrics(MetricDict):
 
     def __init__(
@@ -20,23 +30,63 @@ class SummMultiMetrics(MetricDict):
         use_n_sent=True,
         use_n_word=True,
         description_style="simple",
+        cache_size: int = 4096,
         **metrics: Metric,
     ):
+        """
+        ROUGE scores and length features of summaries. Each text is tokenized once per ``score`` call, and the
+        analyses of the gold references are kept in an LRU cache of ``cache_size`` entries, since the same references
+        are scored against the predictions of every prompt.
+        """
         super().__init__(primary, **metrics)
         self.use_rouge = use_rouge
         self.use_n_sent = use_n_sent
         self.use_n_word = use_n_word
         self.description_style = description_style
+        self.cache_size = cache_size
+        self._gold_analyses = OrderedDict()
+        self._cache_lock = threading.Lock()
 
         if use_rouge:
-            self.rouge_scorer = RougeScorer(
+            self.rouge_scorer = FastRougeScorer(
                 ["rouge1", "rouge2", "rougeL", "rougeLsum"], use_stemmer=True
             )
 
-    def compute_rouge(self, pred: Union[str, Any], gold: Union[str, Any]) -> dict:
-        pred = "\n".join(sent_tokenize(pred))
-        gold = "\n".join(sent_tokenize(gold))
-        scores = self.rouge_scorer.score(prediction=pred, target=gold)
+    def analyze(self, text: str) -> TextAnalysis:
+        sents = sent_tokenize(text)
+        return TextAnalysis(
+            n_sent=len(sents),
+            n_word=len(word_tokenize(text)) if self.use_n_word else None,
+            rouge=(
+                self.rouge_scorer.analyze("\n".join(sents)) if self.use_rouge else None
+            ),
+        )
+
+    def analyze_gold(self, gold: str) -> TextAnalysis:
+        with self._cache_lock:
+            analysis = self._gold_analyses.get(gold)
+            if analysis is not None:
+                self._gold_analyses.move_to_end(gold)
+                return analysis
+        analysis = self.analyze(gold)
+        with self._cache_lock:
+            self._gold_analyses[gold] = analysis
+            if len(self._gold_analyses) > self.cache_size:
+                self._gold_analyses.popitem(last=False)
+        return analysis
+
+    def compute_rouge(
+        self,
+        pred: Union[str, Any, TextAnalysis],
+        gold: Union[str, Any, TextAnalysis],
+    ) -> dict:
+        if not isinstance(pred, TextAnalysis):
+            pred = self.analyze(pred)
+        if not isinstance(gold, TextAnalysis):
+            gold = self.analyze_gold(gold)
+        scores = self.rouge_scorer.score_analyzed(
+            target=gold.rouge, prediction=pred.rouge
+        )
         ret = {}
         for k, v in scores.items():
             ret[k + "f"] = v.fmeasure * 100
@@ -48,20 +98,32 @@ class SummMultiMetrics(MetricDict):
         self, pred: Union[str, Any], gold: Union[str, Any], x: Union[str, Any] = None
     ) -> FloatDict:
         result = {}
+        # Shared by the features below
+        pred = self.analyze(pred)
+        gold = self.analyze_gold(gold)
 
         if self.use_rouge:
             result.update(self.compute_rouge(pred, gold))
 
         if self.use_n_sent:
-            result["n_sent"] = len(sent_tokenize(pred))
-            result["n_sent_diff"] = len(sent_tokenize(pred)) - len(sent_tokenize(gold))
+            result["n_sent"] = pred.n_sent
+            result["n_sent_diff"] = pred.n_sent - gold.n_sent
 
         if self.use_n_word:
-            result["n_word"] = len(word_tokenize(pred))
-            result["n_word_diff"] = len(word_tokenize(pred)) - len(word_tokenize(gold))
+            result["n_word"] = pred.n_word
+            result["n_word_diff"] = pred.n_word - gold.n_word
 
         return FloatDict(value=result[self.primary] if self.primary else None, **result)
 
+    def score_batch(
+        self,
+        preds: Sequence[Union[str, Any]],
+        golds: Sequence[Union[str, Any]],
+        xs: Sequence[Union[str, Any]] = None,
+    ) -> list[FloatDict]:
+        # Its features are computed from the texts alone, unlike the metrics of a MetricDict
+        return Metric.score_batch(self, preds, golds, xs)
+
     def get_description(self, result) -> str:
         if self.description_style == "simple":
             ret = ""
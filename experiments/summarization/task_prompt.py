@@ -10,6 +10,8 @@ from experiments.summarization.constants import ARTICLE_PLACEHOLDER
 
 @dataclass(eq=True, frozen=True)
 class SummarizationTaskPromptNoPlaceholder(TaskPrompt):
+    output_tag = "summary"
+
     def fill(self, x: Union[str, Any]) -> str:
         buffer = [self.prompt, x]
         if "<summary>" not in self.prompt:
@@ -28,6 +30,8 @@ class SummarizationTaskPromptNoPlaceholder(TaskPrompt):
 
 @dataclass(eq=True, frozen=True)
 class SummarizationTaskPromptWithPlaceholder(TaskPrompt):
+    output_tag = "summary"
+
     def fill(self, x: Union[str, Any]) -> str:
         assert ARTICLE_PLACEHOLDER in self.prompt
         filled_prompt = self.prompt.replace(
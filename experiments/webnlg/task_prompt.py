@@ -21,6 +21,7 @@ Write down your natural-language text in <text/>.
 
 @dataclass(eq=True, frozen=True)
 class WebNLGTaskPrompt(TaskPrompt):
+    output_tag = "text"
     prompt: str = _P
 
     def fill(self, x: list[str]) -> str:
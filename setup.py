@@ -33,7 +33,12 @@ setup(
         "matplotlib",
         "boto3",
     ],
-    extras_require={"experiments": METRICS},
+    extras_require={
+        "experiments": METRICS,
+        "async": ["aiobotocore"],
+        "openai": ["aiohttp"],
+        "local": ["torch", "transformers"],
+    },
     tests_require=["pytest", "black"],
     python_requires=">=3.10",
 )
@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import importlib
+import sys
+import types
+
+import pytest
+
+MODULE = "experiments.summarization.metrics.align_score"
+
+
+class StubAlignModel:
+    def __init__(self):
+        self.base_model = "encoder"
+        self.bin_layer = "head"
+
+    def eval(self):
+        pass
+
+
+class StubAlignScore:
+    instances = []
+
+    def __init__(self, model, batch_size, device, ckpt_path, evaluation_mode, verbose):
+        self.model_name = model
+        self.model = types.SimpleNamespace(model=StubAlignModel())
+        self.submissions = []
+        StubAlignScore.instances.append(self)
+
+    def score(self, contexts, claims):
+        self.submissions.append((contexts, claims))
+        # Deterministic and asymmetric, so precision and recall differ
+        error = 0.01 if self.model.model.base_model == "int8 encoder" else 0.0
+        return [
+            len(claim) / (len(claim) + len(context)) + error
+            for context, claim in zip(contexts, claims)
+        ]
+
+
+@pytest.fixture
+def align_score(monkeypatch):
+    StubAlignScore.instances = []
+    monkeypatch.setitem(
+        sys.modules, "alignscore", types.SimpleNamespace(AlignScore=StubAlignScore)
+    )
+    transformers = types.SimpleNamespace(
+        utils=types.SimpleNamespace(
+            get_file_from_repo=lambda repo, name: f"/tmp/{name}"
+        )
+    )
+    monkeypatch.setitem(sys.modules, "transformers", transformers)
+    monkeypatch.delitem(sys.modules, MODULE, raising=False)
+    # A fresh module, with an empty model registry
+    yield importlib.import_module(MODULE)
+    sys.modules.pop(MODULE, None)
+
+
+PREDS = ["The cat sat.", "It rained all day long."]
+GOLDS = ["A cat was sitting on the mat.", "Rain."]
+XS = ["The cat sat on the mat all afternoon.", "Weather report: rain."]
+
+
+def test_model_loaded_once_per_size(align_score):
+    align_score.AlignScorePrecision().score_batch(PREDS, GOLDS)
+    align_score.AlignScoreRecall().score_batch(PREDS, GOLDS)
+    align_score.AlignScoreF1(large=False).score_batch(PREDS, GOLDS)
+    assert [m.model_name for m in StubAlignScore.instances] == [
+        "roberta-large",
+        "roberta-base",
+    ]
+
+
+def test_f1_single_submission(align_score):
+    f1 = align_score.AlignScoreF1().score_batch(PREDS, GOLDS)
+    (model,) = StubAlignScore.instances
+    assert len(model.submissions) == 1
+    precision = align_score.AlignScorePrecision().score_batch(PREDS, GOLDS)
+    recall = align_score.AlignScoreRecall().score_batch(PREDS, GOLDS)
+    assert f1 == [
+        pytest.approx(align_score.f1_score(p, r)) for p, r in zip(precision, recall)
+    ]
+
+
+def test_fused_matches_separate_scorers(align_score):
+    fused = align_score.AlignScoreMetrics().score_batch(PREDS, GOLDS, XS)
+    (model,) = StubAlignScore.instances
+    assert len(model.submissions) == 1
+    separate = dict(
+        precision=align_score.AlignScorePrecision().score_batch(PREDS, GOLDS, XS),
+        recall=align_score.AlignScoreRecall().score_batch(PREDS, GOLDS, XS),
+        f1=align_score.AlignScoreF1().score_batch(PREDS, GOLDS, XS),
+        precision_x=align_score.AlignScorePrecisionX().score_batch(PREDS, GOLDS, XS),
+    )
+    for i, scores in enumerate(fused):
+        for name, values in separate.items():
+            assert scores[name] == pytest.approx(values[i])
+
+
+def test_fused_without_x(align_score):
+    metric = align_score.AlignScoreMetrics(primary="f1")
+    score = metric.score(PREDS[0], GOLDS[0])
+    assert "precision_x" not in score.scores and "f1" in score.scores
+    assert len(metric.score_batch(PREDS, GOLDS)) == 2
+    with pytest.raises(ValueError):
+        align_score.AlignScorePrecisionX().score(PREDS[0], GOLDS[0])
+
+
+@pytest.fixture
+def torch(monkeypatch):
+    torch = types.SimpleNamespace(
+        num_threads=[],
+        qint8="qint8",
+        nn=types.SimpleNamespace(Linear="Linear"),
+        cuda=types.SimpleNamespace(is_available=lambda: False),
+    )
+    torch.set_num_threads = torch.num_threads.append
+    torch.ao = types.SimpleNamespace(
+        quantization=types.SimpleNamespace(
+            quantize_dynamic=lambda module, layers, dtype: f"int8 {module}"
+        )
+    )
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    return torch
+
+
+def test_quantization_parity(align_score, torch):
+    parity = align_score.quantization_parity(XS, PREDS, num_threads=4)
+    assert parity["max_abs_diff"] == pytest.approx(0.01)
+    assert parity["mean_abs_diff"] == pytest.approx(0.01)
+    fp32, int8 = StubAlignScore.instances
+    # Only the encoder is quantized
+    assert fp32.model.model.base_model == "encoder"
+    assert int8.model.model.base_model == "int8 encoder"
+    assert int8.model.model.bin_layer == "head"
+    # Set when each model is loaded, not on every access
+    align_score.AlignScoreF1(quantize=True, num_threads=4).score_batch(PREDS, GOLDS)
+    assert torch.num_threads == [4, 4]
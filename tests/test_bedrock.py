@@ -0,0 +1,167 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from botocore.credentials import EnvProvider
+from botocore.exceptions import ClientError
+
+from crispo.llms import PrefixedPrompt
+from crispo.llms.bedrock import wrapper
+from crispo.llms.bedrock.client import SharedBedrockClient
+from crispo.llms.bedrock.claude3 import Claude3
+from crispo.llms.bedrock.llama import BedrockLlama
+from crispo.task.prompt import TaskPrompt
+
+
+class StubBedrockHandler(BaseHTTPRequestHandler):
+    """
+    Answers ``invoke_model`` like Claude 3 with prompt caching: the first request with a cache breakpoint writes the
+    prefix, the following ones read it.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.bodies.append(body)
+        if self.server.expired:
+            self.server.expired -= 1
+            out = json.dumps({"message": "The security token has expired"}).encode()
+            self.send_response(403)
+            self.send_header("x-amzn-ErrorType", "ExpiredTokenException")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+            return
+        usage = {"input_tokens": 10, "output_tokens": 2}
+        content = body["messages"][0]["content"]
+        if isinstance(content, list) and "cache_control" in content[0]:
+            with self.server.lock:
+                cached = self.server.cached
+                self.server.cached = True
+            key = "cache_read_input_tokens" if cached else "cache_creation_input_tokens"
+            usage[key] = 1000
+        out = json.dumps(
+            {"content": [{"text": " ok"}], "stop_reason": "end_turn", "usage": usage}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_bedrock(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBedrockHandler)
+    server.bodies, server.cached, server.lock = [], False, threading.Lock()
+    server.expired = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "stub")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "stub")
+    monkeypatch.setattr(SharedBedrockClient, "credential_provider", EnvProvider)
+    monkeypatch.setattr(
+        wrapper, "ENDPOINT_URL", f"http://127.0.0.1:{server.server_port}/"
+    )
+    yield server
+    server.shutdown()
+
+
+def test_prefixed_prompt():
+    prompt = PrefixedPrompt("Human: Summarize. Text: a", "Human: Summarize. Text: ")
+    assert prompt == "Human: Summarize. Text: a"
+    assert prompt.prefix == "Human: Summarize. Text: "
+    prompts = TaskPrompt.mark_static_prefix(None, ["Text: a", "Text: b"])
+    assert [p.prefix for p in prompts] == ["Text: "] * 2
+    prompts = TaskPrompt.mark_static_prefix(None, ["a", "b"])
+    assert not isinstance(prompts[0], PrefixedPrompt)
+
+
+def test_prompt_caching(stub_bedrock):
+    llm = Claude3("stub-model").use_prompt_caching()
+    prefix = "Human: Follow these instructions. Text: "
+    prompts = [PrefixedPrompt(prefix + x, prefix) for x in "ab"]
+    assert llm.batch_generate(prompts) == ["ok", "ok"]
+    assert asyncio.run(llm.agenerate(prompts[0])) == "ok"
+
+    content = stub_bedrock.bodies[0]["messages"][0]["content"]
+    assert content[0] == {
+        "type": "text",
+        "text": "Follow these instructions. Text: ",
+        "cache_control": {"type": "ephemeral"},
+    }
+    assert content[1]["text"] in ("a", "b")
+    assert llm.usage["cache_creation_input_tokens"] == 1000
+    assert llm.usage["cache_read_input_tokens"] == 2000
+    assert llm.usage["input_tokens"] == 30
+
+    llm.use_prompt_caching(False).generate(prompts[0])
+    assert isinstance(stub_bedrock.bodies[-1]["messages"][0]["content"], str)
+
+
+def test_shared_client(stub_bedrock):
+    haiku, sonnet = Claude3("haiku", concurrency=4), Claude3("sonnet", concurrency=8)
+    shared = haiku.client.shared_client
+    assert sonnet.client.shared_client is shared
+    assert haiku.client.bedrock is sonnet.client.bedrock
+    assert shared.build_config().max_pool_connections == 12
+
+    client = shared.client
+    stub_bedrock.expired = 1
+    assert haiku.generate("Hi") == "ok"
+    assert shared.client is not client
+
+
+def test_llama_errors(stub_bedrock):
+    llm = BedrockLlama()
+
+    def raising(error):
+        async def generate_async(prompt):
+            raise error
+
+        def generate(prompt):
+            raise error
+
+        llm.inferencer.generate_async = generate_async
+        llm.inferencer.generate = generate
+
+    def validation_error(message):
+        return ClientError(
+            {"Error": {"Code": "ValidationException", "Message": message}},
+            "InvokeModel",
+        )
+
+    raising(validation_error("Prompt is too long"))
+    assert asyncio.run(llm.agenerate("a")) == ""
+    assert llm.generate("a") == ""
+    # The sync and async paths raise the same errors
+    for error in [
+        validation_error("Malformed input request: temperature must be <= 1"),
+        ClientError({"Error": {"Code": "AccessDeniedException"}}, "InvokeModel"),
+    ]:
+        raising(error)
+        with pytest.raises(ClientError):
+            asyncio.run(llm.agenerate("a"))
+        with pytest.raises(ClientError):
+            llm.generate("a")
+    raising(asyncio.CancelledError())
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(llm.agenerate("a"))
+
+
+def test_async_client_closed_on_loop_change(stub_bedrock):
+    llm = Claude3("stub-model")
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(llm.agenerate("a")) == "ok"
+    client = llm.client.async_bedrock
+    # The client of the previous loop is closed on it
+    assert asyncio.run(llm.agenerate("b")) == "ok"
+    assert llm.client.async_bedrock is not client
+    assert client._endpoint.http_session._sessions is None
+    loop.close()
@@ -0,0 +1,109 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+
+import pytest
+
+from crispo.llms.concurrency import AdaptiveConcurrencyLimiter
+from crispo.llms.rate_limit import RateLimiter
+from crispo.llms.scheduler import Priority, PriorityScheduler, request_priority
+
+
+def test_aimd():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, maximum=8, cooldown=0)
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.concurrency == 4
+    assert 4.9 < limiter.limit < 5
+    limiter.on_throttle()
+    assert limiter.concurrency == 2
+    for _ in range(1000):
+        limiter.on_success()
+    assert limiter.concurrency == 8
+
+
+def test_limits_in_flight():
+    limiter = AdaptiveConcurrencyLimiter(initial=2, increase=0)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[work() for _ in range(10)])
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_shared_by_model():
+    a = AdaptiveConcurrencyLimiter.for_model("test-model", initial=3)
+    b = AdaptiveConcurrencyLimiter.for_model("test-model", defaults=dict(initial=5))
+    assert a is b and a.concurrency == 3
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter.for_model("test-model", initial=5)
+    # Each class has its own registry
+    assert PriorityScheduler.get("test-model") is None
+    assert RateLimiter.for_model("test-model", requests_per_minute=60) is not a
+    with pytest.raises(ValueError):
+        RateLimiter.for_model("test-model", requests_per_minute=120)
+
+
+def test_priority_scheduler():
+    scheduler = PriorityScheduler(concurrency=1)
+    order = []
+
+    async def work(name, priority):
+        with request_priority(priority):
+            async with scheduler:
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+    async def main():
+        first = asyncio.ensure_future(work("first", Priority.BULK))
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            first,
+            work("dev", Priority.BULK),
+            work("train", Priority.TRAIN),
+            work("critique", Priority.CRITICAL),
+        )
+
+    asyncio.run(main())
+    assert order == ["first", "critique", "train", "dev"]
+    assert scheduler.in_flight == 0
+    assert scheduler.served[Priority.BULK] == 2
+
+
+def test_scheduler_wakes_head_only():
+    scheduler = PriorityScheduler(concurrency=1)
+    order = []
+
+    async def work(name, priority):
+        with request_priority(priority):
+            async with scheduler:
+                order.append(name)
+                await asyncio.sleep(0)
+
+    async def main():
+        await scheduler.acquire()
+        waiters = [
+            asyncio.ensure_future(work(f"dev {i}", Priority.BULK)) for i in range(10)
+        ]
+        cancelled = asyncio.ensure_future(work("cancelled", Priority.CRITICAL))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        await scheduler.release()
+        # Only the head waiter is admitted
+        assert scheduler.in_flight == 1
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert order == [f"dev {i}" for i in range(10)]
+    assert scheduler.in_flight == 0
@@ -0,0 +1,25 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import random
+
+from crispo.metrics.floats import FloatDict
+from crispo.trainer.example_scores import ExampleScoreSums, lowest
+
+
+def test_lowest_matches_stable_sort():
+    rng = random.Random(0)
+    for _ in range(100):
+        values = [rng.randint(0, 5) / 5 for _ in range(rng.randint(1, 30))]
+        k = rng.randint(0, 35)
+        expected = sorted(range(len(values)), key=values.__getitem__)[:k]
+        assert lowest(values, k).tolist() == expected
+
+
+def test_running_sums():
+    sums = ExampleScoreSums(num_examples=2)
+    sums.add([FloatDict(1.0, x=1.0), FloatDict(0.0, x=0.0)])
+    sums.start_step()
+    sums.add([1.0, 0.5])
+    assert sums.step_sums.tolist() == [1.0, 0.5]
+    assert sums.total_sums.tolist() == [2.0, 0.5]
@@ -0,0 +1,48 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import random
+import statistics
+from collections import defaultdict
+
+from crispo.metrics.accuracy import Accuracy
+from crispo.metrics.floats import FloatDict
+from crispo.metrics.metric import MetricDict
+from crispo.trainer.leaderboard import Leaderboard
+
+
+def brute_force_ranks(prompt_score_pairs, metric):
+    metric_scores = defaultdict(list)
+    for score in prompt_score_pairs.values():
+        for name, value in score.scores.items():
+            metric_scores[name].append(value)
+    ranks = dict()
+    for prompt, score in prompt_score_pairs.items():
+        ranks[prompt] = statistics.mean(
+            sorted(values, key=metric[name].key, reverse=True).index(score.scores[name])
+            for name, values in metric_scores.items()
+        )
+    return ranks
+
+
+def test_average_ranks():
+    rng = random.Random(0)
+    metric = MetricDict(a=Accuracy(), b=Accuracy(), primary="rank")
+    leaderboard = Leaderboard(metric)
+    scores = dict()
+    for i in range(50):
+        score = FloatDict(a=rng.randint(0, 9) / 10, b=rng.random())
+        scores[str(i)] = score
+        leaderboard[str(i)] = score
+        ranks = brute_force_ranks(scores, metric)
+        for prompt, rank in ranks.items():
+            assert leaderboard[prompt].scores["rank"] == rank
+    assert [p for p, _ in leaderboard.top(5)] == sorted(scores, key=ranks.get)[:5]
+
+
+def test_sorted_on_insertion():
+    leaderboard = Leaderboard(Accuracy())
+    for prompt, score in [("a", 0.5), ("b", 0.7), ("c", 0.5), ("a", 0.9)]:
+        leaderboard[prompt] = score
+    assert leaderboard.items() == [("a", 0.9), ("b", 0.7), ("c", 0.5)]
+    assert leaderboard.top(1) == [("a", 0.9)] and "c" in leaderboard
@@ -0,0 +1,288 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from crispo.llms import (
+    LargeLanguageModel,
+    TYPE_PROMPT,
+    FailedGeneration,
+    PrefixedPrompt,
+    RetryPolicy,
+    is_retryable,
+)
+from crispo.llms.cache import GenerationCache
+from crispo.llms.local import LocalLLM
+from crispo.llms.openai_compatible import OpenAICompatibleError
+
+
+class EchoLLM(LargeLanguageModel):
+    def __init__(self, temperature: float = 0.0, **kwargs) -> None:
+        super().__init__(temperature=temperature, **kwargs)
+        self.model_name = "echo"
+        self.calls = 0
+
+    def generate(self, prompt: TYPE_PROMPT) -> str:
+        self.calls += 1
+        return f"echo: {prompt}"
+
+
+def test_cache_hit(tmp_path):
+    llm = EchoLLM()
+    llm.cache = GenerationCache(str(tmp_path / "cache.db"))
+    assert llm.batch_generate(["a", "b"], desc=None) == ["echo: a", "echo: b"]
+    assert llm.batch_generate(["a", "b"], desc=None) == ["echo: a", "echo: b"]
+    assert llm.calls == 2
+    assert llm.cache.hits == 2 and llm.cache.misses == 2
+
+
+def test_cache_skips_failures(tmp_path):
+    llm = FlakyLLM(failures=1, cache=GenerationCache(str(tmp_path / "cache.db")))
+    generations = llm.batch_generate(["bad", "a"], desc=None, return_exceptions=True)
+    assert isinstance(generations[0], FailedGeneration)
+    llm.cache.put(llm, "empty", "")
+    assert len(llm.cache) == 1
+    assert llm.batch_generate(["bad"], desc=None) == ["echo: bad"]
+
+
+def test_cache_skips_sampling(tmp_path):
+    llm = EchoLLM(temperature=1.0)
+    llm.cache = GenerationCache(str(tmp_path / "cache.db"))
+    llm.batch_generate(["a"], desc=None)
+    llm.batch_generate(["a"], desc=None)
+    assert llm.calls == 2
+    assert len(llm.cache) == 0
+
+
+def test_cache_evicts_by_size(tmp_path):
+    llm = EchoLLM()
+    cache = GenerationCache(str(tmp_path / "cache.db"), max_size=20)
+    for prompt in ["a", "b", "c"]:
+        cache.put(llm, prompt, "0123456789")
+    assert len(cache) == 2
+    assert cache.get(llm, "a") is None
+    assert cache.get(llm, "c") == "0123456789"
+
+
+def test_cache_deletes_expired(tmp_path):
+    llm = EchoLLM()
+    cache = GenerationCache(str(tmp_path / "cache.db"), max_age=0.05)
+    cache.put(llm, "a", "x")
+    time.sleep(0.1)
+    assert cache.get(llm, "a") is None
+    assert len(cache) == 0 and cache.misses == 1
+
+
+CACHE_WRITER = """
+import sys
+
+from crispo.llms import LargeLanguageModel
+from crispo.llms.cache import GenerationCache
+
+
+class EchoLLM(LargeLanguageModel):
+    def generate(self, prompt):
+        return f"echo: {prompt}"
+
+
+# The same cache keys as the EchoLLM of the tests
+llm = EchoLLM(cache=GenerationCache(sys.argv[1]))
+llm.model_name = "echo"
+llm.batch_generate([str(i) for i in range(10)], desc=None)
+# Neither flushed nor closed, committed at exit
+llm.cache.put(llm, "last", "echo: last")
+"""
+
+
+def test_cache_persists_across_processes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    subprocess.run(
+        [sys.executable, "-c", CACHE_WRITER, path],
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    llm = EchoLLM()
+    cache = GenerationCache(path)
+    assert len(cache) == 11
+    assert cache.get(llm, "3") == "echo: 3"
+    assert cache.get(llm, "last") == "echo: last"
+
+
+class FlakyLLM(EchoLLM):
+    def __init__(self, failures: int, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.error = None
+
+    def generate(self, prompt: TYPE_PROMPT) -> str:
+        if prompt == "bad" and self.failures:
+            self.failures -= 1
+            raise self.error or ValueError(prompt)
+        return super().generate(prompt)
+
+
+def test_batch_generate_retries_failed_only():
+    llm = FlakyLLM(failures=1)
+    generations = llm.batch_generate(
+        ["a", "bad", "b"], desc=None, retry_policy=RetryPolicy(delay=0)
+    )
+    assert generations == ["echo: a", "echo: bad", "echo: b"]
+    assert llm.calls == 3
+
+
+def test_batch_generate_failure_placeholder():
+    llm = FlakyLLM(failures=99)
+    generations = llm.batch_generate(
+        ["a", "bad"],
+        desc=None,
+        return_exceptions=True,
+        retry_policy=RetryPolicy(delay=0),
+    )
+    assert generations[0] == "echo: a"
+    assert isinstance(generations[1], FailedGeneration) and generations[1] == ""
+    assert isinstance(generations[1].error, ValueError)
+    with pytest.raises(ValueError):
+        llm.batch_generate(["bad"], desc=None)
+
+
+def test_client_errors_not_retried():
+    llm = FlakyLLM(failures=99)
+    llm.error = ClientError(
+        {"Error": {"Code": "ValidationException", "Message": "Malformed input"}},
+        "InvokeModel",
+    )
+    generations = llm.batch_generate(
+        ["bad"], desc=None, return_exceptions=True, retry_policy=RetryPolicy(delay=0)
+    )
+    assert isinstance(generations[0].error, ClientError)
+    assert llm.failures == 98
+    assert is_retryable(ClientError({"Error": {"Code": "ThrottlingException"}}, ""))
+    assert not is_retryable(OpenAICompatibleError(400, "Bad request"))
+    assert is_retryable(OpenAICompatibleError(429, "Too many requests"))
+    assert is_retryable(ValueError())
+
+
+class StopLLM(EchoLLM):
+    supports_stop_sequences = True
+
+    def generate(self, prompt: TYPE_PROMPT, stop_sequences=None) -> str:
+        return f"{super().generate(prompt)} {stop_sequences}"
+
+
+def test_stop_sequences_override():
+    # Backends without per-request stop sequences get the completion truncated
+    assert EchoLLM().batch_generate(["a:b", "c"], desc=None, stop_sequences=[":"]) == [
+        "echo",
+        "echo",
+    ]
+    assert StopLLM().batch_generate(["a"], desc=None, stop_sequences=["x"]) == [
+        "echo: a ['x']"
+    ]
+    assert StopLLM().batch_generate(["a"], desc=None) == ["echo: a None"]
+    assert EchoLLM().batch_generate(["a"], desc=None, stop_sequences=()) == ["echo: a"]
+
+
+class PrefixCachingLLM(EchoLLM):
+    caches_prefixes = True
+
+    def __init__(self) -> None:
+        super().__init__(temperature=1.0)
+        self.events = []
+
+    async def agenerate(self, prompt: TYPE_PROMPT, stop_sequences=None) -> str:
+        self.events.append(("start", str(prompt)))
+        await asyncio.sleep(0.01)
+        self.events.append(("end", str(prompt)))
+        return f"echo: {prompt}"
+
+
+def test_cached_prefix_written_once():
+    llm = PrefixCachingLLM()
+    prompts = [
+        PrefixedPrompt(f"Task {t}: {x}", f"Task {t}: ") for t in "ab" for x in range(3)
+    ]
+    assert llm.batch_generate(prompts, desc=None) == [f"echo: {p}" for p in prompts]
+    # The first request of each prefix runs alone, the two prefixes in parallel
+    for prefix in ["Task a", "Task b"]:
+        events = [event for event, prompt in llm.events if prompt.startswith(prefix)]
+        assert events[:3] == ["start", "end", "start"]
+    assert [event for event, _ in llm.events[:2]] == ["start", "start"]
+    llm.events.clear()
+    prompt = PrefixedPrompt("Meta", "Meta")
+    assert asyncio.run(llm.agenerate_samples(prompt, 3)) == ["echo: Meta"] * 3
+    assert [event for event, _ in llm.events] == ["start", "end"] + ["start"] * 2 + [
+        "end"
+    ] * 2
+
+
+class StreamingLLM(EchoLLM):
+    def __init__(self) -> None:
+        super().__init__()
+        self.streaming = True
+        self.num_chunks = 0
+
+    async def stream_async(self, prompt: TYPE_PROMPT):
+        for chunk in ["Sure, <summary>", "short", "</summary>", " Some", " commentary"]:
+            self.num_chunks += 1
+            yield chunk
+
+
+def test_streaming_stops_at_closing_tag():
+    llm = StreamingLLM()
+    assert llm.batch_generate(["a"], desc=None, stop_tag="summary") == [
+        "Sure, <summary>short</summary>"
+    ]
+    assert llm.num_chunks == 3
+    assert len(llm.first_token_latencies) == 1
+
+
+class StragglingLLM(EchoLLM):
+    async def agenerate(self, prompt: TYPE_PROMPT, stop_sequences=None) -> str:
+        self.calls += 1
+        # The first request for "slow" is stuck, its duplicate is not
+        await asyncio.sleep(10 if prompt == "slow" and self.calls == 21 else 0.01)
+        return f"echo: {prompt}"
+
+
+def test_hedging():
+    llm = StragglingLLM().use_hedging(max_extra_load=0.1)
+    # The hedge takes a concurrency slot of its own
+    llm.concurrency = 2
+    assert llm.batch_generate(["a"] * 20, desc=None) == ["echo: a"] * 20
+    assert llm.batch_generate(["slow"], desc=None) == ["echo: slow"]
+    assert llm.hedger.stats["fired"] == llm.hedger.stats["won"] == 1
+    # The cancelled primary is recorded, only the hedge is not
+    assert len(llm.hedger.latencies) == 21
+    assert llm.hedger.latencies[-1] > sorted(llm.hedger.latencies)[10]
+    llm.temperature = 1.0
+    llm.batch_generate(["a"], desc=None)
+    assert llm.hedger.num_requests == 21
+
+
+class BatchedLLM(LocalLLM):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def generate_batch(self, prompts):
+        self.batches.append(prompts)
+        return [f"echo: {prompt}" for prompt in prompts]
+
+
+def test_micro_batching():
+    assert BatchedLLM(max_batch_size=4).concurrency == 20
+    llm = BatchedLLM(max_batch_size=4, max_wait=0.05, max_pending=8)
+    assert llm.concurrency == 12
+    prompts = ["abcd" * (i * 7 % 13 + 1) for i in range(20)]
+    assert llm.batch_generate(prompts, desc=None) == [f"echo: {p}" for p in prompts]
+    assert max(len(batch) for batch in llm.batches) == 4
+    assert llm.batcher.stats["mean_batch_size"] > 2
+    for batch in llm.batches:
+        assert [len(p) for p in batch] == sorted(len(p) for p in batch)
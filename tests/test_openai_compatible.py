@@ -0,0 +1,108 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from crispo.llms.openai_compatible import OpenAICompatible, OpenAICompatibleError
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.bodies.append(body)
+        self.server.ports.add(self.client_address[1])
+        prompt = body["messages"][0]["content"]
+        if prompt == "throttled" and self.server.throttles:
+            self.server.throttles -= 1
+            self.reply(429, {"error": {"message": "Too many requests"}})
+        elif prompt == "invalid":
+            self.reply(400, {"error": {"message": "Invalid request"}})
+        else:
+            choices = [
+                {
+                    "index": i,
+                    "message": {"role": "assistant", "content": f" {prompt} {i}"},
+                }
+                for i in reversed(range(body["n"]))
+            ]
+            self.reply(200, {"choices": choices})
+
+    def reply(self, status, payload):
+        out = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.bodies, server.ports, server.throttles = [], set(), 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def make_llm(server, **kwargs):
+    llm = OpenAICompatible(
+        "stub", base_url=f"http://127.0.0.1:{server.server_port}/v1", **kwargs
+    )
+    llm.client.throttling_wait = 0
+    return llm
+
+
+def test_generate(stub_server):
+    llm = make_llm(stub_server, concurrency=2)
+    assert llm.batch_generate(["a", "b", "c", "d"], desc=None) == [
+        "a 0",
+        "b 0",
+        "c 0",
+        "d 0",
+    ]
+    # Keep-alive connections are reused
+    assert len(stub_server.ports) <= 2
+    assert stub_server.bodies[0]["model"] == "stub"
+    assert stub_server.bodies[0]["temperature"] == 0.0
+    assert "top_k" not in stub_server.bodies[0]
+
+
+def test_n_samples(stub_server):
+    llm = make_llm(stub_server)
+    assert asyncio.run(llm.agenerate_samples("a", 3)) == ["a 0", "a 1", "a 2"]
+    assert len(stub_server.bodies) == 1 and stub_server.bodies[0]["n"] == 3
+
+
+def test_retries(stub_server):
+    llm = make_llm(stub_server)
+    stub_server.throttles = 2
+    assert llm.generate("throttled") == "throttled 0"
+    assert len(stub_server.bodies) == 3
+    with pytest.raises(OpenAICompatibleError):
+        llm.generate("invalid")
+    assert len(stub_server.bodies) == 4
+
+
+def test_sessions_closed(stub_server):
+    llm = make_llm(stub_server)
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(llm.agenerate("a")) == "a 0"
+    session = llm.client.session
+    # The session of the previous loop is closed on it
+    assert asyncio.run(llm.agenerate("b")) == "b 0"
+    assert session.closed and llm.client.session is not session
+    loop.run_until_complete(llm.agenerate("c"))
+    llm.client.close()
+    assert llm.client.session.closed
+    loop.close()
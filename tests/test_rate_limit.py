@@ -0,0 +1,58 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+
+import pytest
+
+from crispo.llms import LargeLanguageModel, TYPE_PROMPT
+from crispo.llms.rate_limit import RateLimiter, TokenBucket, estimate_num_tokens
+
+
+def test_estimate_num_tokens():
+    assert estimate_num_tokens("abcdefgh") == 2
+    assert estimate_num_tokens([{"role": "user", "content": "abcdefgh"}]) == 2
+    assert estimate_num_tokens(None) == 0
+
+
+def test_token_bucket_overdraw():
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.reserve(2) == 0
+    assert 0.9 < bucket.reserve(1) <= 1
+    bucket.refund(1)
+    assert bucket.reserve(1) <= 1
+
+
+class FailingLLM(LargeLanguageModel):
+    def __init__(self) -> None:
+        super().__init__(max_new_tokens=100)
+        self.model_name = "failing"
+
+    def generate(self, prompt: TYPE_PROMPT) -> str:
+        raise ValueError(prompt)
+
+
+def test_failed_request_refunded():
+    llm = FailingLLM().use_rate_limit(tokens_per_minute=1000)
+    with pytest.raises(ValueError):
+        asyncio.run(llm.generate_async("abcdefgh"))
+    assert llm.rate_limiter.num_tokens == 0
+    assert llm.rate_limiter.tokens.available == pytest.approx(1000)
+    assert llm.rate_limiter.network_time > 0
+
+
+def test_cancelled_reservation_refunded():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=60)
+    limiter.tokens.reserve(60)
+
+    async def cancel():
+        task = asyncio.ensure_future(limiter.acquire(30))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel())
+    assert limiter.num_requests == 0 and limiter.num_tokens == 0
+    assert limiter.tokens.available > -1
+    assert limiter.requests.available == pytest.approx(60)
@@ -0,0 +1,119 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import random
+
+import numpy as np
+import pytest
+from rouge_score.rouge_scorer import RougeScorer
+
+from experiments.summarization.metrics.fast_rouge import (
+    FastRougeScorer,
+    ngram_keys,
+    score_ngrams,
+)
+
+ROUGE_TYPES = ["rouge1", "rouge2", "rouge3", "rougeL", "rougeLsum"]
+WORDS = [
+    "the",
+    "a",
+    "cat",
+    "cats",
+    "running",
+    "runs",
+    "ran",
+    "generously",
+    "generous",
+    "hearing",
+    "heard",
+    "council",
+    "councils",
+    "approved",
+    "approves",
+    "2024",
+    "$5",
+    "U.S.",
+    "co-operation",
+    "naïve",
+    "",
+    "...",
+]
+
+
+def random_text(rng: random.Random) -> str:
+    sents = [
+        " ".join(rng.choices(WORDS, k=rng.randint(0, 15))) + rng.choice([".", "!", ""])
+        for _ in range(rng.randint(0, 5))
+    ]
+    return "\n".join(sents)
+
+
+@pytest.mark.parametrize("use_stemmer", [True, False])
+def test_parity(use_stemmer):
+    rng = random.Random(0)
+    expected = RougeScorer(ROUGE_TYPES, use_stemmer=use_stemmer)
+    actual = FastRougeScorer(ROUGE_TYPES, use_stemmer=use_stemmer)
+    for _ in range(300):
+        target, prediction = random_text(rng), random_text(rng)
+        expected_scores = expected.score(target, prediction)
+        actual_scores = actual.score(target, prediction)
+        for rouge_type in ROUGE_TYPES:
+            assert actual_scores[rouge_type] == pytest.approx(
+                expected_scores[rouge_type]
+            ), (rouge_type, target, prediction)
+
+
+def test_score_multi():
+    targets = ["The cats ran home.", "A council approved it.", ""]
+    scores = FastRougeScorer(["rouge1", "rougeL"], use_stemmer=True).score_multi(
+        targets, "The council approves."
+    )
+    expected = RougeScorer(["rouge1", "rougeL"], use_stemmer=True).score_multi(
+        targets, "The council approves."
+    )
+    assert scores == expected
+
+
+def test_unpacked_ngrams():
+    # Ids too large to pack 3 of them into 64 bits are counted as rows
+    target = np.array([2**30, 1, 2**30, 1, 2**30], dtype=np.int64)
+    prediction = np.array([1, 2**30, 1, 7], dtype=np.int64)
+    assert ngram_keys(target, 3, 31).shape == (3, 3)
+    score = score_ngrams(target, prediction, 3)
+    assert score.precision == 1 / 2 and score.recall == 1 / 3
+
+
+def test_invalid_rouge_type():
+    with pytest.raises(ValueError):
+        FastRougeScorer(["rouge0"])
+
+
+def test_summ_multi_metrics_cache(monkeypatch):
+    from experiments.summarization.metrics import summ_multi_metrics
+
+    calls = []
+
+    def sent_tokenize(text):
+        calls.append(text)
+        return [s + "." for s in text.split(". ") if s]
+
+    # The punkt models of nltk may not be downloaded
+    monkeypatch.setattr(summ_multi_metrics, "sent_tokenize", sent_tokenize)
+    monkeypatch.setattr(summ_multi_metrics, "word_tokenize", str.split)
+    metric = summ_multi_metrics.SummMultiMetrics(primary="rouge1f", cache_size=2)
+    golds = ["The council approved it. The cats ran home", "Hearing. Heard", "A cat"]
+    for prompt in range(3):
+        preds = [f"The council approves {prompt}. Cats run", "Heard it"]
+        scores = metric.score_batch(preds, golds[:2])
+        assert len(calls) == 2 * (prompt + 1) + 2
+    score = scores[0]
+    assert score["n_sent"] == 2 and score["n_sent_diff"] == 0
+    assert score["n_word"] == 6 and score["n_word_diff"] == -2
+    expected = RougeScorer(["rouge1"], use_stemmer=True).score(
+        "The council approved it.\nThe cats ran home.",
+        "The council approves 2.\nCats run.",
+    )
+    assert score["rouge1f"] == pytest.approx(expected["rouge1"].fmeasure * 100)
+    # Bounded
+    metric.score("A cat", golds[2])
+    assert list(metric._gold_analyses) == golds[1:]
@@ -0,0 +1,271 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: CC-BY-NC-4.0
+
+import asyncio
+import itertools
+import random
+import threading
+from dataclasses import dataclass
+
+import pytest
+
+from crispo.llms import LargeLanguageModel, TYPE_PROMPT
+from crispo.metrics.accuracy import Accuracy
+from crispo.metrics.metric import MetricDict
+from crispo.optimizer.meta_prompt import MetaPrompt
+from crispo.task.critique import CritiquePrompt
+from crispo.task.example import Example
+from crispo.task.prompt import TaskPrompt
+from crispo.trainer.racing import RacingPolicy
+from crispo.trainer.trainer import Trainer
+from crispo.utilities.prompt_util import extract_xml_tag
+from crispo.utilities.time_util import CountdownTimer
+
+
+@dataclass(eq=True, frozen=True)
+class LengthTaskPrompt(TaskPrompt):
+    output_tag = "answer"
+
+    def fill(self, x) -> str:
+        return f"{self.prompt}\n{x}"
+
+    def parse(self, generation: str):
+        return extract_xml_tag(generation, self.output_tag)
+
+
+class LengthMetaPrompt(MetaPrompt):
+    def fill(self, prompt_score_pairs, few_shot_examples, **kwargs) -> str:
+        return "Write a prompt." + "".join(e.x for e in few_shot_examples or [])
+
+    def parse(self, generation: str) -> TaskPrompt:
+        return LengthTaskPrompt(extract_xml_tag(generation, "prompt"))
+
+
+class FirstPredictionCritiquePrompt(CritiquePrompt):
+    def fill(self, prompt, predictions, few_shot_examples) -> str:
+        return f"Critique {predictions[0]}"
+
+    def parse(self, generation: str):
+        return generation
+
+
+class ToyLLM(LargeLanguageModel):
+    """
+    Answers whether the instruction is longer than the input number, and proposes instructions of growing length.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.counter = itertools.count(1)
+        self.counter_lock = threading.Lock()
+        self.calls = 0
+        self.meta_calls = 0
+
+    def generate(self, prompt: TYPE_PROMPT) -> str:
+        self.calls += 1
+        if prompt.startswith("Critique"):
+            return prompt
+        if prompt.startswith("Write a prompt."):
+            self.meta_calls += 1
+            prompt, _, request = prompt.partition("\n\nRepeat the above ")
+            num_candidates = int(request.split()[0]) if request else 1
+            shots = sum(map(int, prompt[len("Write a prompt.") :]))
+            with self.counter_lock:
+                candidates = [
+                    f"<prompt>{'a' * (next(self.counter) + shots % 3)}</prompt>"
+                    for _ in range(num_candidates)
+                ]
+            if num_candidates == 1:
+                return candidates[0]
+            return "".join(f"<candidate>{c}</candidate>" for c in candidates)
+        instruction, x = prompt.rsplit("\n", 1)
+        return f"<answer>{int(len(instruction) > int(x))}</answer>"
+
+
+def fit(tmp_path, use_afit=False, trainer=None, **kwargs):
+    random.seed(0)
+    train = [Example(str(x), str(int(x < 5))) for x in range(10)]
+    dev = [Example(str(x), str(int(x < 3))) for x in range(10)]
+    llm = ToyLLM()
+    trainer = trainer or Trainer(str(tmp_path))
+    args = (train, dev, {LengthTaskPrompt("aa")}, LengthMetaPrompt(), llm, Accuracy())
+    kwargs = dict(
+        dict(
+            num_search_steps=2,
+            num_new_prompts_in_each_step=3,
+            num_few_shot_examples_in_meta_prompt=0,
+            dev_evaluation_per_n_steps=1,
+            save_every_n_steps=100,
+        ),
+        **kwargs,
+    )
+    if use_afit:
+        prompt_score_pairs, _ = asyncio.run(trainer.afit(*args, **kwargs))
+    else:
+        prompt_score_pairs, _ = trainer.fit(*args, **kwargs)
+    return dict((str(p), s) for p, s in prompt_score_pairs.items()), llm.calls
+
+
+def test_flatten_evaluation(tmp_path):
+    serial = fit(tmp_path / "serial")
+    flattened = fit(tmp_path / "flattened", flatten_evaluation=True)
+    assert serial == flattened
+    assert (tmp_path / "flattened" / "step-002" / "train-prompt-003.csv").is_file()
+
+
+def test_afit_matches_fit(tmp_path):
+    kwargs = dict(
+        critique_prompt=FirstPredictionCritiquePrompt(),
+        few_shot_selection_criteria="random",
+        num_few_shot_examples_in_meta_prompt=2,
+    )
+    assert fit(tmp_path / "fit", **kwargs) == fit(
+        tmp_path / "afit", use_afit=True, **kwargs
+    )
+
+
+class CrashingTrainer(Trainer):
+    def start_step(self, state, step, num_search_steps):
+        if step == 2:
+            raise KeyboardInterrupt()
+        return super().start_step(state, step, num_search_steps)
+
+
+def test_resume(tmp_path):
+    kwargs = dict(
+        few_shot_selection_criteria="random",
+        num_few_shot_examples_in_meta_prompt=2,
+        save_every_n_steps=1,
+    )
+    expected, expected_calls = fit(tmp_path / "full", **kwargs)
+    with pytest.raises(KeyboardInterrupt):
+        fit(tmp_path, trainer=CrashingTrainer(str(tmp_path)), **kwargs)
+    prompt_score_pairs, calls = fit(tmp_path, resume=True, **kwargs)
+    assert prompt_score_pairs == expected
+    # Only the last step is run again
+    assert calls < expected_calls / 2
+    assert (tmp_path / "step-000").is_dir() and (tmp_path / "step-002").is_dir()
+
+
+def test_race_drops_dominated_prompts(tmp_path):
+    llm = ToyLLM()
+    train = [Example(str(x), "1") for x in range(200)]
+    good, bad = LengthTaskPrompt("a" * 200), LengthTaskPrompt("a" * 100)
+    raced = Trainer(str(tmp_path)).race(
+        [good, bad],
+        train,
+        llm,
+        Accuracy(),
+        RacingPolicy(initial_size=10, value_range=1),
+    )
+    indices, (_, _, predictions), scores = raced[good]
+    assert indices == list(range(200)) and predictions == ["1"] * 200
+    assert len(raced[bad][0]) < 100
+    assert llm.calls < 300
+    # Dropped against the best score on the full train set
+    raced = Trainer(str(tmp_path)).race(
+        [good], train, llm, Accuracy(), RacingPolicy(initial_size=10, value_range=1), 2
+    )
+    assert len(raced[good][0]) == 10
+
+
+def test_dropped_prompts_not_selected(tmp_path):
+    trainer = Trainer(str(tmp_path))
+    full, dropped = LengthTaskPrompt("full"), LengthTaskPrompt("dropped")
+    state = trainer.init_state([], {full}, Accuracy())
+    state.prompt_score_pairs[full] = 0.5
+    # An optimistic estimate on a subset
+    state.prompt_score_pairs[dropped] = 0.9
+    state.partial_train_prompts.add(dropped)
+    state.prompt_steps = {full: 0, dropped: 0}
+    trainer.finish_train_evaluation(state, Accuracy(), CountdownTimer(1))
+    assert state.best_prompt == full and state.best_score == 0.5
+    selected, _ = trainer.select_prompts_to_eval_dev(
+        state, [full, dropped], Accuracy(), None
+    )
+    assert [prompt for _, prompt in selected] == [full]
+
+
+def test_afit_rejects_racing(tmp_path):
+    with pytest.raises(ValueError):
+        fit(tmp_path, use_afit=True, racing=RacingPolicy())
+
+
+def test_racing_bounds_union():
+    policy = RacingPolicy(value_range=1)
+    values = [1, 0] * 10
+    lower, upper = policy.bounds(values, 100)
+    lower_union, upper_union = policy.bounds(values, 100, num_bounds=10)
+    assert lower_union < lower < 0.5 < upper < upper_union
+
+
+def test_multiple_candidates_per_meta_call(tmp_path):
+    meta_prompt = LengthMetaPrompt()
+    meta_prompt.num_candidates = 2
+    llm = ToyLLM()
+    new_prompts = Trainer(str(tmp_path)).generating_new_prompts(
+        meta_prompt=meta_prompt,
+        prompt_score_pairs=dict(),
+        train=[],
+        step_few_shot_example_scores=None,
+        accumulative_few_shot_example_scores=None,
+        critiques=dict(),
+        step_save_dir=str(tmp_path),
+        meta_llm=llm,
+        metric=Accuracy(),
+        few_shot_selection_criteria="random",
+        num_few_shot_examples_in_meta_prompt=0,
+        num_task_prompts_in_meta_prompt=20,
+        num_new_prompts_in_each_step=3,
+        refresh_meta_prompt_each_attempt=True,
+    )
+    assert len(new_prompts) == 3 and len(set(map(str, new_prompts))) == 3
+    assert llm.meta_calls == 2
+
+
+def test_retries_counted_per_meta_call(tmp_path):
+    meta_prompt = LengthMetaPrompt()
+    meta_prompt.num_candidates = 3
+    llm = ToyLLM()
+    # The 3 candidates of the first call are all known already
+    known = dict((LengthTaskPrompt("a" * n), 0.0) for n in range(1, 4))
+    new_prompts = Trainer(str(tmp_path)).generating_new_prompts(
+        meta_prompt=meta_prompt,
+        prompt_score_pairs=known,
+        train=[],
+        step_few_shot_example_scores=None,
+        accumulative_few_shot_example_scores=None,
+        critiques=dict(),
+        step_save_dir=str(tmp_path),
+        meta_llm=llm,
+        metric=Accuracy(),
+        few_shot_selection_criteria="random",
+        num_few_shot_examples_in_meta_prompt=0,
+        num_task_prompts_in_meta_prompt=20,
+        num_new_prompts_in_each_step=3,
+        refresh_meta_prompt_each_attempt=True,
+        max_retry=2,
+    )
+    assert [len(str(p)) for p in new_prompts] == [4, 5, 6]
+    assert llm.meta_calls == 2
+
+
+class BatchCountingAccuracy(Accuracy):
+    def __init__(self) -> None:
+        super().__init__()
+        self.batch_sizes = []
+
+    def score_batch(self, preds, golds, xs=None):
+        self.batch_sizes.append(len(preds))
+        return super().score_batch(preds, golds, xs)
+
+
+def test_evaluate_scores_in_one_batch(tmp_path):
+    dataset = [Example(str(x), str(int(x < 5))) for x in range(10)]
+    metric = MetricDict(accuracy=BatchCountingAccuracy())
+    overall_score, scores, predictions = Trainer(str(tmp_path)).evaluate(
+        LengthTaskPrompt("aa"), dataset, ToyLLM(), metric
+    )
+    assert metric["accuracy"].batch_sizes == [10]
+    assert scores == [metric.score(p, e.y) for p, e in zip(predictions, dataset)]
+    assert overall_score.scores["accuracy"] == 0.7